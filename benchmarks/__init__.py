@@ -0,0 +1,6 @@
+"""
+Package: benchmarks
+Performance benchmarks for the supplier service
+They need a Postgres database they are allowed to wipe, taken from
+DATABASE_URI (the test database by default).
+"""
@@ -0,0 +1,148 @@
+"""
+Benchmark: sync gunicorn workers against the async ASGI app
+
+Starts each server as a subprocess with the same number of workers and
+the read-through cache off, then drives a read-heavy mix (GET, plus a
+PUT every tenth request) over keep-alive connections at several
+concurrency levels and reports throughput and latency.
+
+    python -m benchmarks.bench_asgi --workers 2 --concurrency 1,16,64
+"""
+import os
+import time
+import random
+import socket
+import asyncio
+import argparse
+import subprocess
+from benchmarks.common import DATABASE_URI, setup_app, reset_schema, \
+    seed_suppliers
+
+SERVERS = {
+    "gunicorn": ["gunicorn", "--workers", "{workers}", "--bind",
+                 "127.0.0.1:{port}", "service:app"],
+    "uvicorn": ["gunicorn", "--workers", "{workers}", "--bind",
+                "127.0.0.1:{port}", "--worker-class",
+                "uvicorn.workers.UvicornWorker", "service.asgi:app"],
+}
+
+
+async def request(connection, method: str, path: str, body: bytes = b""):
+    """Sends one HTTP/1.1 request; returns the status and keep-alive flag"""
+    reader, writer = connection
+    head = "%s %s HTTP/1.1\r\nHost: bench\r\nContent-Length: %d\r\n" \
+        % (method, path, len(body))
+    if body:
+        head += "Content-Type: application/json\r\n"
+    writer.write(head.encode() + b"\r\n" + body)
+    status_line = await reader.readline()
+    length, keep_alive = 0, True
+    while True:
+        line = (await reader.readline()).strip().lower()
+        if not line:
+            break
+        name, _, value = line.partition(b":")
+        if name == b"content-length":
+            length = int(value)
+        elif name == b"connection" and value.strip() == b"close":
+            keep_alive = False
+    await reader.readexactly(length)
+    return int(status_line.split()[1]), keep_alive
+
+
+async def connect(port: int):
+    """Opens a connection with Nagle's algorithm off"""
+    connection = await asyncio.open_connection("127.0.0.1", port)
+    connection[1].get_extra_info("socket").setsockopt(
+        socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return connection
+
+
+async def client(port: int, ids: range, deadline: float, latencies: list):
+    """Runs requests on one connection until the deadline"""
+    connection = await connect(port)
+    count = 0
+    while time.perf_counter() < deadline:
+        path = "/suppliers/%d" % random.choice(ids)
+        count += 1
+        start = time.perf_counter()
+        if count % 10 == 0:
+            status, keep_alive = await request(
+                connection, "PUT", path, b'{"address":"%d Main St"}' % count)
+        else:
+            status, keep_alive = await request(connection, "GET", path)
+        latencies.append(time.perf_counter() - start)
+        if status >= 500:
+            raise RuntimeError("server answered %d" % status)
+        if not keep_alive:  # gunicorn sync workers close every connection
+            connection[1].close()
+            connection = await connect(port)
+    connection[1].close()
+
+
+async def drive(port: int, ids: range, concurrency: int, seconds: float):
+    """Runs concurrency clients and returns the latencies in seconds"""
+    latencies = []
+    deadline = time.perf_counter() + seconds
+    await asyncio.gather(*[client(port, ids, deadline, latencies)
+                           for _ in range(concurrency)])
+    return latencies
+
+
+def wait_for(port: int, timeout: float = 15.0) -> None:
+    """Waits until something accepts connections on port"""
+    async def probe():
+        _, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.close()
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            asyncio.run(probe())
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+
+
+def main():
+    """Runs the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--servers", default="gunicorn,uvicorn")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--concurrency", default="1,16,64")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    setup_app()
+    reset_schema()
+    seed_suppliers(args.rows)
+    ids = range(1, args.rows + 1)
+    env = dict(os.environ, DATABASE_URI=DATABASE_URI, CACHE_BACKEND="none")
+
+    print("%-9s %6s %10s %10s %10s" % ("server", "conns", "req/s",
+                                       "p50", "p99"))
+    for name in args.servers.split(","):
+        command = [part.format(workers=args.workers, port=args.port)
+                   for part in SERVERS[name]]
+        server = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.DEVNULL)
+        try:
+            wait_for(args.port)
+            for concurrency in [int(c) for c in args.concurrency.split(",")]:
+                latencies = sorted(asyncio.run(
+                    drive(args.port, ids, concurrency, args.seconds)))
+                print("%-9s %6d %10.0f %8.2fms %8.2fms" % (
+                    name, concurrency, len(latencies) / args.seconds,
+                    latencies[len(latencies) // 2] * 1000,
+                    latencies[int(len(latencies) * 0.99)] * 1000))
+        finally:
+            server.terminate()
+            server.wait()
+    reset_schema()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Benchmark: supplier creates with and without group commit
+
+Runs Supplier.create from many threads at once, as the request threads
+of one gunicorn worker (--threads) would. It reports the throughput,
+the create latency and the mean number of creates per commit, first with
+a commit per create and then in group-commit mode for each wait window.
+Give the pool a connection per thread:
+
+    DB_POOL_SIZE=16 python -m benchmarks.bench_group_commit --threads 16
+"""
+import time
+import argparse
+import threading
+import statistics
+from service import app
+from service.supplier import Supplier, db
+from service.group_commit import GroupCommitter
+from benchmarks.common import setup_app, reset_schema
+
+
+def run(threads: int, creates: int) -> dict:
+    """Creates threads * creates suppliers and times each create"""
+    latencies = []
+    barrier = threading.Barrier(threads + 1)
+
+    def worker():
+        samples = []
+        with app.app_context():
+            barrier.wait()
+            for index in range(creates):
+                supplier = Supplier(name="s%d" % index, email="e")
+                start = time.perf_counter()
+                supplier.create()
+                samples.append((time.perf_counter() - start) * 1000)
+            db.session.remove()
+        latencies.extend(samples)
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "throughput": len(latencies) / elapsed,
+        "median_ms": statistics.median(latencies),
+        "p99_ms": latencies[int(len(latencies) * 0.99)],
+        "max_ms": latencies[-1],
+    }
+
+
+def main():
+    """Runs the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--creates", type=int, default=200,
+                        help="creates per thread")
+    parser.add_argument("--waits", default="0,1,2,5",
+                        help="group-commit windows to try, in ms")
+    parser.add_argument("--max-batch", type=int, default=100)
+    args = parser.parse_args()
+
+    setup_app()
+    if app.config["DB_POOL_SIZE"] < args.threads:
+        parser.error("DB_POOL_SIZE must be at least --threads")
+    reset_schema()
+    print("synchronous_commit=%s, %d threads x %d creates" % (
+        db.session.execute("SHOW synchronous_commit").scalar(),
+        args.threads, args.creates))
+    print("%-14s %10s %9s %9s %9s %7s" % (
+        "mode", "creates/s", "median", "p99", "max", "batch"))
+    modes = [("commit each", None)] + [
+        ("group %gms" % float(wait), float(wait))
+        for wait in args.waits.split(",")]
+    for name, wait in modes:
+        reset_schema()
+        committer = None
+        if wait is not None:
+            committer = GroupCommitter(Supplier._flush_creates,
+                                       args.max_batch, wait / 1000.0)
+        Supplier.group_commit = committer
+        run(args.threads, 10)  # open the connections first
+        if committer is not None:
+            committer.batches = committer.items = 0
+        stats = run(args.threads, args.creates)
+        print("%-14s %10.0f %7.2fms %7.2fms %7.2fms %7.1f" % (
+            name, stats["throughput"], stats["median_ms"], stats["p99_ms"],
+            stats["max_ms"],
+            committer.stats()["mean_batch"] if committer else 1))
+    Supplier.group_commit = None
+    reset_schema()
+
+
+if __name__ == "__main__":
+    main()
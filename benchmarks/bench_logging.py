@@ -0,0 +1,108 @@
+"""
+Benchmark: logging overhead per request
+
+Times the logging that POST /suppliers does for one request (the body at
+INFO, then the new id), as the request thread pays it, for bodies with
+more and more products:
+
+    sync      the old setup: str.format of the parsed body, written by
+              the handler in the request thread
+    async     the queue of service/logs.py: the raw body, truncated to
+              LOG_BODY_MAX_BYTES and formatted as JSON by the listener
+    sampled   the same, logging the body of 1% of the requests
+
+Records go to a log file, as with gunicorn --error-logfile. It reports
+the wall time of the logging calls and the CPU time of the request
+thread alone (on few cores the listener's work shows up in the wall
+time), and for the async modes how long the listener took to write the
+records still queued at the end.
+
+    python -m benchmarks.bench_logging --products 10,1000,10000
+"""
+import os
+import json
+import time
+import logging
+import argparse
+import tempfile
+import statistics
+from flask import Flask, request
+from service.logs import AsyncQueueHandler, JsonFormatter, log_request_body
+
+TEXT_FORMAT = "[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s"
+
+
+def make_logger(name: str, handler: logging.Handler) -> logging.Logger:
+    """A logger of its own that writes to handler"""
+    logger = logging.getLogger("bench_logging." + name)
+    logger.handlers = [handler]
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    return logger
+
+
+def measure(func, repeat: int) -> tuple:
+    """Returns the median wall and thread CPU times of func in us"""
+    wall, cpu = [], []
+    for _ in range(repeat):
+        start, start_cpu = time.perf_counter(), time.thread_time()
+        func()
+        cpu.append((time.thread_time() - start_cpu) * 1e6)
+        wall.append((time.perf_counter() - start) * 1e6)
+    return statistics.median(wall), statistics.median(cpu)
+
+
+def main():
+    """Runs the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--products", default="10,1000,10000",
+                        help="product ids per request body")
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--max-bytes", type=int, default=1024)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config["LOG_BODY_MAX_BYTES"] = args.max_bytes
+    directory = tempfile.mkdtemp()
+    print("%-8s %9s %12s %12s %12s" % (
+        "mode", "products", "wall", "thread cpu", "listener"))
+    for count in map(int, args.products.split(",")):
+        body = json.dumps({"name": "Ken", "email": "ken@example.com",
+                           "products": list(range(1, count + 1))})
+        for mode in ("sync", "async", "sampled"):
+            path = os.path.join(directory, "%s-%d.log" % (mode, count))
+            target = logging.FileHandler(path)
+            if mode == "sync":
+                target.setFormatter(logging.Formatter(TEXT_FORMAT))
+                handler = target
+            else:
+                target.setFormatter(JsonFormatter())
+                handler = AsyncQueueHandler([target], args.repeat * 4)
+            logger = make_logger(mode, handler)
+            app.config["LOG_BODY_SAMPLE_RATE"] = \
+                0.01 if mode == "sampled" else 1.0
+
+            def log_request():
+                if mode == "sync":
+                    logger.info("request body: {}".format(request.json))
+                    logger.info("created new supplier with id {}".format(1))
+                else:
+                    log_request_body(logger)
+                    logger.info("created new supplier with id %s", 1)
+            with app.test_request_context("/suppliers", method="POST",
+                                          data=body,
+                                          content_type="application/json"):
+                request.get_json()  # the route has parsed it already
+                wall, cpu = measure(log_request, args.repeat)
+                start = time.perf_counter()
+                if mode != "sync":
+                    handler.stop()
+                drain = (time.perf_counter() - start) * 1000
+            target.close()
+            print("%-8s %9d %10.1fus %10.1fus %12s" % (
+                mode, count, wall, cpu,
+                "-" if mode == "sync" else "%.0fms" % drain))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Benchmark: which suppliers carry product X
+
+Times the product_id lookup used by GET /suppliers at several table
+sizes, both in the database (EXPLAIN ANALYZE execution time) and through
+Supplier.page, and prints the plan so the GIN index use is visible.
+
+    python -m benchmarks.bench_product_lookup --sizes 10000,100000,1000000
+"""
+import random
+import argparse
+from service.supplier import Supplier, db
+from benchmarks.common import setup_app, reset_schema, seed_suppliers, \
+    measure
+
+PRODUCT_SPACE = 100000
+
+
+def explain(product_ids, match_all):
+    """Returns the plan and execution time (ms) of one lookup"""
+    query = Supplier.query \
+        .filter(Supplier.product_filter(product_ids, match_all)) \
+        .order_by(Supplier.id).limit(100)
+    compiled = query.statement.compile(dialect=db.engine.dialect)
+    # a plain string goes to psycopg2 as-is, with its own bind params
+    lines = [row[0] for row in db.session.connection().execute(
+        "EXPLAIN ANALYZE " + str(compiled), compiled.params)]
+    execution = [line for line in lines if line.startswith("Execution Time")]
+    return lines, float(execution[0].split()[2])
+
+
+def main():
+    """Runs the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", default="10000,100000",
+                        help="comma separated table sizes")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    setup_app()
+    print("%10s %6s %12s %12s %12s" % (
+        "rows", "match", "db median", "page median", "page p99"))
+    for size in [int(size) for size in args.sizes.split(",")]:
+        reset_schema()
+        seed_suppliers(size, product_space=PRODUCT_SPACE)
+        for match_all, count in ((False, 1), (False, 5), (True, 2)):
+            def lookup():
+                ids = random.sample(range(1, PRODUCT_SPACE + 1), count)
+                return Supplier.page(100, product_ids=ids,
+                                     match_all=match_all)
+            db_times = sorted(
+                explain(random.sample(range(1, PRODUCT_SPACE + 1), count),
+                        match_all)[1]
+                for _ in range(args.repeat // 10 or 1))
+            stats = measure(lookup, args.repeat)
+            db.session.remove()
+            print("%10d %6s %10.3fms %10.3fms %10.3fms" % (
+                size, "all" if match_all else "any%d" % count,
+                db_times[len(db_times) // 2],
+                stats["median_ms"], stats["p99_ms"]))
+        plan, _ = explain([42], False)
+        print("\n".join("    " + line for line in plan))
+    reset_schema()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Benchmark: ORM hydration against the read-only SupplierRecord model
+
+Reads the same page of suppliers with Supplier.page (ORM objects) and
+Supplier.page_records (Core SELECT, slotted records), serializes every
+row and reports CPU time and memory allocated per row.
+
+    python -m benchmarks.bench_read_model --rows 1000 --repeat 50
+"""
+import gc
+import argparse
+import tracemalloc
+from service.supplier import Supplier, db
+from benchmarks.common import setup_app, reset_schema, seed_suppliers, \
+    measure
+
+READERS = {
+    "orm": Supplier.page,
+    "record": Supplier.page_records,
+}
+
+
+def read_page(reader, rows: int) -> list:
+    """Reads and serializes one page, in a fresh session"""
+    page = [item.serialize_to_dict() for item in reader(rows)]
+    db.session.remove()
+    return page
+
+
+def allocations(reader, rows: int):
+    """Returns the bytes and blocks allocated to read one page"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    page = reader(rows)  # keep the page alive while measuring
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = after.compare_to(before, "filename")
+    size = sum(stat.size_diff for stat in stats)
+    blocks = sum(stat.count_diff for stat in stats)
+    del page
+    db.session.remove()
+    return size, blocks
+
+
+def main():
+    """Runs the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    setup_app()
+    reset_schema()
+    seed_suppliers(args.rows)
+    print("%-7s %12s %12s %12s %12s" % (
+        "reader", "median", "us/row", "bytes/row", "blocks/row"))
+    for name, reader in READERS.items():
+        stats = measure(lambda reader=reader: read_page(reader, args.rows),
+                        args.repeat)
+        size, blocks = allocations(reader, args.rows)
+        print("%-7s %10.2fms %12.2f %12.0f %12.1f" % (
+            name, stats["median_ms"],
+            stats["median_ms"] * 1000 / args.rows,
+            size / args.rows, blocks / args.rows))
+    reset_schema()
+
+
+if __name__ == "__main__":
+    main()
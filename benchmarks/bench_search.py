@@ -0,0 +1,62 @@
+"""
+Benchmark: GET /suppliers/search latency on a large table
+
+Seeds the table, then runs Supplier.search for a few type-ahead queries
+and reports their latency, the number of results and whether the plan
+reads ix_supplier_search (trigram with pg_trgm, full-text without).
+
+    python -m benchmarks.bench_search --rows 1000000 --repeat 50
+"""
+import argparse
+from service.supplier import Supplier, SEARCH_DOCUMENT, db
+from benchmarks.common import setup_app, reset_schema, seed_suppliers, \
+    measure
+
+# seeded rows all carry the words supplier, main, st, example and com, so
+# the last two queries complete a prefix of a word found in every row
+QUERIES = ("supplier 12345", "98765", "supplier4242@exa", "777 main")
+
+
+def plan(query: str) -> str:
+    """Returns the EXPLAIN of the search condition for query"""
+    if Supplier.search_backend == "trigram":
+        condition = ":query <% " + SEARCH_DOCUMENT
+    else:
+        words = query.replace("@", " ").split()
+        query = " & ".join(words[:-1] + [words[-1] + ":*"])
+        condition = ("to_tsvector('simple', %s) @@ "
+                     "to_tsquery('simple', :query)" % SEARCH_DOCUMENT)
+    rows = db.session.execute(
+        "EXPLAIN SELECT id FROM supplier WHERE " + condition,
+        {"query": query})
+    return "\n".join(row[0] for row in rows)
+
+
+def main():
+    """Runs the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    setup_app()
+    reset_schema()
+    seed_suppliers(args.rows, products_per_supplier=1)
+    Supplier.search("warm up", args.limit)
+    print("backend: %s, %d rows" % (Supplier.search_backend, args.rows))
+    print("%-18s %8s %10s %10s %6s" % (
+        "query", "results", "median", "p99", "index"))
+    for query in QUERIES:
+        stats = measure(lambda query=query: Supplier.search(
+            query, args.limit), args.repeat)
+        results = len(Supplier.search(query, args.limit))
+        print("%-18s %8d %8.2fms %8.2fms %6s" % (
+            query, results, stats["median_ms"], stats["p99_ms"],
+            "ix_supplier_search" in plan(query)))
+    db.session.remove()
+    reset_schema()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Benchmark: worker boot time for each DB_SCHEMA_MODE
+
+Imports the service in fresh interpreters, as a gunicorn worker does,
+and reports the process wall time, the time spent importing the service
+and the SQL statements it ran while booting.
+
+    python -m benchmarks.bench_startup --repeat 10
+"""
+import os
+import sys
+import time
+import json
+import argparse
+import statistics
+import subprocess
+from benchmarks.common import DATABASE_URI, setup_app, reset_schema
+from service.schema import create_schema
+
+BOOT = """
+import json, time
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+statements = []
+event.listen(Engine, "before_cursor_execute",
+             lambda *args: statements.append(1))
+start = time.perf_counter()
+import service
+print(json.dumps({"import_ms": (time.perf_counter() - start) * 1000,
+                  "statements": len(statements)}))
+"""
+
+
+def boot(mode: str) -> dict:
+    """Boots the service once in a new interpreter"""
+    env = dict(os.environ, DATABASE_URI=DATABASE_URI, DB_SCHEMA_MODE=mode)
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", BOOT], env=env,
+                            check=True, stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL)
+    sample = json.loads(result.stdout.decode().splitlines()[-1])
+    sample["wall_ms"] = (time.perf_counter() - start) * 1000
+    return sample
+
+
+def main():
+    """Runs the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--modes", default="auto,check,off")
+    args = parser.parse_args()
+
+    setup_app()
+    reset_schema()
+    create_schema()
+    print("%-6s %12s %12s %11s" % ("mode", "wall", "import", "statements"))
+    for mode in args.modes.split(","):
+        samples = [boot(mode) for _ in range(args.repeat)]
+        print("%-6s %10.1fms %10.1fms %11d" % (
+            mode,
+            statistics.median(sample["wall_ms"] for sample in samples),
+            statistics.median(sample["import_ms"] for sample in samples),
+            samples[-1]["statements"]))
+    reset_schema()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+"""
+Benchmark suite for the model and HTTP layers
+
+Times each case at every table size and product-array length and
+writes the results as JSON; compare flags cases whose median got slower
+between two runs (and exits with status 1 if any did).
+
+    python -m benchmarks.suite run --sizes 1000,100000 --products 10,1000 \\
+        -o before.json
+    python -m benchmarks.suite compare before.json after.json --threshold 10
+
+Model-only cases (validation, (de)serialization) do not touch the
+database and run once per product-array length, with rows = 0. The
+read-through cache is off except in the find_cached case.
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import subprocess
+from typing import Callable, Dict, List
+import sqlalchemy
+from service.cache import LRUCache, NullCache
+from service.supplier import Supplier, db
+from benchmarks.common import setup_app, reset_schema, seed_suppliers, \
+    measure
+
+PRODUCT_SPACE = 100000
+
+
+class Context:
+    """What a case needs: a table size, a product-array length and data"""
+
+    def __init__(self, app, rows: int, products: int):
+        self.client = app.test_client()
+        self.rows = rows
+        self.products = products
+        self.data = {
+            "name": "bench", "email": "bench@example.com",
+            "address": "1 Main St",
+            "products": random.sample(range(1, PRODUCT_SPACE + 1), products),
+        }
+        self.supplier = Supplier(**self.data)
+
+    def random_id(self) -> int:
+        """Returns the id of a seeded supplier"""
+        return random.randint(1, self.rows)
+
+
+def case_validate(ctx: Context):
+    """Supplier.__init__ and its checks"""
+    Supplier(**ctx.data)
+
+
+def case_deserialize(ctx: Context):
+    """Supplier.deserialize_from_dict"""
+    Supplier.deserialize_from_dict(ctx.data)
+
+
+def case_serialize_dict(ctx: Context):
+    """Supplier.serialize_to_dict"""
+    ctx.supplier.serialize_to_dict()
+
+
+def case_serialize_json(ctx: Context):
+    """Supplier.serialize_to_json"""
+    ctx.supplier.serialize_to_json()
+
+
+def case_create(ctx: Context):
+    """Supplier.create"""
+    Supplier(**ctx.data).create()
+    db.session.remove()
+
+
+def case_find(ctx: Context):
+    """Supplier.find, from the database"""
+    Supplier.find(ctx.random_id())
+    db.session.remove()
+
+
+def case_find_cached(ctx: Context):
+    """Supplier.find, read through a warm cache"""
+    Supplier.find(ctx.random_id() % min(ctx.rows, 100) + 1)
+    db.session.remove()
+
+
+def case_update(ctx: Context):
+    """Supplier.find then update"""
+    Supplier.find(ctx.random_id()).update({"address": str(time.time())})
+    db.session.remove()
+
+
+def case_route_read(ctx: Context):
+    """GET /suppliers/<id>"""
+    check(ctx.client.get("/suppliers/%d" % ctx.random_id()), 200)
+
+
+def case_route_list(ctx: Context):
+    """GET /suppliers, one page of 100"""
+    check(ctx.client.get("/suppliers?limit=100"), 200)
+
+
+def case_route_create(ctx: Context):
+    """POST /suppliers"""
+    check(ctx.client.post("/suppliers", json=ctx.data), 201)
+
+
+def case_route_update(ctx: Context):
+    """PUT /suppliers/<id>"""
+    check(ctx.client.put("/suppliers/%d" % ctx.random_id(),
+                         json={"address": str(time.time())}), 200)
+
+
+def check(response, expected: int) -> None:
+    """Fails the benchmark on an unexpected status"""
+    if response.status_code != expected:
+        raise RuntimeError("%s answered %d" % (response.request.path,
+                                               response.status_code))
+
+
+# case name -> (function, whether it uses the supplier table)
+CASES: Dict[str, tuple] = {
+    "validate": (case_validate, False),
+    "deserialize": (case_deserialize, False),
+    "serialize_dict": (case_serialize_dict, False),
+    "serialize_json": (case_serialize_json, False),
+    "create": (case_create, True),
+    "find": (case_find, True),
+    "find_cached": (case_find_cached, True),
+    "update": (case_update, True),
+    "route_read": (case_route_read, True),
+    "route_list": (case_route_list, True),
+    "route_create": (case_route_create, True),
+    "route_update": (case_route_update, True),
+}
+
+
+def run_case(name: str, func: Callable, ctx: Context, repeat: int) -> dict:
+    """Times one case and returns its result"""
+    Supplier.cache = NullCache()
+    if name == "find_cached":
+        Supplier.cache = LRUCache()
+        for supplier_id in range(1, min(ctx.rows, 100) + 1):
+            Supplier.find(supplier_id)
+        db.session.remove()
+    stats = measure(lambda: func(ctx), repeat)
+    stats.update({"case": name, "rows": ctx.rows,
+                  "products": ctx.products})
+    return stats
+
+
+def metadata() -> dict:
+    """Describes the environment the results come from"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], check=True,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+        ).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "sqlalchemy": sqlalchemy.__version__,
+        "postgres": db.session.execute("SHOW server_version").scalar(),
+        "machine": platform.machine(),
+    }
+
+
+def run(args) -> None:
+    """Runs the selected cases and writes the results"""
+    app = setup_app()
+    cases = args.cases.split(",") if args.cases else list(CASES)
+    sizes = [int(size) for size in args.sizes.split(",")]
+    lengths = [int(length) for length in args.products.split(",")]
+    results: List[dict] = []
+    for products in lengths:
+        ctx = Context(app, 0, products)
+        for name in cases:
+            func, uses_table = CASES[name]
+            if not uses_table:
+                results.append(run_case(name, func, ctx, args.repeat))
+                report(results[-1])
+        for rows in sizes:
+            reset_schema()
+            seed_suppliers(rows, products, PRODUCT_SPACE)
+            ctx = Context(app, rows, products)
+            for name in cases:
+                func, uses_table = CASES[name]
+                if uses_table:
+                    results.append(run_case(name, func, ctx, args.repeat))
+                    report(results[-1])
+    reset_schema()
+    output = {"meta": metadata(), "results": results}
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(output, file, indent=2)
+    else:
+        json.dump(output, sys.stdout, indent=2)
+
+
+def report(result: dict) -> None:
+    """Prints one result to stderr as it completes"""
+    print("%-15s rows=%-8d products=%-6d median %9.3fms  p99 %9.3fms" % (
+        result["case"], result["rows"], result["products"],
+        result["median_ms"], result["p99_ms"]), file=sys.stderr)
+
+
+def compare(args) -> int:
+    """
+    Compares the medians of two runs
+    Returns 1 if a case is slower by more than threshold percent and by
+    more than min_ms milliseconds, 0 otherwise
+    """
+    def load(path: str) -> dict:
+        with open(path) as file:
+            return {(result["case"], result["rows"], result["products"]):
+                    result for result in json.load(file)["results"]}
+
+    base, head = load(args.base), load(args.head)
+    regressions = 0
+    print("%-15s %8s %8s %11s %11s %8s" % (
+        "case", "rows", "products", "base", "head", "change"))
+    for key in sorted(base.keys() & head.keys()):
+        before, after = base[key]["median_ms"], head[key]["median_ms"]
+        change = (after - before) / before * 100 if before else 0.0
+        flag = ""
+        if change > args.threshold and after - before > args.min_ms:
+            flag = "  REGRESSION"
+            regressions += 1
+        elif change < -args.threshold and before - after > args.min_ms:
+            flag = "  improved"
+        print("%-15s %8d %8d %9.3fms %9.3fms %+7.1f%%%s" % (
+            key + (before, after, change, flag)))
+    for key in sorted(base.keys() ^ head.keys()):
+        print("%-15s %8d %8d  only in %s" % (
+            key + (args.base if key in base else args.head,)))
+    print("%d regression(s)" % regressions)
+    return 1 if regressions else 0
+
+
+def main():
+    """Parses the command line"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    run_parser = commands.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("--sizes", default="1000,100000",
+                            help="comma separated table sizes")
+    run_parser.add_argument("--products", default="10,1000",
+                            help="comma separated product-array lengths")
+    run_parser.add_argument("--cases", default="",
+                            help="comma separated cases, all by default: "
+                            + ", ".join(CASES))
+    run_parser.add_argument("--repeat", type=int, default=200)
+    run_parser.add_argument("-o", "--output",
+                            help="results file, stdout by default")
+
+    compare_parser = commands.add_parser(
+        "compare", help="flag regressions between two runs")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("head")
+    compare_parser.add_argument("--threshold", type=float, default=10.0,
+                                help="percent slowdown that is flagged")
+    compare_parser.add_argument("--min-ms", type=float, default=0.01,
+                                help="ignore smaller absolute slowdowns")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -20,6 +20,86 @@ if 'VCAP_SERVICES' in os.environ:
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Connection pool of each worker (see service/pool.py)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# seconds before a connection is replaced, -1 to keep connections forever
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# test connections on checkout so failovers do not surface as errors
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "True") == "True"
+# per statement timeout in milliseconds, 0 for none
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+# let PgBouncer pool connections (transaction pooling) instead of the worker
+DB_PGBOUNCER = os.getenv("DB_PGBOUNCER", "False") == "True"
+
+# What a worker does with the schema at boot: auto (create the tables),
+# check (verify the version stamped by flask suppliers db-init) or off
+DB_SCHEMA_MODE = os.getenv("DB_SCHEMA_MODE", "auto")
+
+# Where product ids are stored: array (the products column) or table (one
+# row per product in supplier_product; see flask suppliers backfill-products)
+PRODUCT_STORAGE = os.getenv("PRODUCT_STORAGE", "array")
+
+# Product ids are checked against this table (e.g. catalog.product) when
+# set; ids are kept in memory and reloaded every PRODUCT_CATALOG_REFRESH s
+PRODUCT_CATALOG_TABLE = os.getenv("PRODUCT_CATALOG_TABLE", "")
+PRODUCT_CATALOG_COLUMN = os.getenv("PRODUCT_CATALOG_COLUMN", "id")
+PRODUCT_CATALOG_REFRESH = float(os.getenv("PRODUCT_CATALOG_REFRESH", "300"))
+
+# Group commit: queue concurrent creates of a worker (gunicorn --threads)
+# and write them with one INSERT and one commit (see service/group_commit.py)
+GROUP_COMMIT = os.getenv("GROUP_COMMIT", "False") == "True"
+GROUP_COMMIT_MAX_BATCH = int(os.getenv("GROUP_COMMIT_MAX_BATCH", "100"))
+GROUP_COMMIT_WAIT_MS = float(os.getenv("GROUP_COMMIT_WAIT_MS", "2"))
+
+# Number of rows written per multi-row INSERT by the bulk endpoint
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "1000"))
+
+# Page sizes for GET /suppliers
+LIST_DEFAULT_LIMIT = int(os.getenv("LIST_DEFAULT_LIMIT", "100"))
+LIST_MAX_LIMIT = int(os.getenv("LIST_MAX_LIMIT", "1000"))
+
+# Ids accepted by one multi-get (GET /suppliers?ids=, POST /suppliers/lookup)
+MULTI_GET_MAX_IDS = int(os.getenv("MULTI_GET_MAX_IDS", "1000"))
+
+# Results returned by GET /suppliers/search without a limit
+SEARCH_DEFAULT_LIMIT = int(os.getenv("SEARCH_DEFAULT_LIMIT", "10"))
+
+# Longest wait, in seconds, of a long-poll on GET /suppliers/changes?wait=;
+# each waiting request holds a worker thread and a database connection
+CHANGES_MAX_WAIT = float(os.getenv("CHANGES_MAX_WAIT", "30"))
+
+# Rows fetched per round trip by the streaming export
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+# Read-through cache under Supplier.find: none, lru (in-process, for a
+# single worker process only) or shared, in the Redis server at
+# CACHE_STORE_URL (e.g. redis://cache:6379/0; see service/cache.py)
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "none")
+CACHE_MAX_SIZE = int(os.getenv("CACHE_MAX_SIZE", "10000"))
+CACHE_TTL = float(os.getenv("CACHE_TTL", "60"))
+CACHE_STORE_URL = os.getenv("CACHE_STORE_URL", "")
+
+# JSON encoder for responses: auto (orjson if installed), orjson or json
+JSON_BACKEND = os.getenv("JSON_BACKEND", "auto")
+
+# On-demand profiling and slow-query log (see service/profiling.py)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/supplier-profiles")
+# log SQL statements slower than this many milliseconds, 0 for none
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "0"))
+
+# Logging (see service/logs.py): json or text lines, written by a
+# background thread from a queue of LOG_QUEUE_SIZE records; request bodies
+# are logged for LOG_BODY_SAMPLE_RATE of the requests, truncated to
+# LOG_BODY_MAX_BYTES
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_BODY_SAMPLE_RATE = float(os.getenv("LOG_BODY_SAMPLE_RATE", "1"))
+LOG_BODY_MAX_BYTES = int(os.getenv("LOG_BODY_MAX_BYTES", "1024"))
+
 # Secret for session management
 # SECRET_KEY = os.getenv("SECRET_KEY", "sup3r-s3cr3t")
 LOGGING_LEVEL = logging.INFO
@@ -0,0 +1,26 @@
+"""
+Gunicorn configuration for the supplier service
+    gunicorn --config gunicorn.conf.py service:app
+
+With --preload (preload_app) the app is imported once in the master and
+forked; the master's database connections are closed before each fork so
+that no worker inherits, and shares, a connection.
+"""
+import os
+import sys
+
+bind = "0.0.0.0:{}".format(os.getenv("PORT", "5000"))
+
+
+def child_exit(server, worker):
+    """Drops the metrics of a dead worker from the shared store"""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
+
+
+def pre_fork(server, worker):
+    """Closes the pooled connections a preloaded app opened in the master"""
+    supplier = sys.modules.get("service.supplier")
+    if supplier is not None and supplier.Supplier.app is not None:
+        supplier.db.get_engine(supplier.Supplier.app).dispose()
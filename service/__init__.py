@@ -5,30 +5,29 @@ This module creates and configures the Flask app and sets up the logging
 and SQL database
 """
 import sys
-import logging
-from flask import Flask
+import time
+
+boot_start = time.perf_counter()
+
+from flask import Flask  # noqa: E402
 # Import the rutes After the Flask app is created
-from . import supplier
+from . import supplier, schema  # noqa: E402
+from .metrics import init_metrics, BOOT_TIME  # noqa: E402
+from .profiling import init_profiling  # noqa: E402
+from .logs import init_logging  # noqa: E402
+
+imports_done = time.perf_counter()
 
 # Create Flask application
 app = Flask(__name__)
 app.config.from_object("config")
+init_metrics(app)
+init_profiling(app)
 
-# Set up logging for production
+# Set up logging for production: JSON lines written by a background thread
 print("Setting up logging for {}...".format(__name__))
-app.logger.propagate = False
-if __name__ != "__main__":
-    gunicorn_logger = logging.getLogger("gunicorn.error")
-    app.logger.handlers = gunicorn_logger.handlers
-    app.logger.setLevel(gunicorn_logger.level)
-    # Make all log formats consistent
-    formatter = logging.Formatter(
-        "[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s",
-        "%Y-%m-%d %H:%M:%S %z"
-    )
-    for handler in app.logger.handlers:
-        handler.setFormatter(formatter)
-    app.logger.info("Logging handler established")
+init_logging(app)
+app.logger.info("Logging handler established")
 
 app.logger.info(70 * "*")
 app.logger.info("  S U P P L I E R   S T O R E   "
@@ -36,10 +35,27 @@ app.logger.info("  S U P P L I E R   S T O R E   "
 app.logger.info(70 * "*")
 
 try:
-    supplier.init_db(app)  # make our sqlalchemy tables
+    supplier.init_db(app)
+    schema.prepare_schema(app.config["DB_SCHEMA_MODE"])
 except Exception as error:
     app.logger.critical("%s: Cannot continue", error)
     # gunicorn requires exit code 4 to stop spawning workers when they die
     sys.exit(4)
+database_done = time.perf_counter()
+
+# Import the routes and error handlers after the Flask app is created
+from . import routes, error_handlers  # noqa: F401, E402
+from .commands import suppliers_cli  # noqa: E402
+
+app.cli.add_command(suppliers_cli)
 
-app.logger.info("Service inititalized!")
+boot_done = time.perf_counter()
+BOOT_TIME.labels("imports").set(imports_done - boot_start)
+BOOT_TIME.labels("database").set(database_done - imports_done)
+BOOT_TIME.labels("total").set(boot_done - boot_start)
+app.logger.info("Service inititalized in %.1fms (imports %.1fms, "
+                "database %.1fms, schema mode %s)",
+                (boot_done - boot_start) * 1000,
+                (imports_done - boot_start) * 1000,
+                (database_done - imports_done) * 1000,
+                app.config["DB_SCHEMA_MODE"])
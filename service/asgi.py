@@ -0,0 +1,281 @@
+"""
+Async ASGI entry point for the supplier API
+
+Serves the same create, read and update routes as the Flask app, but
+on an event loop with a native async Postgres driver (asyncpg) and its
+connection pool, so a worker is not blocked during database round trips:
+
+    gunicorn -k uvicorn.workers.UvicornWorker -w 4 service.asgi:app
+
+(prefer this to uvicorn --workers, whose workers add ~40ms of Nagle
+delay to keep-alive responses here).
+
+Validation and serialization are the Supplier model's; validation runs
+in the thread pool, as the product catalog blocks on psycopg2. The
+connection pool is sized from the same DB_* settings as the sync
+workers. In PgBouncer mode asyncpg's prepared statement cache is turned
+off. This app reads past the supplier cache, but its updates invalidate
+it, which reaches the Flask workers with CACHE_BACKEND=shared (the Redis
+server at CACHE_STORE_URL); the other backends are private to each
+process. It reads and writes the products array column, so it refuses
+to start with PRODUCT_STORAGE=table.
+
+Needs the optional starlette, uvicorn and asyncpg packages.
+"""
+import json
+import contextlib
+from typing import Callable, Optional
+import asyncpg
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.exceptions import HTTPException
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Route
+import config
+from service import status
+from service.cache import NullCache, make_cache
+from service.supplier import Supplier
+from service.serializers import Serializer
+from service.supplier_exception import SupplierException, VersionConflict
+
+COLUMNS = "id, name, email, address, products, version"
+
+serializer = Serializer(config.JSON_BACKEND)
+
+
+async def create_pool(database_uri: str) -> asyncpg.pool.Pool:
+    """Creates the asyncpg pool from the DB_* settings"""
+    server_settings = {}
+    if config.DB_STATEMENT_TIMEOUT_MS:
+        server_settings["statement_timeout"] = \
+            str(config.DB_STATEMENT_TIMEOUT_MS)
+    return await asyncpg.create_pool(
+        database_uri,
+        min_size=1,
+        max_size=config.DB_POOL_SIZE + config.DB_MAX_OVERFLOW,
+        max_inactive_connection_lifetime=max(config.DB_POOL_RECYCLE, 0),
+        statement_cache_size=0 if config.DB_PGBOUNCER else 100,
+        server_settings=server_settings,
+    )
+
+
+######################################################################
+# Routes
+######################################################################
+async def create_supplier(request: Request) -> Response:
+    """ Creates a supplier and returns the supplier as a dict """
+    body = await read_json(request)
+    if "name" not in body:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "missing name")
+    supplier = await run_in_threadpool(
+        validate, Supplier.deserialize_from_dict, body)
+    row = await request.app.state.pool.fetchrow(
+        "INSERT INTO supplier (name, email, address, products) "
+        "VALUES ($1, $2, $3, $4) RETURNING " + COLUMNS,
+        supplier.name, supplier.email, supplier.address, supplier.products)
+    return supplier_response(row, status.HTTP_201_CREATED)
+
+
+async def read_supplier(request: Request) -> Response:
+    """
+    Returns the supplier with the provided supplier id
+    Honors If-None-Match with a bodiless 304 when the version is unchanged
+    """
+    supplier_id = request.path_params["supplier_id"]
+    row = await request.app.state.pool.fetchrow(
+        "SELECT " + COLUMNS + " FROM supplier WHERE id = $1", supplier_id)
+    if row is None:
+        raise not_found(supplier_id)
+    etag = '"%d"' % row["version"]
+    if etag_matches(request.headers.get("if-none-match"), etag, weak=True):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED,
+                        headers={"ETag": etag})
+    return supplier_response(row, status.HTTP_200_OK)
+
+
+async def update_supplier(request: Request) -> Response:
+    """
+    Updates a supplier with the provided supplier id in one UPDATE
+    Honors If-Match with 412 when the supplier is at another version
+    Values are checked by Supplier.check_changes, like the Flask PATCH
+    Returns the updated supplier
+    """
+    supplier_id = request.path_params["supplier_id"]
+    body = await read_json(request)
+    if not isinstance(body, dict):
+        raise HTTPException(status.HTTP_400_BAD_REQUEST,
+                            "a JSON object is expected")
+    expected_version = if_match_version(request.headers.get("if-match"))
+
+    changes = await run_in_threadpool(validate, Supplier.check_changes, body)
+    params = [supplier_id] + list(changes.values())
+    assignments = ["%s = $%d" % (field, index)
+                   for index, field in enumerate(changes, start=2)]
+    condition = "id = $1"
+    if expected_version is not None:
+        params.append(expected_version)
+        condition += " AND version = $%d" % len(params)
+    if assignments:
+        sql = "UPDATE supplier SET %s, version = version + 1 WHERE %s " \
+              "RETURNING %s" % (", ".join(assignments), condition, COLUMNS)
+    else:
+        sql = "SELECT %s FROM supplier WHERE %s" % (COLUMNS, condition)
+
+    async with request.app.state.pool.acquire() as connection:
+        row = await connection.fetchrow(sql, *params)
+        if row is None:
+            version = await connection.fetchval(
+                "SELECT version FROM supplier WHERE id = $1", supplier_id)
+            if version is None:
+                raise not_found(supplier_id)
+            raise VersionConflict("Supplier %s is at version %s, not %s"
+                                  % (supplier_id, version, expected_version))
+    if assignments:
+        await invalidate(request.app, supplier_id, row["version"])
+    return supplier_response(row, status.HTTP_200_OK)
+
+
+######################################################################
+#  U T I L I T Y   F U N C T I O N S
+######################################################################
+async def read_json(request: Request):
+    """Reads the JSON body, which must be sent as application/json"""
+    content_type = request.headers.get("content-type")
+    if content_type != "application/json":
+        raise HTTPException(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                            "Content-Type must be application/json")
+    try:
+        return json.loads(await request.body())
+    except ValueError as error:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST,
+                            "invalid JSON: %s" % error) from error
+
+
+def validate(check: Callable, body: dict):
+    """
+    Checks a body with a Supplier validator, like the Flask app; meant
+    for the thread pool, as the product catalog may query Postgres
+    through psycopg2
+    """
+    if Supplier.app is None:  # no init_db, so no catalog to query
+        return check(body)
+    # the catalog queries through db.session, which needs the Flask app
+    # on this thread; popping the context returns its connection
+    with Supplier.app.app_context():
+        return check(body)
+
+
+async def invalidate(app: Starlette, supplier_id: int, version: int) -> None:
+    """Invalidates the cached supplier, off the event loop"""
+    cache = app.state.cache
+    if not isinstance(cache, NullCache):  # a store client may block
+        await run_in_threadpool(cache.delete, supplier_id, version)
+
+
+def supplier_response(row, code: int) -> Response:
+    """Serializes a supplier row with Supplier.serialize_to_dict"""
+    supplier = Supplier.from_row(dict(row))
+    return Response(serializer.dumps(supplier.serialize_to_dict()),
+                    status_code=code, media_type="application/json",
+                    headers={"ETag": '"%d"' % supplier.version})
+
+
+def not_found(supplier_id: int) -> HTTPException:
+    """Builds the 404 for a missing supplier"""
+    return HTTPException(status.HTTP_404_NOT_FOUND,
+                         "Supplier %s was not found" % supplier_id)
+
+
+def etag_matches(header: Optional[str], etag: str, weak: bool) -> bool:
+    """Tells whether an If-None-Match/If-Match header lists etag"""
+    if not header:
+        return False
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if weak and candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def if_match_version(header: Optional[str]) -> Optional[int]:
+    """
+    Reads the supplier version the client expects from If-Match
+    Returns None when there is no precondition (no header or *)
+    """
+    if not header or header.strip() == "*":
+        return None
+    tags = [tag.strip() for tag in header.split(",")]
+    if len(tags) != 1 or tags[0].startswith("W/"):
+        raise VersionConflict("If-Match must carry exactly one strong ETag")
+    try:
+        return int(tags[0].strip('"'))
+    except ValueError as error:
+        raise VersionConflict("If-Match does not match any version") \
+            from error
+
+
+async def http_error(request: Request, error: HTTPException) -> Response:
+    """Returns HTTP errors in the same JSON shape as the Flask app"""
+    return Response(
+        serializer.dumps({"status": error.status_code,
+                          "error": error.detail}),
+        status_code=error.status_code, media_type="application/json",
+        headers=getattr(error, "headers", None))
+
+
+async def data_error(request: Request, error: Exception) -> Response:
+    """Maps values Postgres rejects (types, constraints) to 400"""
+    code = status.HTTP_400_BAD_REQUEST
+    return Response(serializer.dumps({"status": code, "error": str(error)}),
+                    status_code=code, media_type="application/json")
+
+
+async def supplier_error(request: Request, error: Exception) -> Response:
+    """Maps supplier exceptions to 412 (VersionConflict) or 400"""
+    code = status.HTTP_412_PRECONDITION_FAILED \
+        if isinstance(error, VersionConflict) \
+        else status.HTTP_400_BAD_REQUEST
+    return Response(serializer.dumps({"status": code, "error": str(error)}),
+                    status_code=code, media_type="application/json")
+
+
+def create_app(database_uri: str = None) -> Starlette:
+    """Builds the ASGI app; database_uri defaults to DATABASE_URI"""
+    database_uri = database_uri or config.DATABASE_URI
+    if config.PRODUCT_STORAGE != "array":
+        raise ValueError("The ASGI app only supports PRODUCT_STORAGE=array")
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app: Starlette):
+        app.state.pool = await create_pool(database_uri)
+        try:
+            yield
+        finally:
+            await app.state.pool.close()
+
+    app = Starlette(
+        routes=[
+            Route("/suppliers", create_supplier, methods=["POST"]),
+            Route("/suppliers/{supplier_id:int}", read_supplier,
+                  methods=["GET"]),
+            Route("/suppliers/{supplier_id:int}", update_supplier,
+                  methods=["PUT"]),
+        ],
+        exception_handlers={
+            HTTPException: http_error,
+            SupplierException: supplier_error,
+            asyncpg.DataError: data_error,
+            asyncpg.IntegrityConstraintViolationError: data_error,
+        },
+        lifespan=lifespan,
+    )
+    app.state.cache = make_cache(vars(config))
+    return app
+
+
+app = create_app()
@@ -0,0 +1,342 @@
+"""
+Read-through cache for serialized suppliers
+
+Supplier.find looks a supplier up here before going to Postgres, and
+every write path (the Flask and ASGI routes, bulk writes, imports)
+refreshes or invalidates the entries of the rows it changed after it
+commits. Values are the dictionaries made by
+Supplier.serialize_to_dict and are treated as immutable.
+
+Sets are checked against versions: a value is only stored if its
+version is newer than the one cached, and an invalidation leaves a
+tombstone, for the time-to-live, that refuses values older than the
+version written. So a slow read that missed the cache cannot store its
+row after a newer write has invalidated it.
+
+Backends:
+    NullCache   -- caching disabled (the default)
+    LRUCache    -- in-process, bounded by size and time-to-live; only
+                   sound with a single worker process, as writes made by
+                   other processes (workers, the ASGI app, imports)
+                   cannot invalidate it
+    SharedCache -- any shared key-value store (Redis, memcached, ...)
+                   through a small client interface: RedisStore for the
+                   CACHE_STORE_URL of a Redis server (needs the optional
+                   redis package), or DictStore, a local stand-in for
+                   tests
+"""
+import json
+import time
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+
+class CacheBackend:
+    """Interface of the supplier caches"""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: int) -> Optional[dict]:
+        """Returns the cached value or None"""
+        raise NotImplementedError
+
+    def set(self, key: int, value: dict) -> None:
+        """Stores a value, unless a newer version is cached or was written"""
+        raise NotImplementedError
+
+    def delete(self, key: int, version: int = None) -> None:
+        """
+        Drops a value, and refuses values older than version (the version
+        just written) for the time-to-live; without a version, only the
+        values no newer than the one cached are refused
+        """
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        """Drops every value"""
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        return 0
+
+    def stats(self) -> dict:
+        """Returns the cache counters"""
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self).__name__,
+            "size": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+class NullCache(CacheBackend):
+    """A cache that never holds anything"""
+
+    def get(self, key: int) -> Optional[dict]:
+        self.misses += 1
+        return None
+
+    def set(self, key: int, value: dict) -> None:
+        pass
+
+    def delete(self, key: int, version: int = None) -> None:
+        pass
+
+    def clear(self) -> None:
+        pass
+
+
+def min_version(value: Optional[dict], floor: int) -> int:
+    """
+    The oldest version a set may store over an entry: newer than its
+    value, or at least floor for a tombstone (0 when unversioned)
+    """
+    if value is None:
+        return floor
+    version = value.get("version")
+    return 0 if version is None else version + 1
+
+
+def accepts(value: dict, floor: int) -> bool:
+    """Whether value is recent enough to be stored over floor"""
+    version = value.get("version")
+    return version is None or version >= floor
+
+
+class LRUCache(CacheBackend):
+    """
+    In-process least recently used cache
+    Holds at most max_size entries, values or tombstones, each for at
+    most ttl seconds. Expired values count as evictions when they are
+    found.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 60.0):
+        super().__init__()
+        self.max_size = max_size
+        self.ttl = ttl
+        # key -> (expires_at, value or None for a tombstone, min version)
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: int) -> Optional[dict]:
+        with self._lock:
+            entry = self._entry(key)
+            if entry is None or entry[1] is None:
+                self.misses += 1
+                return None
+            self._values.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: int, value: dict) -> None:
+        with self._lock:
+            entry = self._entry(key)
+            if entry is not None and \
+                    not accepts(value, min_version(entry[1], entry[2])):
+                return
+            self._store(key, value, 0)
+
+    def delete(self, key: int, version: int = None) -> None:
+        with self._lock:
+            entry = self._entry(key)
+            value, floor = (None, 0) if entry is None else entry[1:]
+            if value is not None:
+                self.invalidations += 1
+            floor = max(min_version(value, floor), version or 0)
+            if floor:
+                self._store(key, None, floor)
+            else:
+                self._values.pop(key, None)
+
+    def _entry(self, key: int) -> Optional[tuple]:
+        """The live entry of key, dropping it if it has expired"""
+        entry = self._values.get(key)
+        if entry is not None and entry[0] < time.monotonic():
+            del self._values[key]
+            if entry[1] is not None:
+                self.evictions += 1
+            return None
+        return entry
+
+    def _store(self, key: int, value: Optional[dict], floor: int) -> None:
+        """Stores an entry as the most recently used one"""
+        self._values[key] = (time.monotonic() + self.ttl, value, floor)
+        self._values.move_to_end(key)
+        while len(self._values) > self.max_size:
+            self._values.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+
+class DictStore:
+    """
+    Local stand-in for a shared key-value store client
+    Implements the get/set/delete/flush calls SharedCache needs, with
+    the same bytes values and expiry semantics as Redis or memcached.
+    """
+
+    def __init__(self):
+        self._values = {}  # key -> (expires_at, bytes)
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Returns the value or None if it is missing or expired"""
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._values[key]
+                return None
+            return entry[1]
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        """Stores value for ttl seconds"""
+        with self._lock:
+            self._values[key] = (time.monotonic() + ttl, value)
+
+    def delete(self, key: str) -> None:
+        """Drops a value"""
+        with self._lock:
+            self._values.pop(key, None)
+
+    def flush(self, prefix: str) -> None:
+        """Drops every value whose key starts with prefix"""
+        with self._lock:
+            for key in [key for key in self._values
+                        if key.startswith(prefix)]:
+                del self._values[key]
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+
+class RedisStore:
+    """
+    The store calls SharedCache needs, over a redis-py client
+    Values expire in Redis itself, and flush scans the keys of a prefix.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    @classmethod
+    def from_url(cls, url: str) -> "RedisStore":
+        """Connects to the Redis server at url, e.g. redis://cache:6379/0"""
+        import redis  # optional, only needed by a shared cache
+        return cls(redis.Redis.from_url(url))
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Returns the value or None if it is missing or expired"""
+        return self.client.get(key)
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        """Stores value for ttl seconds"""
+        self.client.set(key, value, px=max(int(ttl * 1000), 1))
+
+    def delete(self, key: str) -> None:
+        """Drops a value"""
+        self.client.delete(key)
+
+    def flush(self, prefix: str) -> None:
+        """Drops every value whose key starts with prefix"""
+        for key in self.client.scan_iter(match=prefix + "*"):
+            self.client.delete(key)
+
+
+class SharedCache(CacheBackend):
+    """
+    Cache kept in a store shared by every worker process
+    The store client needs get(key), set(key, value, ttl), delete(key)
+    and flush(prefix), with str keys and bytes values; see DictStore.
+    Tombstones are stored as {"min_version": N}. The version check reads
+    the entry before writing it, so two processes setting the same key
+    at the same instant may still race, for that instant only.
+    Counters are kept per process, and evictions are left to the store.
+    """
+
+    def __init__(self, store, ttl: float = 60.0, prefix: str = "supplier:"):
+        super().__init__()
+        self.store = store
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key: int) -> Optional[dict]:
+        value, _ = self._entry(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def set(self, key: int, value: dict) -> None:
+        if accepts(value, min_version(*self._entry(key))):
+            self._store(key, value)
+
+    def delete(self, key: int, version: int = None) -> None:
+        floor = max(min_version(*self._entry(key)), version or 0)
+        if floor:
+            self._store(key, {"min_version": floor})
+        else:
+            self.store.delete(self.prefix + str(key))
+        self.invalidations += 1
+
+    def _entry(self, key: int) -> tuple:
+        """The value of key, or None, and the min version of its entry"""
+        raw = self.store.get(self.prefix + str(key))
+        if raw is None:
+            return None, 0
+        value = json.loads(raw)
+        if "min_version" in value:
+            return None, value["min_version"]
+        return value, 0
+
+    def _store(self, key: int, value: dict) -> None:
+        """Writes a value or a tombstone for ttl seconds"""
+        raw = json.dumps(value, separators=(",", ":")).encode("utf-8")
+        self.store.set(self.prefix + str(key), raw, self.ttl)
+
+    def clear(self) -> None:
+        self.store.flush(self.prefix)
+
+    def __len__(self) -> int:
+        return len(self.store) if hasattr(self.store, "__len__") else 0
+
+
+def make_cache(config: dict, store=None) -> CacheBackend:
+    """
+    Builds the cache selected by CACHE_BACKEND (none, lru or shared)
+    A shared cache uses store, or the Redis server at CACHE_STORE_URL;
+    it cannot go without either, as a store private to the process would
+    not see the writes of the others
+    """
+    backend = config.get("CACHE_BACKEND", "none")
+    ttl = config.get("CACHE_TTL", 60.0)
+    if backend == "none":
+        return NullCache()
+    if backend == "lru":
+        return LRUCache(config.get("CACHE_MAX_SIZE", 10000), ttl)
+    if backend == "shared":
+        if store is None:
+            url = config.get("CACHE_STORE_URL")
+            if not url:
+                raise ValueError("CACHE_BACKEND=shared needs CACHE_STORE_URL")
+            store = RedisStore.from_url(url)
+        return SharedCache(store, ttl)
+    raise ValueError("Unknown CACHE_BACKEND %r" % backend)
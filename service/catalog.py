@@ -0,0 +1,145 @@
+"""
+Product catalog used to validate the product ids of suppliers
+
+Supplier._check_product_ids asks the catalog for the ids it does not
+know, and rejects them all in one UnknownProducts error.
+
+Catalogs:
+    NullCatalog  -- no validation (the default)
+    TableCatalog -- ids are looked up in a table of the service database
+                    (PRODUCT_CATALOG_TABLE, e.g. a replicated or foreign
+                    table of the products service)
+
+TableCatalog keeps every catalog id in a sorted array of 64-bit ints
+(8 bytes per product), reloaded every PRODUCT_CATALOG_REFRESH seconds.
+Ids found there are accepted without a query. The ids that are not
+there may have been added since the last load, so they are looked up
+with one batched SELECT before they are reported. Products deleted from
+the catalog are accepted until the next reload.
+"""
+import time
+import logging
+import threading
+from array import array
+from bisect import bisect_left
+from typing import Callable, List, Sequence
+from sqlalchemy import BigInteger, Column, MetaData, Table, select
+
+logger = logging.getLogger("flask.app")
+
+# ids fetched per round trip while loading the catalog
+LOAD_BATCH_SIZE = 10000
+
+
+class ProductCatalog:
+    """Interface of the product catalogs"""
+
+    def missing(self, product_ids: Sequence[int]) -> List[int]:
+        """Returns the ids that are not in the catalog, sorted"""
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        """Returns the catalog counters"""
+        return {"catalog": type(self).__name__}
+
+
+class NullCatalog(ProductCatalog):
+    """A catalog that knows every product"""
+
+    def missing(self, product_ids: Sequence[int]) -> List[int]:
+        return []
+
+
+class TableCatalog(ProductCatalog):
+    """Product ids read from a database table; see the module docstring"""
+
+    def __init__(self, connect: Callable, table: str, column: str = "id",
+                 refresh: float = 300.0):
+        """
+        connect returns a connection (or session) to run the SELECTs on
+        table may be qualified with a schema, e.g. catalog.product
+        """
+        schema, _, name = table.rpartition(".")
+        self.table = Table(name, MetaData(),
+                           Column(column, BigInteger, primary_key=True),
+                           schema=schema or None)
+        self.column = self.table.c[column]
+        self.connect = connect
+        self.refresh = refresh
+        self.ids = array("q")
+        self.loaded_at = None
+        self.loads = 0
+        self.lookups = 0
+        self.lock = threading.Lock()
+
+    def missing(self, product_ids: Sequence[int]) -> List[int]:
+        self.ensure_loaded()
+        ids = self.ids
+        count = len(ids)
+        unknown = []
+        for product_id in sorted(set(product_ids)):
+            index = bisect_left(ids, product_id)
+            if index == count or ids[index] != product_id:
+                unknown.append(product_id)
+        if not unknown:
+            return []
+        # the catalog may have grown since it was loaded
+        self.lookups += 1
+        found = {row[0] for row in self.connect().execute(
+            select([self.column]).where(self.column.in_(unknown)))}
+        return [product_id for product_id in unknown
+                if product_id not in found]
+
+    def ensure_loaded(self) -> None:
+        """
+        Loads the catalog if it never was, or reloads it once it is
+        older than refresh seconds; the old copy keeps serving the other
+        threads during a reload
+        """
+        if self.loaded_at is not None and \
+                time.monotonic() - self.loaded_at < self.refresh:
+            return
+        if not self.lock.acquire(blocking=self.loaded_at is None):
+            return  # another thread is reloading
+        try:
+            if self.loaded_at is None or \
+                    time.monotonic() - self.loaded_at >= self.refresh:
+                self.load()
+        finally:
+            self.lock.release()
+
+    def load(self) -> None:
+        """Reads every id of the catalog table, in order"""
+        start = time.monotonic()
+        ids = array("q")
+        result = self.connect() \
+            .execution_options(stream_results=True) \
+            .execute(select([self.column]).order_by(self.column))
+        while True:
+            rows = result.fetchmany(LOAD_BATCH_SIZE)
+            if not rows:
+                break
+            ids.extend(row[0] for row in rows)
+        self.ids = ids
+        self.loaded_at = time.monotonic()
+        self.loads += 1
+        logger.info("Loaded %d catalog products in %.3fs",
+                    len(ids), self.loaded_at - start)
+
+    def stats(self) -> dict:
+        return {
+            "catalog": type(self).__name__,
+            "products": len(self.ids),
+            "loads": self.loads,
+            "lookups": self.lookups,
+        }
+
+
+def make_catalog(config: dict, connect: Callable) -> ProductCatalog:
+    """Builds the catalog selected by PRODUCT_CATALOG_TABLE"""
+    table = config.get("PRODUCT_CATALOG_TABLE", "")
+    if not table:
+        return NullCatalog()
+    return TableCatalog(connect, table,
+                        config.get("PRODUCT_CATALOG_COLUMN", "id"),
+                        config.get("PRODUCT_CATALOG_REFRESH", 300.0))
@@ -0,0 +1,132 @@
+"""
+Change feed of the suppliers
+
+Triggers on supplier write a supplier_change row for every create,
+update and delete, in the transaction of the change, and NOTIFY
+supplier_change at its commit. GET /suppliers/changes pages through the
+rows, so a downstream copy (search index, cache) syncs at the cost of
+what changed rather than of the table.
+
+Rows are read in (txid, seq) order, and only those of transactions older
+than the oldest one still running (the xmin of the snapshot). seq alone
+is not safe: numbers are taken at insert time, so a transaction can
+commit seq 7 after a reader went past seq 8. Every transaction behind
+xmin has finished, and a later one gets a larger txid, so no row can
+appear behind a cursor. The price is that a long transaction anywhere in
+the database holds the feed back until it ends.
+
+A consumer bootstraps with a cursor for "now", then a full export, then
+follows the feed: changes committed before the cursor was taken are in
+the export, the others come through the feed (some maybe twice).
+"""
+import time
+import select
+import logging
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Iterator, List, Optional, Tuple
+from sqlalchemy import func, select as sql_select, text, tuple_
+from service.supplier import db, supplier_change
+
+logger = logging.getLogger("flask.app")
+
+CHANNEL = "supplier_change"
+# seconds between reads while waiting, when no notification comes (a
+# change can be notified before xmin lets it through)
+RECHECK_INTERVAL = 1.0
+
+COLUMNS = supplier_change.c
+KEY = tuple_(COLUMNS.txid, COLUMNS.seq)
+XMIN = func.txid_snapshot_xmin(func.txid_current_snapshot())
+
+
+def read_changes(connection, after: Tuple[int, int],
+                 limit: int) -> List[dict]:
+    """Returns up to limit changes after the (txid, seq) key after"""
+    rows = connection.execute(
+        sql_select([COLUMNS.txid, COLUMNS.seq, COLUMNS.supplier_id,
+                    COLUMNS.op, COLUMNS.version, COLUMNS.changed_at])
+        .where(KEY > tuple_(*after))
+        .where(COLUMNS.txid < XMIN)
+        .order_by(COLUMNS.txid, COLUMNS.seq)
+        .limit(limit))
+    return [dict(row) for row in rows]
+
+
+def head(connection) -> Tuple[int, int]:
+    """
+    Returns the key of "now": every change after it belongs to a
+    transaction that had not finished yet
+    """
+    return (connection.execute(sql_select([XMIN])).scalar(), 0)
+
+
+def oldest(connection) -> Optional[Tuple[int, int]]:
+    """Returns the key of the oldest change kept, None if there is none"""
+    row = connection.execute(
+        sql_select([COLUMNS.txid, COLUMNS.seq])
+        .order_by(COLUMNS.txid, COLUMNS.seq).limit(1)).first()
+    return tuple(row) if row is not None else None
+
+
+def wait_changes(connection, after: Tuple[int, int], limit: int,
+                 timeout: float, listen: bool = True) -> List[dict]:
+    """
+    Reads changes after after, waiting up to timeout seconds for some
+    connection must be in autocommit mode, so that each read sees the
+    latest commits; with listen off (e.g. behind PgBouncer in
+    transaction mode) the feed is polled every RECHECK_INTERVAL
+    """
+    deadline = time.monotonic() + timeout
+    with listening(connection, listen):
+        while True:
+            changes = read_changes(connection, after, limit)
+            remaining = deadline - time.monotonic()
+            if changes or remaining <= 0:
+                return changes
+            wait_notification(connection, min(remaining, RECHECK_INTERVAL),
+                              listen)
+
+
+@contextmanager
+def listening(connection, listen: bool) -> Iterator[None]:
+    """LISTENs on the change channel for the duration of the block"""
+    if not listen:
+        yield
+        return
+    connection.execute(text("LISTEN " + CHANNEL))
+    try:
+        yield
+    finally:
+        # the connection goes back to the pool: stop queueing notifications
+        connection.execute(text("UNLISTEN " + CHANNEL))
+        connection.connection.notifies.clear()
+
+
+def wait_notification(connection, timeout: float, listen: bool) -> None:
+    """Returns at the next notification, or after timeout seconds"""
+    if not listen:
+        time.sleep(timeout)
+        return
+    dbapi_connection = connection.connection
+    dbapi_connection.poll()
+    if not dbapi_connection.notifies:
+        select.select([dbapi_connection], [], [], timeout)
+        dbapi_connection.poll()
+    dbapi_connection.notifies.clear()
+
+
+def prune_changes(keep: timedelta) -> int:
+    """
+    Deletes the changes older than keep, but always keeps the newest one
+    Returns the number of changes deleted
+    """
+    cutoff = datetime.now(timezone.utc) - keep
+    newest = sql_select([func.max(COLUMNS.seq)]).as_scalar()
+    deleted = db.session.execute(
+        supplier_change.delete()
+        .where(COLUMNS.changed_at < cutoff)
+        .where(COLUMNS.seq < newest)).rowcount
+    db.session.commit()
+    logger.info("Pruned %d supplier changes older than %s", deleted, cutoff)
+    return deleted
@@ -0,0 +1,114 @@
+"""
+Flask CLI commands for supplier maintenance
+
+Run them with FLASK_APP=service:app, e.g.
+    flask suppliers export --format csv -o suppliers.csv
+    DB_SCHEMA_MODE=off flask suppliers db-init
+    flask suppliers backfill-products --batch-size 500
+    flask suppliers import suppliers.csv.gz --workers 4 --upsert
+    flask suppliers prune-changes --keep-days 7
+"""
+import os
+import sys
+from datetime import timedelta
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from service.supplier import Supplier
+from service.changes import prune_changes
+from service.export import EXPORTERS
+from service.importer import FORMATS, detect_format, import_suppliers, \
+    open_input
+from service.schema import SCHEMA_VERSION, create_schema, current_version
+
+suppliers_cli = AppGroup("suppliers", help="Supplier maintenance commands")
+
+
+@suppliers_cli.command("export")
+@click.option("--format", "export_format", default="ndjson",
+              type=click.Choice(sorted(EXPORTERS)), show_default=True,
+              help="Output format")
+@click.option("--output", "-o", type=click.File("w"), default="-",
+              help="Output file, stdout by default")
+@click.option("--batch-size", type=int, default=None,
+              help="Rows fetched per round trip "
+                   "(defaults to EXPORT_BATCH_SIZE)")
+def export_command(export_format, output, batch_size):
+    """Streams every supplier to a file as NDJSON or CSV"""
+    batch_size = batch_size or current_app.config["EXPORT_BATCH_SIZE"]
+    rows = Supplier.stream(batch_size)
+    for chunk in EXPORTERS[export_format](rows, Supplier.EXPORT_FIELDS):
+        output.write(chunk)
+
+
+@suppliers_cli.command("db-init")
+def db_init_command():
+    """Creates or migrates the schema and stamps its version"""
+    previous = current_version()
+    create_schema()
+    click.echo("Schema at version %d (was %s)" % (SCHEMA_VERSION, previous))
+
+
+@suppliers_cli.command("backfill-products")
+@click.option("--batch-size", type=int, default=1000, show_default=True,
+              help="Suppliers copied per transaction")
+@click.option("--clear", is_flag=True,
+              help="Empty the products arrays once copied")
+def backfill_products_command(batch_size, clear):
+    """Copies the products arrays into the supplier_product table"""
+    suppliers = products = 0
+    for batch_suppliers, batch_products in Supplier.backfill_products(
+            batch_size, clear):
+        suppliers += batch_suppliers
+        products += batch_products
+        click.echo("%d suppliers, %d products copied" % (suppliers, products))
+    click.echo("Done: %d suppliers, %d products copied"
+               % (suppliers, products))
+
+
+@suppliers_cli.command("prune-changes")
+@click.option("--keep-days", type=float, default=7, show_default=True,
+              help="Age of the oldest changes kept")
+def prune_changes_command(keep_days):
+    """Deletes old changes from the change feed"""
+    deleted = prune_changes(timedelta(days=keep_days))
+    click.echo("%d changes older than %g days deleted" % (deleted, keep_days))
+
+
+@suppliers_cli.command("import")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False,
+                                        allow_dash=True))
+@click.option("--format", "import_format", type=click.Choice(FORMATS),
+              default=None,
+              help="Input format, guessed from the file name by default")
+@click.option("--workers", type=int, default=os.cpu_count() or 1,
+              show_default="CPU count", help="Validation processes")
+@click.option("--chunk-size", type=int, default=10000, show_default=True,
+              help="Rows per COPY and transaction")
+@click.option("--keep-ids", is_flag=True,
+              help="Keep the ids of the file instead of generating them")
+@click.option("--upsert", is_flag=True,
+              help="Update the suppliers whose id exists (implies --keep-ids)")
+@click.option("--rejects", "rejects_path", type=click.Path(dir_okay=False),
+              default=None, help="File of the rejected rows "
+                                 "(PATH.rejects.ndjson by default)")
+def import_command(path, import_format, workers, chunk_size, keep_ids,
+                   upsert, rejects_path):
+    """Loads suppliers from a CSV or NDJSON file, gzipped or not"""
+    import_format = import_format or detect_format(path)
+    if import_format is None:
+        raise click.UsageError("Cannot guess the format of %s, "
+                               "use --format" % path)
+    if rejects_path is None:
+        rejects_path = "import.rejects.ndjson" if path == "-" \
+            else path + ".rejects.ndjson"
+
+    def progress(stats):
+        click.echo("%d rows loaded, %d rejected (%.0f rows/s)"
+                   % (stats.loaded, stats.rejected, stats.rate), err=True)
+    binary = sys.stdin.buffer if path == "-" else open(path, "rb")
+    with open_input(binary) as stream, open(rejects_path, "w") as rejects:
+        stats = import_suppliers(stream, import_format, rejects, workers,
+                                 chunk_size, keep_ids, upsert, progress)
+    click.echo("Done: %d rows loaded, %d rejected in %s (%.0f rows/s)"
+               % (stats.loaded, stats.rejected, rejects_path, stats.rate))
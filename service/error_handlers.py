@@ -1,6 +1,6 @@
 from flask import jsonify
 from . import app, status
-from service.supplier_exception import SupplierException
+from service.supplier_exception import SupplierException, VersionConflict
 
 
 @app.errorhandler(SupplierException)
@@ -9,6 +9,17 @@ def supplier_exception(error):
     return bad_request(error)
 
 
+@app.errorhandler(VersionConflict)
+def version_conflict(error):
+    """ Handles failed If-Match preconditions with 412_PRECONDITION_FAILED """
+    message = str(error)
+    app.logger.warning(message)
+    return (
+        jsonify(status=status.HTTP_412_PRECONDITION_FAILED, error=message),
+        status.HTTP_412_PRECONDITION_FAILED,
+    )
+
+
 @app.errorhandler(status.HTTP_400_BAD_REQUEST)
 def bad_request(error):
     """ Handles bad requests with 400_BAD_REQUEST """
@@ -29,3 +40,14 @@ def not_found(error):
         jsonify(status=status.HTTP_404_NOT_FOUND, error=message),
         status.HTTP_404_NOT_FOUND,
     )
+
+
+@app.errorhandler(status.HTTP_410_GONE)
+def gone(error):
+    """Handles resources that no longer exist with 410_GONE """
+    message = str(error)
+    app.logger.warning(message)
+    return (
+        jsonify(status=status.HTTP_410_GONE, error=message),
+        status.HTTP_410_GONE,
+    )
@@ -0,0 +1,76 @@
+"""
+Streaming encoders for supplier exports
+
+Each encoder takes an iterator of supplier dictionaries and yields text
+chunks, so an export never holds more than one chunk in memory. The
+header (or first row) is yielded right away and the rest is batched
+into chunks of about CHUNK_SIZE characters to keep write calls cheap.
+"""
+import io
+import csv
+from typing import Callable, Dict, Iterable, Iterator, Sequence
+from service.serializers import Serializer
+
+CHUNK_SIZE = 64 * 1024
+CSV_COLUMNS = ["id", "name", "email", "address", "products"]
+# products are written as a single CSV cell, e.g. "1;2;3"
+CSV_PRODUCT_SEPARATOR = ";"
+
+
+def _batched(lines: Iterable[str]) -> Iterator[str]:
+    """Joins small lines into chunks of about CHUNK_SIZE characters"""
+    buffer = []
+    size = 0
+    first = True
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if first or size >= CHUNK_SIZE:
+            yield "".join(buffer)
+            buffer = []
+            size = 0
+            first = False
+    if buffer:
+        yield "".join(buffer)
+
+
+def iter_ndjson(rows: Iterable[dict],
+                columns: Sequence[str] = None) -> Iterator[str]:
+    """Encodes suppliers as newline delimited JSON"""
+    dumps = Serializer().dumps
+    return _batched(dumps(row).decode("utf-8") + "\n" for row in rows)
+
+
+def iter_csv(rows: Iterable[dict],
+             columns: Sequence[str] = None) -> Iterator[str]:
+    """Encodes suppliers as CSV with a header row of columns"""
+    columns = columns or CSV_COLUMNS
+
+    def cell(row, column):
+        value = row[column]
+        if column == "products" and value is not None:
+            return CSV_PRODUCT_SEPARATOR.join(map(str, value))
+        return value
+
+    def lines():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        yield buffer.getvalue()
+        for row in rows:
+            buffer.seek(0)
+            buffer.truncate(0)
+            writer.writerow([cell(row, column) for column in columns])
+            yield buffer.getvalue()
+    return _batched(lines())
+
+
+Exporter = Callable[[Iterable[dict], Sequence[str]], Iterator[str]]
+EXPORTERS: Dict[str, Exporter] = {
+    "ndjson": iter_ndjson,
+    "csv": iter_csv,
+}
+MIMETYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
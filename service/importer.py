@@ -0,0 +1,368 @@
+"""
+Bulk import of suppliers from CSV or NDJSON files
+
+    flask suppliers import suppliers.ndjson.gz --workers 4
+
+The input is read as a stream (gzip is recognized by its magic bytes)
+and cut into chunks of rows. Worker processes parse the chunks, validate
+each row with the checks of Supplier.__init__ and encode the valid ones
+for COPY. The command then loads each chunk, in input order, with one
+COPY ... FROM STDIN and commits it. Rows that fail, in a worker or in
+Postgres, are written to a rejects file as NDJSON objects
+{"line", "error", "row"}, and the import goes on.
+
+CSV files use the columns of flask suppliers export --format csv
+(products as "1;2;3", empty cells as null), so an export can be imported
+back. Ids are ignored and generated anew unless keep_ids is set, in
+which case the id sequence is moved past them at the end. upsert keeps
+ids too: each chunk is COPYed into a temporary staging table and merged
+with INSERT ... ON CONFLICT (id) DO UPDATE, which bumps the version of
+the suppliers that existed (the last row wins within a chunk), and
+their cache entries are invalidated once the chunk is committed.
+
+The product catalog, if any, is checked in the command, once per chunk.
+With PRODUCT_STORAGE=table the arrays are moved to supplier_product by
+the backfill at the end.
+"""
+import io
+import csv
+import json
+import gzip
+import time
+import multiprocessing
+from collections import deque
+from typing import Callable, IO, Iterator, List, Optional, Tuple
+import psycopg2
+from service.catalog import NullCatalog
+from service.export import CSV_PRODUCT_SEPARATOR
+from service.supplier import Supplier, db
+from service.supplier_exception import SupplierException, WrongArgType
+
+FORMATS = ("ndjson", "csv")
+EXTENSIONS = {".ndjson": "ndjson", ".jsonl": "ndjson", ".json": "ndjson",
+              ".csv": "csv"}
+
+STAGING = """
+DROP TABLE IF EXISTS supplier_import;
+CREATE TEMPORARY TABLE supplier_import AS
+SELECT id, name, email, address, products, 0::bigint AS line
+FROM supplier WITH NO DATA
+"""
+MERGE = """
+INSERT INTO supplier (id, name, email, address, products)
+SELECT DISTINCT ON (id) id, name, email, address, products
+FROM supplier_import ORDER BY id, line DESC
+ON CONFLICT (id) DO UPDATE SET
+    name = EXCLUDED.name, email = EXCLUDED.email,
+    address = EXCLUDED.address, products = EXCLUDED.products,
+    version = supplier.version + 1
+RETURNING id, version
+"""
+# escapes of the COPY text format
+COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n",
+                              "\r": "\\r"})
+
+
+class ImportStats:
+    """Counters of an import"""
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.read = 0
+        self.loaded = 0
+        self.rejected = 0
+
+    @property
+    def rate(self) -> float:
+        """Rows read per second so far"""
+        elapsed = time.monotonic() - self.start
+        return self.read / elapsed if elapsed > 0 else 0.0
+
+
+######################################################################
+# Reading
+######################################################################
+def detect_format(path: str) -> Optional[str]:
+    """Guesses the format from a file name, e.g. suppliers.csv.gz"""
+    name = path.lower()
+    if name.endswith(".gz"):
+        name = name[:-3]
+    for extension, import_format in EXTENSIONS.items():
+        if name.endswith(extension):
+            return import_format
+    return None
+
+
+def open_input(binary: IO[bytes]) -> IO[str]:
+    """Opens a binary stream as text, decompressing it if it is gzip"""
+    binary = io.BufferedReader(binary) \
+        if not hasattr(binary, "peek") else binary
+    if binary.peek(2)[:2] == b"\x1f\x8b":
+        binary = gzip.GzipFile(fileobj=binary)
+    return io.TextIOWrapper(binary, encoding="utf-8", newline="")
+
+
+def read_chunks(stream: IO[str], import_format: str,
+                chunk_size: int) -> Iterator[List[tuple]]:
+    """
+    Yields lists of up to chunk_size (line number, raw row) pairs; raw
+    rows are text lines for NDJSON and dicts of cells for CSV
+    """
+    if import_format == "csv":
+        reader = csv.DictReader(stream)
+        rows = ((reader.line_num, row) for row in reader)
+    else:
+        rows = ((number, line) for number, line in enumerate(stream, 1)
+                if line.strip())
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+######################################################################
+# Validation (in the worker processes)
+######################################################################
+def parse_row(raw) -> dict:
+    """Turns a raw NDJSON line or CSV row into supplier fields"""
+    if isinstance(raw, str):
+        data = json.loads(raw)
+        if not isinstance(data, dict):
+            raise WrongArgType("a JSON object is expected")
+        return data
+    data = {key: value or None for key, value in raw.items()}
+    if data.get("id") is not None:
+        data["id"] = int(data["id"])
+    if data.get("products") is not None:
+        data["products"] = [int(product) for product in
+                            data["products"].split(CSV_PRODUCT_SEPARATOR)]
+    return data
+
+
+def encode_row(data: dict, keep_ids: bool) -> Tuple[str, list]:
+    """
+    Validates the fields of a supplier like Supplier.__init__ and
+    returns its COPY text line (without a line end) and its products
+    """
+    supplier_id = data.pop("id", None)
+    if keep_ids and (not isinstance(supplier_id, int) or
+                     isinstance(supplier_id, bool) or supplier_id <= 0):
+        raise WrongArgType("a positive integer id is required, got %r"
+                           % (supplier_id,))
+    # the checks of Supplier.__init__, without building an ORM object
+    fields = Supplier.check_changes(
+        {field: data.get(field) for field in Supplier.UPDATABLE_FIELDS})
+    values = [fields["name"], fields["email"], fields["address"],
+              fields["products"]]
+    if keep_ids:
+        values.insert(0, supplier_id)
+    return "\t".join(map(copy_value, values)), fields["products"] or []
+
+
+def copy_value(value) -> str:
+    """Encodes a value in the COPY text format"""
+    if value is None:
+        return "\\N"
+    if isinstance(value, list):
+        return "{%s}" % ",".join(map(str, value))
+    if isinstance(value, str):
+        return value.translate(COPY_ESCAPES)
+    return str(value)
+
+
+def validate_chunk(chunk: List[tuple], keep_ids: bool) -> tuple:
+    """
+    Validates a chunk of (line number, raw row) pairs
+    Returns the valid rows as (line number, COPY line, products) and the
+    rejects as (line number, error)
+    """
+    rows, rejects = [], []
+    # the catalog is checked later, once per chunk (see check_catalog)
+    catalog, Supplier.catalog = Supplier.catalog, NullCatalog()
+    try:
+        for line, raw in chunk:
+            try:
+                text, products = encode_row(parse_row(raw), keep_ids)
+                rows.append((line, text, products))
+            except (SupplierException, ValueError, TypeError) as error:
+                rejects.append((line, str(error) or type(error).__name__))
+    finally:
+        Supplier.catalog = catalog
+    return rows, rejects
+
+
+######################################################################
+# Loading
+######################################################################
+class Loader:
+    """COPYs validated chunks into the supplier table, one transaction each"""
+
+    def __init__(self, connection, keep_ids: bool, upsert: bool):
+        self.connection = connection
+        self.cursor = connection.cursor()
+        self.upsert = upsert
+        columns = "id, name, email, address, products" if keep_ids \
+            else "name, email, address, products"
+        if upsert:
+            self.cursor.execute(STAGING)
+            self.connection.commit()  # a failed merge must not drop it
+            self.copy = "COPY supplier_import (%s, line) FROM STDIN" % columns
+        else:
+            self.copy = "COPY supplier (%s) FROM STDIN" % columns
+
+    def load(self, rows: List[tuple]) -> List[tuple]:
+        """
+        Loads rows of (line number, COPY line) and commits
+        Returns the rows Postgres refused as (line number, error)
+        """
+        merged = []  # (id, version) of the suppliers written
+        if self.upsert:
+            rows = [(line, "%s\t%d" % (text, line)) for line, text in rows]
+        failed = self.copy_rows(rows)
+        if self.upsert:
+            try:
+                if Supplier.product_storage == "table":
+                    self.cursor.execute(
+                        "DELETE FROM supplier_product WHERE supplier_id IN "
+                        "(SELECT id FROM supplier_import)")
+                self.cursor.execute(MERGE)
+                merged = self.cursor.fetchall()
+            except psycopg2.Error as error:
+                self.connection.rollback()
+                refused = {line for line, _ in failed}
+                failed += [(line, first_line(error)) for line, _ in rows
+                           if line not in refused]
+            self.cursor.execute("TRUNCATE supplier_import")
+        self.connection.commit()
+        for supplier_id, version in merged:
+            Supplier.cache.delete(supplier_id, version)
+        return failed
+
+    def copy_rows(self, rows: List[tuple]) -> List[tuple]:
+        """COPYs rows, halving them to find the ones Postgres refuses"""
+        if not rows:
+            return []
+        self.cursor.execute("SAVEPOINT import_rows")
+        try:
+            self.cursor.copy_expert(self.copy, io.StringIO(
+                "".join(text + "\n" for _, text in rows)))
+            self.cursor.execute("RELEASE SAVEPOINT import_rows")
+            return []
+        except psycopg2.Error as error:
+            self.cursor.execute("ROLLBACK TO SAVEPOINT import_rows")
+            self.cursor.execute("RELEASE SAVEPOINT import_rows")
+            if len(rows) == 1:
+                return [(rows[0][0], first_line(error))]
+        middle = len(rows) // 2
+        return self.copy_rows(rows[:middle]) + self.copy_rows(rows[middle:])
+
+    def finish(self, keep_ids: bool) -> None:
+        """Moves the id sequence past imported ids"""
+        if self.upsert:
+            self.cursor.execute("DROP TABLE supplier_import")
+        if keep_ids:
+            self.cursor.execute(
+                "SELECT setval(pg_get_serial_sequence('supplier', 'id'), "
+                "COALESCE(max(id), 0) + 1, false) FROM supplier")
+        self.connection.commit()
+
+
+def first_line(error: Exception) -> str:
+    """The first line of a database error"""
+    return str(error).strip().splitlines()[0]
+
+
+def import_suppliers(stream: IO[str], import_format: str, rejects: IO[str],
+                     workers: int = 1, chunk_size: int = 10000,
+                     keep_ids: bool = False, upsert: bool = False,
+                     progress: Callable[[ImportStats], None] = None
+                     ) -> ImportStats:
+    """
+    Imports the suppliers of stream; see the module docstring
+    workers is the number of validation processes, 1 to validate in
+    this process; rejected rows are written to rejects
+    """
+    keep_ids = keep_ids or upsert
+    stats = ImportStats()
+    pool = None
+    if workers > 1:
+        db.engine.dispose()  # forked workers must not share connections
+        pool = multiprocessing.Pool(workers)
+    connection = db.engine.raw_connection()
+    try:
+        loader = Loader(connection, keep_ids, upsert)
+
+        def load(chunk, result):
+            rows, refused = result
+            rows = check_catalog(rows, refused)
+            refused += loader.load([(line, text) for line, text, _ in rows])
+            write_rejects(rejects, chunk, refused)
+            stats.read += len(chunk)
+            stats.rejected += len(refused)
+            stats.loaded = stats.read - stats.rejected
+            if progress is not None:
+                progress(stats)
+
+        pending = deque()
+        for chunk in read_chunks(stream, import_format, chunk_size):
+            if pool is None:
+                load(chunk, validate_chunk(chunk, keep_ids))
+                continue
+            pending.append((chunk, pool.apply_async(validate_chunk,
+                                                    (chunk, keep_ids))))
+            if len(pending) >= 2 * workers:  # bounds the memory in use
+                chunk, result = pending.popleft()
+                load(chunk, result.get())
+        while pending:
+            chunk, result = pending.popleft()
+            load(chunk, result.get())
+        loader.finish(keep_ids)
+    finally:
+        connection.close()
+        if pool is not None:
+            pool.close()
+            pool.join()
+    if Supplier.product_storage == "table":
+        for _ in Supplier.backfill_products(chunk_size, clear=True):
+            pass
+    return stats
+
+
+def check_catalog(rows: List[tuple], refused: List[tuple]) -> List[tuple]:
+    """
+    Moves the rows carrying products unknown to the catalog to refused
+    as (line number, error), with one catalog call for the whole chunk
+    """
+    if isinstance(Supplier.catalog, NullCatalog):
+        return rows
+    unknown = set(Supplier.catalog.missing(
+        [product for _, _, products in rows for product in products]))
+    if not unknown:
+        return rows
+    kept = []
+    for line, text, products in rows:
+        missing = sorted(unknown.intersection(products))
+        if missing:
+            refused.append((line, "Unknown product ids: %s"
+                            % ", ".join(map(str, missing))))
+        else:
+            kept.append((line, text, products))
+    return kept
+
+
+def write_rejects(rejects: IO[str], chunk: List[tuple],
+                  refused: List[tuple]) -> None:
+    """Writes the refused rows of a chunk as NDJSON, in line order"""
+    if not refused:
+        return
+    raws = dict(chunk)
+    for line, error in sorted(refused):
+        raw = raws[line]
+        if isinstance(raw, str):
+            raw = raw.rstrip("\r\n")
+        rejects.write(json.dumps({"line": line, "error": error,
+                                  "row": raw}) + "\n")
@@ -0,0 +1,221 @@
+"""
+Asynchronous structured logging for the request path
+
+Request threads only put log records on a bounded in-memory queue. One
+listener thread per worker process takes them off and formats and writes
+them through the real handlers (gunicorn's, or stderr), so a request
+never waits on a handler lock or a slow pipe. When the queue is full,
+records are dropped and counted in supplier_log_records_dropped_total,
+rather than blocking.
+
+Messages are formatted lazily, in the listener, from the message and
+its arguments: log with logger.info("... %s", value), never with
+str.format. Request bodies are logged through log_request_body, which
+samples LOG_BODY_SAMPLE_RATE of the requests and renders at most
+LOG_BODY_MAX_BYTES of the raw body.
+
+Each request gets an id, taken from a valid X-Request-ID header or
+generated, sent back in X-Request-ID and added to every record logged
+while it is served. With LOG_FORMAT=json (the default) each record is
+one JSON object:
+    {"time", "level", "logger", "message", "request_id", ...}
+plus the fields passed with extra={...} and any exception.
+"""
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import queue
+import atexit
+import random
+import logging
+import threading
+import logging.handlers
+from typing import List
+from flask import Flask, current_app, g, request, has_request_context
+from service.metrics import LOG_RECORDS_DROPPED
+
+REQUEST_ID_HEADER = "X-Request-ID"
+VALID_REQUEST_ID = re.compile(r"[A-Za-z0-9._:-]{1,64}\Z")
+TEXT_FORMAT = "[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s"
+TEXT_DATE_FORMAT = "%Y-%m-%d %H:%M:%S %z"
+# loggers of the modules, served by the queue along with app.logger
+LOGGERS = ("flask.app", "service.slow_query")
+
+# attributes of every LogRecord; the others come from extra={...}
+RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord(
+    "", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as one JSON object per line"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": "%s.%03dZ" % (
+                time.strftime("%Y-%m-%dT%H:%M:%S",
+                              time.gmtime(record.created)),
+                record.msecs),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id is not None:
+            entry["request_id"] = request_id
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RequestFormatter(logging.Formatter):
+    """The text format, with the request id when there is one"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        request_id = getattr(record, "request_id", None)
+        return line if request_id is None else \
+            "%s [request_id=%s]" % (line, request_id)
+
+
+class QueueListener(logging.handlers.QueueListener):
+    """A QueueListener that can be stopped while its queue is full"""
+
+    def enqueue_sentinel(self) -> None:
+        self.queue.put(self._sentinel)
+
+
+class AsyncQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to a listener thread without formatting them
+    The listener is started by the first record of each process, so a
+    worker forked from a preloading master gets its own
+    """
+
+    def __init__(self, handlers: List[logging.Handler], size: int = 10000):
+        super().__init__(None)
+        self.handlers = handlers
+        self.size = size
+        self.listener = None
+        self.pid = None
+        self.start_lock = threading.Lock()
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Adds the request id; the message is left to the listener, but a
+        traceback is rendered now, while its frames are current
+        """
+        if has_request_context():
+            record.request_id = g.get("request_id")
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.pid != os.getpid():
+            self.start()
+        # SimpleQueue is unbounded but much cheaper than Queue; the bound
+        # is kept approximately (threads may race past it by a record)
+        if self.queue.qsize() >= self.size:
+            self.dropped += 1
+            LOG_RECORDS_DROPPED.inc()
+            return
+        self.queue.put_nowait(record)
+
+    def start(self) -> None:
+        """Starts the listener thread of this process"""
+        with self.start_lock:
+            if self.pid == os.getpid():
+                return
+            # a queue inherited through fork may have been locked
+            self.queue = queue.SimpleQueue()
+            self.listener = QueueListener(
+                self.queue, *self.handlers, respect_handler_level=True)
+            self.listener.start()
+            self.pid = os.getpid()
+            atexit.register(self.stop)
+
+    def stop(self) -> None:
+        """Writes the records still queued and stops the listener"""
+        with self.start_lock:
+            if self.pid == os.getpid() and self.listener is not None:
+                self.listener.stop()
+            self.listener = None
+            self.pid = None
+
+
+class BodySample:
+    """A request body, rendered (and truncated) only if it is logged"""
+    __slots__ = ("data", "limit")
+
+    def __init__(self, data: bytes, limit: int):
+        self.data = data
+        self.limit = limit
+
+    def __str__(self) -> str:
+        text = self.data[:self.limit].decode("utf-8", "replace")
+        if len(self.data) > self.limit:
+            text += "... (%d bytes)" % len(self.data)
+        return text
+
+
+def init_logging(app: Flask) -> AsyncQueueHandler:
+    """
+    Sends the service loggers through a queue to the gunicorn handlers,
+    or to stderr outside gunicorn, and installs the request id hooks
+    """
+    handlers = list(logging.getLogger("gunicorn.error").handlers)
+    level = logging.getLogger("gunicorn.error").level
+    if not handlers:
+        handlers = [logging.StreamHandler(sys.stderr)]
+    if app.config.get("LOG_FORMAT", "json") == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = RequestFormatter(TEXT_FORMAT, TEXT_DATE_FORMAT)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    queue_handler = AsyncQueueHandler(handlers,
+                                      app.config.get("LOG_QUEUE_SIZE", 10000))
+    for name in {app.logger.name, *LOGGERS}:
+        logger = logging.getLogger(name)
+        logger.handlers = [queue_handler]
+        logger.propagate = False
+    app.logger.setLevel(level)
+    app.before_request(_assign_request_id)
+    app.after_request(_send_request_id)
+    return queue_handler
+
+
+def _assign_request_id():
+    request_id = request.headers.get(REQUEST_ID_HEADER, "")
+    g.request_id = request_id if VALID_REQUEST_ID.match(request_id) \
+        else uuid.uuid4().hex
+
+
+def _send_request_id(response):
+    request_id = g.get("request_id")
+    if request_id is not None:
+        response.headers[REQUEST_ID_HEADER] = request_id
+    return response
+
+
+def log_request_body(logger: logging.Logger) -> None:
+    """Logs a sample of the request bodies at INFO, truncated"""
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    config = current_app.config
+    if random.random() >= config.get("LOG_BODY_SAMPLE_RATE", 1.0):
+        return
+    # the body is already read and cached by request.get_json
+    logger.info("request body: %s", BodySample(
+        request.get_data(cache=True), config.get("LOG_BODY_MAX_BYTES", 1024)))
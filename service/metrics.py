@@ -0,0 +1,126 @@
+"""
+Prometheus instrumentation for the supplier service
+
+Records, per route template (e.g. /suppliers/<int:supplier_id>):
+    supplier_http_requests_total             requests by method and status
+    supplier_http_request_duration_seconds   request latency histogram
+    supplier_db_statements_per_request       SQL statements per request
+    supplier_db_time_per_request_seconds     SQL time per request
+and supplier_boot_seconds, the time it took a worker to start (imports,
+database and schema, total), and supplier_log_records_dropped_total, the
+log records dropped because the log queue was full (service/logs.py).
+
+Request timing uses Flask before/after request hooks and SQL timing uses
+SQLAlchemy before/after_cursor_execute events. For streamed responses
+only the time to the first byte is measured.
+
+Under gunicorn every worker has its own counters. Set
+PROMETHEUS_MULTIPROC_DIR to an empty directory before the workers start
+and they will share them through memory-mapped files, so /metrics shows
+the totals of all workers whichever one serves it (gunicorn.conf.py
+cleans up after dead workers).
+"""
+import os
+import time
+from flask import Flask, g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from prometheus_client import CollectorRegistry, Counter, Gauge, \
+    Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+
+REQUESTS = Counter(
+    "supplier_http_requests_total", "HTTP requests",
+    ["method", "route", "status"])
+REQUEST_LATENCY = Histogram(
+    "supplier_http_request_duration_seconds", "HTTP request latency",
+    ["method", "route"],
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10))
+DB_STATEMENTS = Histogram(
+    "supplier_db_statements_per_request", "SQL statements run by a request",
+    ["route"], buckets=(0, 1, 2, 3, 5, 10, 25, 50, 100))
+DB_TIME = Histogram(
+    "supplier_db_time_per_request_seconds", "SQL time spent by a request",
+    ["route"],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 5))
+BOOT_TIME = Gauge(
+    "supplier_boot_seconds", "Time the worker took to start, by phase",
+    ["phase"], multiprocess_mode="max")
+LOG_RECORDS_DROPPED = Counter(
+    "supplier_log_records_dropped_total",
+    "Log records dropped because the log queue was full")
+
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+def init_metrics(app: Flask) -> None:
+    """Installs the request hooks and the SQL statement events"""
+    app.before_request(_start_request)
+    app.after_request(_record_response)
+    app.teardown_request(_record_failure)
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor):
+        event.listen(Engine, "before_cursor_execute", _before_cursor)
+        event.listen(Engine, "after_cursor_execute", _after_cursor)
+        event.listen(Engine, "handle_error", _cursor_failed)
+
+
+def render_metrics():
+    """Returns the metrics in the Prometheus text format and its mimetype"""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def _route() -> str:
+    return request.url_rule.rule if request.url_rule else UNMATCHED_ROUTE
+
+
+def _start_request():
+    g.metrics_start = time.perf_counter()
+    g.db_statements = 0
+    g.db_time = 0.0
+
+
+def _record(status_code: int) -> None:
+    if "metrics_start" not in g:
+        return
+    route = _route()
+    REQUESTS.labels(request.method, route, status_code).inc()
+    REQUEST_LATENCY.labels(request.method, route).observe(
+        time.perf_counter() - g.metrics_start)
+    DB_STATEMENTS.labels(route).observe(g.db_statements)
+    DB_TIME.labels(route).observe(g.db_time)
+    del g.metrics_start
+
+
+def _record_response(response):
+    _record(response.status_code)
+    return response
+
+
+def _record_failure(error=None):
+    # after_request does not run when a request dies with an exception
+    _record(500)
+
+
+def _before_cursor(conn, cursor, statement, parameters, context,
+                   executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+def _after_cursor(conn, cursor, statement, parameters, context,
+                  executemany):
+    elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+    if has_request_context() and "db_statements" in g:
+        g.db_statements += 1
+        g.db_time += elapsed
+
+
+def _cursor_failed(context):
+    if context.connection is None:
+        return
+    starts = context.connection.info.get("query_start_time")
+    if starts:
+        starts.pop()
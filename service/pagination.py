@@ -0,0 +1,41 @@
+"""
+Opaque cursors for keyset (seek) pagination
+
+A cursor wraps the last key a client has seen so the next page can be
+read with ``WHERE key > :last ORDER BY key LIMIT :n``, which costs the
+same on page 1 and page 10,000. A key is an int, or a tuple of ints
+for composite keys.
+"""
+import json
+import base64
+from typing import Tuple, Union
+from werkzeug.exceptions import BadRequest
+
+
+def encode_cursor(key: Union[int, Tuple[int, ...]]) -> str:
+    """Encodes the last seen key as an opaque url-safe cursor"""
+    if isinstance(key, tuple):
+        key = list(key)
+    raw = json.dumps({"k": key}, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str,
+                  size: int = None) -> Union[int, Tuple[int, ...]]:
+    """
+    Decodes a cursor made by encode_cursor
+    size is the length of a composite key, None for an int key
+    Throws BadRequest if the cursor is malformed
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded))["k"]
+    except (ValueError, TypeError, KeyError) as error:
+        raise BadRequest("invalid cursor: %s" % cursor) from error
+    parts = [key] if size is None else key
+    if not isinstance(parts, list) or \
+            len(parts) != (size or 1) or \
+            not all(isinstance(part, int) and not isinstance(part, bool)
+                    for part in parts):
+        raise BadRequest("invalid cursor: %s" % cursor)
+    return key if size is None else tuple(key)
@@ -0,0 +1,151 @@
+"""
+Database connection pool configuration and statistics
+
+engine_options builds SQLALCHEMY_ENGINE_OPTIONS from the DB_* settings
+in config.py. Two modes:
+
+    pooled     -- a QueuePool per worker, bounded by DB_POOL_SIZE +
+                  DB_MAX_OVERFLOW, with recycling and pre-ping
+    PgBouncer  -- DB_PGBOUNCER=True: no pool in the worker (NullPool),
+                  PgBouncer does the pooling. psycopg2 never uses
+                  server-side prepared statements, so transaction
+                  pooling is safe. statement_timeout is applied with
+                  SET LOCAL per transaction, since PgBouncer does not
+                  accept it as a startup parameter.
+
+Both pool classes time how long each checkout waits for a connection;
+pool_stats reports that next to the pool's own counters.
+"""
+import time
+import threading
+import weakref
+from sqlalchemy import event, exc
+from sqlalchemy.pool import NullPool, QueuePool
+
+
+class CheckoutStats:
+    """Counters kept by the timed pools"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.connects = 0
+        self.invalidations = 0
+
+    def record_wait(self, seconds: float) -> None:
+        """Records the time one checkout waited"""
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    def as_dict(self) -> dict:
+        """Returns the counters, with wait times in milliseconds"""
+        return {
+            "checkouts": self.checkouts,
+            "checkout_timeouts": self.timeouts,
+            "checkout_wait_total_ms": self.wait_total * 1000,
+            "checkout_wait_avg_ms": (self.wait_total * 1000 / self.checkouts
+                                     if self.checkouts else 0.0),
+            "checkout_wait_max_ms": self.wait_max * 1000,
+            "connects": self.connects,
+            "invalidations": self.invalidations,
+        }
+
+
+class _TimedCheckout:
+    """
+    Mixin that times Pool._do_get, where every checkout waits for a
+    pooled connection (or opens a new one)
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkout_stats = CheckoutStats()
+        event.listen(self, "connect", self._count_connect)
+        event.listen(self, "invalidate", self._count_invalidate)
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.checkout_stats.timeouts += 1
+            raise
+        self.checkout_stats.record_wait(time.perf_counter() - start)
+        return connection
+
+    def _count_connect(self, *_):
+        self.checkout_stats.connects += 1
+
+    def _count_invalidate(self, *_):
+        self.checkout_stats.invalidations += 1
+
+
+class TimedQueuePool(_TimedCheckout, QueuePool):
+    """QueuePool that records checkout wait times"""
+
+
+class TimedNullPool(_TimedCheckout, NullPool):
+    """NullPool that records connection times"""
+
+
+def engine_options(config: dict) -> dict:
+    """Builds the SQLAlchemy engine options from the DB_* settings"""
+    if config.get("DB_PGBOUNCER", False):
+        return {"poolclass": TimedNullPool}
+    options = {
+        "poolclass": TimedQueuePool,
+        "pool_size": config.get("DB_POOL_SIZE", 5),
+        "max_overflow": config.get("DB_MAX_OVERFLOW", 10),
+        "pool_timeout": config.get("DB_POOL_TIMEOUT", 30),
+        "pool_recycle": config.get("DB_POOL_RECYCLE", -1),
+        "pool_pre_ping": config.get("DB_POOL_PRE_PING", True),
+    }
+    timeout = config.get("DB_STATEMENT_TIMEOUT_MS", 0)
+    if timeout:
+        options["connect_args"] = {
+            "options": "-c statement_timeout=%d" % timeout}
+    return options
+
+
+_engines_with_local_timeout = weakref.WeakSet()
+
+
+def install_statement_timeout(engine, config: dict) -> None:
+    """
+    In PgBouncer mode, sets statement_timeout with SET LOCAL at the
+    start of every transaction (pooled mode sets it at connect time)
+    """
+    timeout = config.get("DB_STATEMENT_TIMEOUT_MS", 0)
+    if not config.get("DB_PGBOUNCER", False) or not timeout \
+            or engine in _engines_with_local_timeout:
+        return
+
+    @event.listens_for(engine, "begin")
+    def set_local_statement_timeout(connection):
+        connection.execute("SET LOCAL statement_timeout = %d" % timeout)
+
+    _engines_with_local_timeout.add(engine)
+
+
+def pool_stats(engine) -> dict:
+    """Returns live statistics for the engine's pool"""
+    pool = engine.pool
+    stats = {"pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        max_overflow = pool._max_overflow  # pylint: disable=protected-access
+        stats.update({
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": max(pool.overflow(), 0),
+            "max_overflow": max_overflow,
+            "timeout": pool.timeout(),
+        })
+    if hasattr(pool, "checkout_stats"):
+        stats.update(pool.checkout_stats.as_dict())
+    return stats
@@ -0,0 +1,175 @@
+"""
+On-demand request profiling and slow-query log
+
+Both are off by default and install no hooks at all until enabled:
+
+    PROFILE_SAMPLE_RATE   fraction of requests to run under cProfile
+    PROFILE_TOKEN         a request sending the header
+                          X-Profile: <PROFILE_TOKEN> is profiled too, and
+                          the response names the dump in X-Profile-File
+    PROFILE_DIR           where the .prof dumps are written
+                          (open them with pstats or snakeviz)
+    SLOW_QUERY_MS         log every SQL statement slower than this
+
+Profiles stop when the response is returned, so for streamed responses
+they cover the time to the first byte. Only one request per worker
+thread is profiled at a time. The slow-query log goes to the
+"service.slow_query" logger. It records the statement, the shape of its
+parameters (types and lengths, never the values), the duration and the
+route that ran it.
+"""
+import os
+import re
+import hmac
+import time
+import random
+import logging
+import cProfile
+from typing import Optional
+from flask import Flask, current_app, g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_FILE_HEADER = "X-Profile-File"
+MAX_STATEMENT_LENGTH = 1000
+
+slow_query_logger = logging.getLogger("service.slow_query")
+_slow_query_seconds: Optional[float] = None
+
+
+def init_profiling(app: Flask) -> None:
+    """Installs the hooks enabled in the app config"""
+    sample_rate = app.config.get("PROFILE_SAMPLE_RATE", 0.0)
+    token = app.config.get("PROFILE_TOKEN", "")
+    if sample_rate > 0 or token:
+        app.before_request(_start_profile)
+        app.after_request(_stop_profile)
+        app.teardown_request(_discard_profile)
+    threshold = app.config.get("SLOW_QUERY_MS", 0)
+    if threshold > 0:
+        install_slow_query_log(threshold)
+
+
+######################################################################
+# Request profiling
+######################################################################
+def _start_profile():
+    config = current_app.config
+    token = config.get("PROFILE_TOKEN", "")
+    requested = bool(token) and hmac.compare_digest(
+        request.headers.get(PROFILE_HEADER, ""), token)
+    if not requested and \
+            random.random() >= config.get("PROFILE_SAMPLE_RATE", 0.0):
+        return
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:  # another profiler is active in this process
+        return
+    g.profile = profile
+    g.profile_requested = requested
+
+
+def _stop_profile(response):
+    profile = g.pop("profile", None)
+    if profile is None:
+        return response
+    profile.disable()
+    directory = current_app.config.get("PROFILE_DIR", "profiles")
+    os.makedirs(directory, exist_ok=True)
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    name = "%s-%s-%s-%d.prof" % (
+        time.strftime("%Y%m%dT%H%M%S"), request.method,
+        re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_") or "root",
+        os.getpid())
+    path = os.path.join(directory, name)
+    profile.dump_stats(path)
+    if g.pop("profile_requested", False):
+        response.headers[PROFILE_FILE_HEADER] = name
+    return response
+
+
+def _discard_profile(error=None):
+    # after_request does not run when a request dies with an exception
+    profile = g.pop("profile", None)
+    if profile is not None:
+        profile.disable()
+
+
+######################################################################
+# Slow-query log
+######################################################################
+def install_slow_query_log(threshold_ms: float) -> None:
+    """Logs statements slower than threshold_ms on every engine"""
+    global _slow_query_seconds  # pylint: disable=global-statement
+    _slow_query_seconds = threshold_ms / 1000.0
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor):
+        event.listen(Engine, "before_cursor_execute", _before_cursor)
+        event.listen(Engine, "after_cursor_execute", _after_cursor)
+        event.listen(Engine, "handle_error", _cursor_failed)
+
+
+def uninstall_slow_query_log() -> None:
+    """Removes the slow-query log listeners"""
+    global _slow_query_seconds  # pylint: disable=global-statement
+    _slow_query_seconds = None
+    if event.contains(Engine, "before_cursor_execute", _before_cursor):
+        event.remove(Engine, "before_cursor_execute", _before_cursor)
+        event.remove(Engine, "after_cursor_execute", _after_cursor)
+        event.remove(Engine, "handle_error", _cursor_failed)
+
+
+def parameter_shape(parameters, executemany: bool = False) -> str:
+    """
+    Describes parameters by type and length, without their values
+    e.g. {name: str, products: list[3]} or 500 x {...} for executemany
+    """
+    if executemany:
+        count = len(parameters)
+        return "%d x %s" % (count, parameter_shape(parameters[0])) \
+            if count else "0 x ()"
+    if isinstance(parameters, dict):
+        return "{%s}" % ", ".join(
+            "%s: %s" % (key, _value_shape(value))
+            for key, value in parameters.items())
+    if isinstance(parameters, (list, tuple)):
+        return "(%s)" % ", ".join(_value_shape(value)
+                                  for value in parameters)
+    return _value_shape(parameters)
+
+
+def _value_shape(value) -> str:
+    if value is None:
+        return "null"
+    if isinstance(value, (list, tuple, set, dict)):
+        return "%s[%d]" % (type(value).__name__, len(value))
+    return type(value).__name__
+
+
+def _before_cursor(conn, cursor, statement, parameters, context,
+                   executemany):
+    conn.info.setdefault("slow_query_start", []).append(time.perf_counter())
+
+
+def _after_cursor(conn, cursor, statement, parameters, context,
+                  executemany):
+    elapsed = time.perf_counter() - conn.info["slow_query_start"].pop()
+    if _slow_query_seconds is None or elapsed < _slow_query_seconds:
+        return
+    route = "<no request>"
+    if has_request_context():
+        route = "%s %s" % (request.method, request.url_rule.rule
+                           if request.url_rule else "<unmatched>")
+    slow_query_logger.warning(
+        "slow query %.1fms route=%s params=%s sql=%s",
+        elapsed * 1000, route, parameter_shape(parameters, executemany),
+        " ".join(statement.split())[:MAX_STATEMENT_LENGTH])
+
+
+def _cursor_failed(context):
+    if context.connection is None:
+        return
+    starts = context.connection.info.get("slow_query_start")
+    if starts:
+        starts.pop()
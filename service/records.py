@@ -0,0 +1,62 @@
+"""
+Read-only supplier records
+
+A SupplierRecord holds the columns of one supplier row in __slots__.
+It is built straight from a Core SELECT result, so read paths skip what
+an ORM Supplier costs: __init__ validation, the identity map, attribute
+instrumentation and change tracking. Records are never attached to a
+session and must not be modified; use Supplier to write.
+"""
+from typing import Iterable, List, Sequence
+
+
+class SupplierRecord:
+    """A read-only supplier row that serializes like Supplier"""
+
+    __slots__ = ("id", "name", "email", "address", "products", "version")
+
+    def __init__(self, id=None, name=None, email=None, address=None,
+                 products=None, version=None):
+        # pylint: disable=redefined-builtin,too-many-arguments
+        self.id = id
+        self.name = name
+        self.email = email
+        self.address = address
+        self.products = products
+        self.version = version
+
+    def __repr__(self):
+        return "<SupplierRecord %r, id=%s>" % (self.name, self.id)
+
+    def __eq__(self, other):
+        if not isinstance(other, SupplierRecord):
+            return False
+        return all(getattr(self, field) == getattr(other, field)
+                   for field in self.__slots__)
+
+    @classmethod
+    def from_rows(cls, fields: Sequence[str],
+                  rows: Iterable[tuple]) -> List["SupplierRecord"]:
+        """
+        Builds records from result rows whose columns are fields,
+        in that order
+        """
+        if tuple(fields) == cls.__slots__:
+            return [cls(*row) for row in rows]
+        return [cls(**dict(zip(fields, row))) for row in rows]
+
+    def serialize_to_dict(self, fields: Sequence[str] = None) -> dict:
+        """
+        Serializes a record into the same dictionary as Supplier
+        fields limits the output to a sparse fieldset
+        """
+        if fields:
+            return {field: getattr(self, field) for field in fields}
+        return {
+            "id": self.id,
+            "name": self.name,
+            "email": self.email,
+            "address": self.address,
+            "products": self.products,
+            "version": self.version,
+        }
@@ -1,9 +1,21 @@
 import os
+import json
 import logging
-from typing import Tuple
-from flask import jsonify, Response, request, make_response
-from werkzeug.exceptions import BadRequest, abort
-from service.supplier import Supplier
+from typing import Iterator, List, Optional, Tuple
+from flask import jsonify, Response, request, make_response, url_for, \
+    stream_with_context
+from werkzeug.exceptions import BadRequest, Gone, abort
+from sqlalchemy.exc import DataError, IntegrityError
+from service.supplier import INT4_MAX, INT4_MIN, Supplier, db
+from service.supplier_exception import SupplierException, \
+    VersionConflict, WrongArgType
+from service.pagination import encode_cursor, decode_cursor
+from service.changes import head, oldest, read_changes, wait_changes
+from service.export import EXPORTERS, MIMETYPES
+from service.pool import pool_stats
+from service.metrics import render_metrics
+from service.serializers import Serializer, parse_fields
+from service.logs import log_request_body
 
 from service import status, app
 
@@ -22,6 +34,11 @@ if DEBUG:
 else:
     app.logger.setLevel(logging.INFO)
 
+serializer = Serializer(app.config["JSON_BACKEND"])
+
+# longer search strings are not type-ahead and only cost index work
+SEARCH_MAX_LENGTH = 100
+
 
 ######################################################################
 # Application Routes
@@ -34,47 +51,657 @@ def index() -> Tuple[Response, int]:
     return make_response(jsonify(name=message), status.HTTP_200_OK)
 
 
+@app.route("/suppliers", methods=["GET"])
+def list_suppliers() -> Tuple[Response, int]:
+    """
+    Lists suppliers in id order, one page at a time
+    Query args: limit, after (cursor from the previous page),
+    name and email equality filters, product_id (repeated or comma
+    separated) with match=any|all, fields (sparse fieldset)
+    With ids (repeated or comma separated), returns those suppliers
+    instead; see lookup_suppliers
+    """
+    fields = parse_fields(request.args.get("fields"), Supplier.FIELDS)
+    if "ids" in request.args:
+        return get_suppliers_by_ids(get_int_list_arg("ids"), fields)
+    limit = get_limit_arg()
+    after = request.args.get("after")
+    after = decode_cursor(after) if after else None
+    filters = {key: request.args[key]
+               for key in ("name", "email") if key in request.args}
+    product_ids = get_int_list_arg("product_id")
+    match = request.args.get("match", "any")
+    if match not in ("any", "all"):
+        raise BadRequest("match must be any or all")
+
+    # read one extra row to learn whether there is a next page
+    suppliers = Supplier.page_records(limit + 1, after,
+                                      product_ids=product_ids,
+                                      match_all=match == "all",
+                                      fields=fields, **filters)
+    next_url = None
+    if len(suppliers) > limit:
+        suppliers = suppliers[:limit]
+        args = request.args.to_dict(flat=False)
+        args["after"] = encode_cursor(suppliers[-1].id)
+        next_url = url_for("list_suppliers", **args)
+
+    response = serializer.response(
+        {"suppliers": [supplier.serialize_to_dict(fields)
+                       for supplier in suppliers],
+         "next": next_url},
+        status.HTTP_200_OK)
+    if next_url:
+        response.headers["Link"] = '<{}>; rel="next"'.format(next_url)
+    return response
+
+
+@app.route("/suppliers/lookup", methods=["POST"])
+def lookup_suppliers() -> Tuple[Response, int]:
+    """
+    Returns the suppliers whose ids are in {"ids": [...]}, for lists too
+    long for GET /suppliers?ids=
+    Query args: fields (sparse fieldset)
+    """
+    check_content_type_is_json()
+    body = request.get_json()
+    if not isinstance(body, dict) or not isinstance(body.get("ids"), list):
+        raise BadRequest('an {"ids": [...]} object is expected')
+    ids = body["ids"]
+    if not all(isinstance(id, int) and not isinstance(id, bool)
+               for id in ids):
+        raise BadRequest("ids must be integers")
+    fields = parse_fields(request.args.get("fields"), Supplier.FIELDS)
+    return get_suppliers_by_ids(ids, fields)
+
+
+@app.route("/suppliers/search", methods=["GET"])
+def search_suppliers() -> Tuple[Response, int]:
+    """
+    Searches suppliers by name, email and address for type-ahead
+    Query args: q, limit, fields (sparse fieldset)
+    Returns the best matches first
+    """
+    query = request.args.get("q", "").strip()
+    if not query:
+        raise BadRequest("q is required")
+    if len(query) > SEARCH_MAX_LENGTH:
+        raise BadRequest("q is limited to %d characters" % SEARCH_MAX_LENGTH)
+    limit = get_limit_arg(app.config["SEARCH_DEFAULT_LIMIT"])
+    fields = parse_fields(request.args.get("fields"), Supplier.FIELDS)
+    suppliers = Supplier.search(query, limit, fields)
+    return serializer.response(
+        {"suppliers": [supplier.serialize_to_dict(fields)
+                       for supplier in suppliers]},
+        status.HTTP_200_OK)
+
+
+@app.route("/suppliers/changes", methods=["GET"])
+def list_supplier_changes() -> Tuple[Response, int]:
+    """
+    Pages through the change feed of the suppliers (service/changes.py)
+    Query args: since (cursor from the previous page, or now), limit,
+    wait (seconds to wait for a change when there is none)
+    Returns the changes, the cursor to read on from, and whether more
+    changes are waiting
+    """
+    since = request.args.get("since")
+    limit = get_limit_arg()
+    wait = get_wait_arg()
+    engine = db.engine.execution_options(isolation_level="AUTOCOMMIT")
+    with engine.connect() as connection:
+        if since == "now":
+            after, changes = head(connection), []
+        else:
+            after = decode_cursor(since, 2) if since else (0, 0)
+            first = oldest(connection)
+            # a cursor of a pruned change: the changes after it are gone
+            if after[1] and first is not None and after < first:
+                raise Gone("The changes after this cursor were pruned; "
+                           "resync from an export")
+            if wait:
+                changes = wait_changes(connection, after, limit + 1, wait,
+                                       not app.config["DB_PGBOUNCER"])
+            else:
+                changes = read_changes(connection, after, limit + 1)
+    more = len(changes) > limit
+    changes = changes[:limit]
+    if changes:
+        after = (changes[-1]["txid"], changes[-1]["seq"])
+    return serializer.response(
+        {"changes": [{"id": change["supplier_id"], "op": change["op"],
+                      "version": change["version"],
+                      "changed_at": change["changed_at"].isoformat()}
+                     for change in changes],
+         "next": encode_cursor(after),
+         "more": more},
+        status.HTTP_200_OK)
+
+
+@app.route("/suppliers/export", methods=["GET"])
+def export_suppliers() -> Response:
+    """
+    Streams every supplier as NDJSON (default) or CSV
+    Query args: format=ndjson|csv, fields (sparse fieldset)
+    """
+    export_format = request.args.get("format", "ndjson")
+    if export_format not in EXPORTERS:
+        raise BadRequest("format must be one of {}".format(
+            ", ".join(EXPORTERS)))
+    fields = parse_fields(request.args.get("fields"), Supplier.EXPORT_FIELDS)
+    app.logger.info("Request to export suppliers as %s", export_format)
+    rows = Supplier.stream(app.config["EXPORT_BATCH_SIZE"], fields)
+    return Response(stream_with_context(
+        EXPORTERS[export_format](rows, fields)),
+                    status=status.HTTP_200_OK,
+                    mimetype=MIMETYPES[export_format])
+
+
 @app.route("/suppliers", methods=["POST"])
 def create_supplier() -> Tuple[Response, int]:
     """ Creates a supplier and returns the supplier as a dict """
 
     check_content_type_is_json()
     request_body = request.json
-    app.logger.info("request body: {}".format(request_body))
+    log_request_body(app.logger)
 
     if "name" not in request_body:
         raise BadRequest("missing name")
 
     new_supplier = Supplier.deserialize_from_dict(request_body)
     new_supplier.create()
+    if new_supplier.id is None or new_supplier.version is None:
+        # create() rolled back a write the database refused
+        app.logger.error("the database refused a new supplier")
+        abort(status.HTTP_500_INTERNAL_SERVER_ERROR,
+              "The supplier could not be created")
     message = new_supplier.serialize_to_dict()
 
-    app.logger.info("created new supplier with id {}".format(new_supplier.id))
+    app.logger.info("created new supplier with id %s", new_supplier.id)
+
+    response = serializer.response(message, status.HTTP_201_CREATED)
+    response.set_etag(str(new_supplier.version))
+    return response
+
+
+@app.route("/suppliers/<int:supplier_id>", methods=["GET"])
+def read_supplier(supplier_id: int) -> Tuple[Response, int]:
+    """
+    Returns the supplier with the provided supplier id
+    Honors If-None-Match with a bodiless 304 when the version is unchanged
+    Query args: fields (sparse fieldset)
+    """
+    fields = parse_fields(request.args.get("fields"), Supplier.FIELDS)
+    supplier = Supplier.find_record(supplier_id, fields)
+    etag = str(supplier.version)
+    if fields:  # each fieldset is a representation of its own
+        etag += "-" + ",".join(fields)
+    if request.if_none_match.contains_weak(etag):
+        response = make_response("", status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = serializer.response(supplier.serialize_to_dict(fields),
+                                       status.HTTP_200_OK)
+    response.set_etag(etag)
+    return response
+
+
+@app.route("/suppliers/bulk", methods=["POST"])
+def create_suppliers_bulk() -> Tuple[Response, int]:
+    """
+    Creates many suppliers from a JSON array or an NDJSON stream
+    Accepted rows are written in chunked multi-row INSERTs
+    Returns a result per item with the generated id or the error
+    """
+    chunk_size = app.config["BULK_CHUNK_SIZE"]
+    results = []
+    pending = []  # (index, supplier) waiting for the next INSERT
+
+    for index, item in enumerate(read_bulk_items()):
+        try:
+            if isinstance(item, Exception):
+                raise item
+            pending.append((index, Supplier.deserialize_from_dict(item)))
+        except (SupplierException, ValueError) as error:
+            results.append({"index": index,
+                            "status": status.HTTP_400_BAD_REQUEST,
+                            "error": str(error)})
+            continue
+        if len(pending) >= chunk_size:
+            results.extend(flush_bulk_chunk(pending))
+            pending = []
+    results.extend(flush_bulk_chunk(pending))
+
+    results.sort(key=lambda result: result["index"])
+    created = sum(1 for result in results
+                  if result["status"] == status.HTTP_201_CREATED)
+    app.logger.info("bulk created %d of %d suppliers", created, len(results))
+
+    code = status.HTTP_201_CREATED if created == len(results) \
+        else status.HTTP_200_OK
+    return serializer.response(
+        {"created": created, "failed": len(results) - created,
+         "results": results},
+        code)
+
+
+@app.route("/suppliers", methods=["PATCH"])
+def update_suppliers_bulk() -> Tuple[Response, int]:
+    """
+    Applies many partial updates from a JSON array or an NDJSON stream
+    Each item is {"id": ..., <fields to change>}, plus an optional
+    "version" to apply it only at that version
+    Valid changes are written in chunked set-based UPDATEs
+    Returns a result per item: 200 updated, 404 not found,
+    412 at another version, or the error
+    """
+    chunk_size = app.config["BULK_CHUNK_SIZE"]
+    results = []
+    pending = []  # (index, change) waiting for the next UPDATE
+    seen = set()
+
+    for index, item in enumerate(read_bulk_items()):
+        try:
+            if isinstance(item, Exception):
+                raise item
+            change = read_change(item)
+            if change["id"] in seen:
+                raise ValueError("Supplier %s is changed more than once"
+                                 % change["id"])
+        except (SupplierException, ValueError) as error:
+            results.append({"index": index,
+                            "status": status.HTTP_400_BAD_REQUEST,
+                            "error": str(error)})
+            continue
+        seen.add(change["id"])
+        pending.append((index, change))
+        if len(pending) >= chunk_size:
+            results.extend(flush_update_chunk(pending))
+            pending = []
+    results.extend(flush_update_chunk(pending))
 
-    return make_response(jsonify(message), status.HTTP_201_CREATED)
+    results.sort(key=lambda result: result["index"])
+    counts = {code: 0 for code in (status.HTTP_200_OK,
+                                   status.HTTP_404_NOT_FOUND,
+                                   status.HTTP_412_PRECONDITION_FAILED)}
+    for result in results:
+        if result["status"] in counts:
+            counts[result["status"]] += 1
+    app.logger.info("bulk updated %d of %d suppliers",
+                    counts[status.HTTP_200_OK], len(results))
+    return serializer.response(
+        {"updated": counts[status.HTTP_200_OK],
+         "not_found": counts[status.HTTP_404_NOT_FOUND],
+         "conflicts": counts[status.HTTP_412_PRECONDITION_FAILED],
+         "failed": len(results) - sum(counts.values()),
+         "results": results},
+        status.HTTP_200_OK)
 
 
 @app.route("/suppliers/<int:supplier_id>", methods=["PUT"])
 def update_supplier(supplier_id: int) -> Tuple[Response, int]:
     """ 
     Updates a supplier with the provided supplier id 
+    Honors If-Match with 412 when the supplier is at another version
     Returns the updated supplier 
     """
     check_content_type_is_json()
     request_body = request.json
-    app.logger.info("request body: {}".format(request_body))
+    log_request_body(app.logger)
 
+    expected_version = get_if_match_version()
     supplier = Supplier.find(supplier_id)
-    supplier.update(request_body)
+    supplier.update(request_body, expected_version)
     message = supplier.serialize_to_dict()
 
-    return make_response(jsonify(message), status.HTTP_200_OK)
+    response = serializer.response(message, status.HTTP_200_OK)
+    response.set_etag(str(supplier.version))
+    return response
+
+
+@app.route("/suppliers/<int:supplier_id>", methods=["PATCH"])
+def patch_supplier(supplier_id: int) -> Tuple[Response, int]:
+    """
+    Changes only the fields in the body, in a single UPDATE
+    Honors If-Match with 412 when the supplier is at another version
+    Returns the id, the new version and the changed fields, plus any
+    other fields asked for with ?fields=
+    """
+    check_content_type_is_json()
+    request_body = request.json
+    fields = parse_fields(request.args.get("fields"), Supplier.FIELDS)
+    expected_version = get_if_match_version()
+    record = Supplier.patch(supplier_id, request_body, expected_version,
+                            fields)
+    returned = ["id", "version"] + [field
+                                    for field in Supplier.UPDATABLE_FIELDS
+                                    if field in request_body]
+    returned += [field for field in fields or () if field not in returned]
+    response = serializer.response(record.serialize_to_dict(returned),
+                                   status.HTTP_200_OK)
+    response.set_etag(str(record.version))
+    return response
+
+
+@app.route("/suppliers/<int:supplier_id>/products", methods=["GET"])
+def list_supplier_products(supplier_id: int) -> Tuple[Response, int]:
+    """
+    Lists the product ids of a supplier in id order, one page at a time
+    Query args: limit, after (cursor from the previous page)
+    """
+    limit = get_limit_arg()
+    after = request.args.get("after")
+    after = decode_cursor(after) if after else None
+    # read one extra id to learn whether there is a next page
+    products = Supplier.page_products(supplier_id, limit + 1, after)
+    next_url = None
+    if len(products) > limit:
+        products = products[:limit]
+        next_url = url_for("list_supplier_products", supplier_id=supplier_id,
+                           limit=limit, after=encode_cursor(products[-1]))
+    response = serializer.response(
+        {"id": supplier_id, "products": products, "next": next_url},
+        status.HTTP_200_OK)
+    if next_url:
+        response.headers["Link"] = '<{}>; rel="next"'.format(next_url)
+    return response
+
+
+@app.route("/suppliers/<int:supplier_id>/products", methods=["POST"])
+def add_supplier_products(supplier_id: int) -> Tuple[Response, int]:
+    """
+    Adds the product ids in {"products": [...]} that the supplier does
+    not carry yet, server-side in a single statement
+    Honors If-Match with 412 when the supplier is at another version
+    Returns the number of products added and the supplier version
+    """
+    product_ids = get_products_body()
+    added, version = Supplier.add_products(supplier_id, product_ids,
+                                           get_if_match_version())
+    response = serializer.response(
+        {"id": supplier_id, "added": added, "version": version},
+        status.HTTP_200_OK)
+    response.set_etag(str(version))
+    return response
+
+
+@app.route("/suppliers/<int:supplier_id>/products", methods=["DELETE"])
+def remove_supplier_products(supplier_id: int) -> Tuple[Response, int]:
+    """
+    Removes the product ids in {"products": [...]} from the supplier,
+    server-side in a single statement
+    Honors If-Match with 412 when the supplier is at another version
+    Returns the number of products removed and the supplier version
+    """
+    product_ids = get_products_body()
+    removed, version = Supplier.remove_products(supplier_id, product_ids,
+                                                get_if_match_version())
+    response = serializer.response(
+        {"id": supplier_id, "removed": removed, "version": version},
+        status.HTTP_200_OK)
+    response.set_etag(str(version))
+    return response
+
+
+@app.route("/internal/cache", methods=["GET"])
+def cache_stats() -> Tuple[Response, int]:
+    """ Returns the hit, miss and eviction counters of the supplier cache """
+    return make_response(jsonify(Supplier.cache.stats()), status.HTTP_200_OK)
+
+
+@app.route("/internal/catalog", methods=["GET"])
+def catalog_stats() -> Tuple[Response, int]:
+    """ Returns the size and counters of the product catalog """
+    return make_response(jsonify(Supplier.catalog.stats()),
+                         status.HTTP_200_OK)
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics() -> Response:
+    """ Returns the service metrics in the Prometheus text format """
+    body, content_type = render_metrics()
+    return Response(body, status=status.HTTP_200_OK,
+                    content_type=content_type)
+
+
+@app.route("/internal/pool", methods=["GET"])
+def database_pool_stats() -> Tuple[Response, int]:
+    """ Returns live statistics of this worker's database pool """
+    return make_response(jsonify(pool_stats(db.engine)), status.HTTP_200_OK)
 
 
 ######################################################################
 #  U T I L I T Y   F U N C T I O N S
 ######################################################################
 
+def get_if_match_version() -> Optional[int]:
+    """
+    Reads the supplier version the client expects from If-Match
+    Returns None when there is no precondition (no header or *)
+    """
+    if_match = request.if_match
+    if not if_match or if_match.star_tag:
+        return None
+    etags = if_match.as_set()  # strong tags only, as If-Match requires
+    if len(etags) != 1:
+        raise VersionConflict("If-Match must carry exactly one strong ETag")
+    try:
+        return int(etags.pop())
+    except ValueError as error:
+        raise VersionConflict("If-Match does not match any version") \
+            from error
+
+
+def get_limit_arg(default: int = None) -> int:
+    """
+    Reads the page size from the limit query arg
+    default defaults to LIST_DEFAULT_LIMIT
+    """
+    limit = request.args.get("limit")
+    if limit is None:
+        return default or app.config["LIST_DEFAULT_LIMIT"]
+    try:
+        limit = int(limit)
+    except ValueError as error:
+        raise BadRequest("limit must be an integer") from error
+    if limit <= 0:
+        raise BadRequest("limit must be positive")
+    return min(limit, app.config["LIST_MAX_LIMIT"])
+
+
+def get_wait_arg() -> float:
+    """Reads the long-poll wait in seconds, up to CHANGES_MAX_WAIT"""
+    wait = request.args.get("wait", "0")
+    try:
+        wait = float(wait)
+    except ValueError as error:
+        raise BadRequest("wait must be a number of seconds") from error
+    if not 0 <= wait < float("inf"):
+        raise BadRequest("wait must not be negative")
+    return min(wait, app.config["CHANGES_MAX_WAIT"])
+
+
+def get_int_list_arg(name: str) -> List[int]:
+    """
+    Reads integers from repeated or comma separated name args
+    Values outside the range of the integer columns are refused
+    """
+    values = []
+    for value in request.args.getlist(name):
+        for part in value.split(","):
+            try:
+                values.append(int(part))
+            except ValueError as error:
+                raise BadRequest(
+                    "%s must be an integer, got %s" % (name, part)) \
+                    from error
+            if not INT4_MIN <= values[-1] <= INT4_MAX:
+                raise BadRequest("%s must be between %d and %d, got %s"
+                                 % (name, INT4_MIN, INT4_MAX, part))
+    return values
+
+
+def get_suppliers_by_ids(ids: List[int],
+                         fields: Optional[List[str]]) -> Tuple[Response, int]:
+    """
+    Answers a multi-get: the suppliers found, in request order, and the
+    ids that were not found, with one query for all of them
+    """
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        raise BadRequest("ids must list at least one supplier id")
+    if len(ids) > app.config["MULTI_GET_MAX_IDS"]:
+        raise BadRequest("at most %d ids can be looked up at once"
+                         % app.config["MULTI_GET_MAX_IDS"])
+    found = Supplier.find_records(ids, fields)
+    return serializer.response(
+        {"suppliers": [found[id].serialize_to_dict(fields)
+                       for id in ids if id in found],
+         "missing": [id for id in ids if id not in found]},
+        status.HTTP_200_OK)
+
+
+BULK_CONTENT_TYPES = ("application/json", "application/x-ndjson",
+                      "application/ndjson")
+
+
+def read_bulk_items() -> Iterator:
+    """
+    Yields the items of a bulk request body
+    A JSON array is parsed whole; NDJSON is read line by line.
+    Lines that are not valid JSON are yielded as the ValueError
+    so that they get their own per-item result.
+    """
+    content_type = request.mimetype
+    if content_type not in BULK_CONTENT_TYPES:
+        app.logger.error("Invalid Content-Type: %s", content_type)
+        abort(
+            status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            "Content-Type must be one of {}".format(
+                ", ".join(BULK_CONTENT_TYPES)),
+        )
+    if content_type == "application/json":
+        items = request.get_json()
+        if not isinstance(items, list):
+            raise BadRequest("a JSON array of suppliers is expected")
+        yield from items
+        return
+    for line in request.stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as error:
+            yield error
+
+
+def database_error_message(error: Exception) -> str:
+    """
+    First line of the database error behind error, without the SQL
+    statement and parameters (supplier data) that SQLAlchemy adds
+    """
+    cause = getattr(error, "orig", None)
+    if cause is None:
+        return type(error).__name__
+    lines = str(cause).strip().splitlines()
+    return lines[0] if lines else type(cause).__name__
+
+
+def flush_bulk_chunk(pending: List[Tuple[int, Supplier]]) -> List[dict]:
+    """
+    Inserts one chunk of validated suppliers and reports each item
+    If Postgres rejects a value, the chunk is retried one supplier at a
+    time so that only the offending items fail
+    """
+    if not pending:
+        return []
+    try:
+        ids = Supplier.create_many([supplier for _, supplier in pending])
+    except (DataError, IntegrityError) as error:
+        if len(pending) > 1:
+            return [result for item in pending
+                    for result in flush_bulk_chunk([item])]
+        code = status.HTTP_400_BAD_REQUEST if isinstance(error, DataError) \
+            else status.HTTP_409_CONFLICT
+        return [{"index": pending[0][0], "status": code,
+                 "error": database_error_message(error)}]
+    except Exception as error:  # pylint: disable=broad-except
+        app.logger.error("bulk chunk of %d failed: %s", len(pending),
+                         database_error_message(error))
+        return [{"index": index,
+                 "status": status.HTTP_500_INTERNAL_SERVER_ERROR,
+                 "error": "chunk could not be written, retry this item"}
+                for index, _ in pending]
+    return [{"index": index, "status": status.HTTP_201_CREATED, "id": id}
+            for (index, _), id in zip(pending, ids)]
+
+
+def get_products_body() -> List[int]:
+    """Reads the product ids of a {"products": [...]} JSON body"""
+    check_content_type_is_json()
+    body = request.get_json()
+    if not isinstance(body, dict) or "products" not in body:
+        raise BadRequest('a {"products": [...]} object is expected')
+    return body["products"]
+
+
+def read_change(item) -> dict:
+    """
+    Checks one item of a bulk update
+    Returns the change with its id, the fields and the optional version
+    """
+    if not isinstance(item, dict):
+        raise WrongArgType("<class 'dict'> expected for a change, "
+                           "got %s" % type(item))
+    change = Supplier.check_changes(item)
+    if not change:
+        raise ValueError("no fields to update, expected some of %s"
+                         % ", ".join(Supplier.UPDATABLE_FIELDS))
+    for key in ("id", "version"):
+        value = item.get(key)
+        if (value is None and key == "id") or \
+                (value is not None and
+                 (not isinstance(value, int) or isinstance(value, bool))):
+            raise WrongArgType("<class 'int'> expected for %s, got %s"
+                               % (key, type(value)))
+        change[key] = value
+    return change
+
+
+def flush_update_chunk(pending: List[Tuple[int, dict]]) -> List[dict]:
+    """
+    Updates one chunk of checked changes and reports each item
+    If Postgres rejects a value, the chunk is retried one change at a
+    time so that only the offending items fail
+    """
+    if not pending:
+        return []
+    try:
+        outcome = Supplier.update_many([change for _, change in pending])
+    except (DataError, IntegrityError) as error:
+        if len(pending) > 1:
+            return [result for item in pending
+                    for result in flush_update_chunk([item])]
+        return [{"index": pending[0][0], "id": pending[0][1]["id"],
+                 "status": status.HTTP_400_BAD_REQUEST,
+                 "error": database_error_message(error)}]
+    except Exception as error:  # pylint: disable=broad-except
+        app.logger.error("bulk update chunk of %d failed: %s",
+                         len(pending), database_error_message(error))
+        return [{"index": index, "id": change["id"],
+                 "status": status.HTTP_500_INTERNAL_SERVER_ERROR,
+                 "error": "chunk could not be written, retry this item"}
+                for index, change in pending]
+    codes = {}
+    for key, code in (("updated", status.HTTP_200_OK),
+                      ("not_found", status.HTTP_404_NOT_FOUND),
+                      ("conflicts", status.HTTP_412_PRECONDITION_FAILED)):
+        codes.update(dict.fromkeys(outcome[key], code))
+    return [{"index": index, "id": change["id"],
+             "status": codes[change["id"]]}
+            for index, change in pending]
+
+
 def check_content_type_is_json():
     """Checks that the media type is correct"""
     content_type = request.headers.get("Content-Type")
@@ -0,0 +1,142 @@
+"""
+Schema management
+
+The schema is created and upgraded by an explicit step,
+    flask suppliers db-init
+which creates the missing tables, runs the MIGRATIONS of every version
+above the one stamped in the schema_version table, in order, then stamps
+SCHEMA_VERSION. It holds an advisory lock while it does, so concurrent
+runs wait for each other instead of racing on the catalogs. At boot a
+worker then does what DB_SCHEMA_MODE says:
+
+    auto   -- one SELECT of the stamped version, and the db-init step
+              only if it is behind (convenient for development and
+              tests; an up to date database gets no DDL)
+    check  -- one SELECT to verify the stamped version, and refuse to
+              start on a mismatch
+    off    -- nothing; no database round trip at all
+
+create_all skips the tables that already exist, so whenever the models
+change the schema, bump SCHEMA_VERSION and add the steps that bring an
+existing database there to MIGRATIONS. Steps are SQL statements, or
+functions of the connection, and must be idempotent (IF NOT EXISTS ...):
+a new database gets both the tables of create_all and every step.
+"""
+import logging
+from typing import Optional
+from sqlalchemy import text
+from sqlalchemy.exc import ProgrammingError
+from service.supplier import (db, create_change_triggers,
+                              create_search_indexes,
+                              PRODUCTS_STATISTICS_TARGET)
+
+SCHEMA_VERSION = 5
+SCHEMA_MODES = ("auto", "check", "off")
+# key of the advisory lock held while the schema is created or migrated
+SCHEMA_LOCK = 0x5c4e3a
+
+MIGRATIONS = {
+    # the supplier table of the first releases: row versions, keyset and
+    # product lookup indexes, larger products statistics
+    1: [
+        "ALTER TABLE supplier ADD COLUMN IF NOT EXISTS "
+        "version integer NOT NULL DEFAULT 1",
+        "CREATE INDEX IF NOT EXISTS ix_supplier_name_id "
+        "ON supplier (name, id)",
+        "CREATE INDEX IF NOT EXISTS ix_supplier_email_id "
+        "ON supplier (email, id)",
+        "CREATE INDEX IF NOT EXISTS ix_supplier_products "
+        "ON supplier USING gin (products)",
+        "ALTER TABLE supplier ALTER COLUMN products "
+        "SET STATISTICS %d" % PRODUCTS_STATISTICS_TARGET,
+    ],
+    2: [],  # supplier_product, made by create_all
+    3: [create_search_indexes],  # GET /suppliers/search
+    # supplier_change, made by create_all, and the triggers filling it
+    4: [create_change_triggers],
+    # ix_supplier_name_prefix, for the name prefixes search ranks first
+    5: [create_search_indexes],
+}
+
+logger = logging.getLogger("flask.app")
+
+schema_version = db.Table(
+    "schema_version", db.metadata,
+    db.Column("version", db.Integer, nullable=False),
+)
+
+
+class SchemaVersionError(RuntimeError):
+    """The database schema is missing or at another version"""
+
+
+def create_schema() -> None:
+    """
+    Creates the missing tables, runs the migrations the database lacks
+    and stamps SCHEMA_VERSION
+    Throws SchemaVersionError if the database is at a newer version
+    """
+    with db.engine.begin() as connection:
+        connection.execute(text("SELECT pg_advisory_xact_lock(:key)"),
+                           key=SCHEMA_LOCK)
+        version = stamped_version(connection)
+        if version is not None and version > SCHEMA_VERSION:
+            raise SchemaVersionError(
+                "Database schema is at version %d, newer than the %d of "
+                "the service" % (version, SCHEMA_VERSION))
+        if version == SCHEMA_VERSION:
+            return
+        logger.info("Migrating the schema from version %s to %d",
+                    version, SCHEMA_VERSION)
+        db.metadata.create_all(bind=connection)
+        for step_version in range((version or 0) + 1, SCHEMA_VERSION + 1):
+            for step in MIGRATIONS[step_version]:
+                if callable(step):
+                    step(connection)
+                else:
+                    connection.execute(text(step))
+        connection.execute(schema_version.delete())
+        connection.execute(schema_version.insert().values(
+            version=SCHEMA_VERSION))
+
+
+def stamped_version(connection) -> Optional[int]:
+    """Returns the stamped schema version, or None if there is none"""
+    if not connection.execute(
+            text("SELECT to_regclass('schema_version') IS NOT NULL")
+    ).scalar():
+        return None
+    return connection.execute(db.select([schema_version.c.version])).scalar()
+
+
+def current_version():
+    """Returns the stamped schema version, or None if there is none"""
+    try:
+        return db.session.execute(
+            db.select([schema_version.c.version])).scalar()
+    except ProgrammingError:  # the table does not exist
+        db.session.rollback()
+        return None
+    finally:
+        db.session.remove()
+
+
+def check_schema() -> None:
+    """Throws SchemaVersionError unless the schema is at SCHEMA_VERSION"""
+    version = current_version()
+    if version != SCHEMA_VERSION:
+        raise SchemaVersionError(
+            "Database schema is at version %s, the service needs %d; "
+            "run flask suppliers db-init" % (version, SCHEMA_VERSION))
+
+
+def prepare_schema(mode: str) -> None:
+    """Creates, checks or ignores the schema according to mode"""
+    if mode == "auto":
+        if current_version() != SCHEMA_VERSION:
+            create_schema()
+    elif mode == "check":
+        check_schema()
+    elif mode != "off":
+        raise ValueError("DB_SCHEMA_MODE must be one of %s, not %r"
+                         % (", ".join(SCHEMA_MODES), mode))
@@ -0,0 +1,65 @@
+"""
+JSON serializers for supplier responses
+
+Responses are encoded compactly (no indentation or spaces). The encoder
+backend is pluggable: "orjson" when the optional orjson package is
+installed, otherwise the standard library "json". JSON_BACKEND=auto
+picks the fastest one available.
+"""
+import json
+from typing import Callable, Dict, Iterable, List, Optional
+from flask import Response
+from werkzeug.exceptions import BadRequest
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+_encoder = json.JSONEncoder(separators=(",", ":"))
+
+
+def _dumps_json(data) -> bytes:
+    return _encoder.encode(data).encode("utf-8")
+
+
+BACKENDS: Dict[str, Callable[[object], bytes]] = {"json": _dumps_json}
+if orjson is not None:
+    BACKENDS["orjson"] = orjson.dumps
+
+
+class Serializer:
+    """Encodes payloads with the selected JSON backend"""
+
+    def __init__(self, backend: str = "auto"):
+        if backend == "auto":
+            backend = "orjson" if "orjson" in BACKENDS else "json"
+        if backend not in BACKENDS:
+            raise ValueError("JSON backend %r is not available" % backend)
+        self.backend = backend
+        self.dumps = BACKENDS[backend]
+
+    def response(self, payload, status: int) -> Response:
+        """Returns payload as a compact application/json response"""
+        return Response(self.dumps(payload), status=status,
+                        mimetype="application/json")
+
+
+def parse_fields(value: Optional[str],
+                 allowed: Iterable[str]) -> Optional[List[str]]:
+    """
+    Parses a sparse fieldset such as "name,email"
+    The id is always included. Returns None when value is empty.
+    Throws BadRequest on unknown fields
+    """
+    if not value:
+        return None
+    fields = ["id"]
+    for field in value.split(","):
+        field = field.strip()
+        if field not in allowed:
+            raise BadRequest("unknown field %r, expected some of %s"
+                             % (field, ", ".join(allowed)))
+        if field not in fields:
+            fields.append(field)
+    return fields
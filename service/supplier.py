@@ -2,35 +2,90 @@
 This file defines the model for Supplier
 '''
 
+import re
 import json
 import logging
-from typing import List, Set, Union
+from functools import partial
+from typing import Dict, Iterator, List, Optional, Sequence, Set, Union
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, any_, bindparam, cast, event, func, literal, \
+    literal_column, select, text
 from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.orm import load_only, make_transient_to_detached
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy.orm.attributes import get_history, set_committed_value
+from werkzeug.exceptions import NotFound
+from service.cache import CacheBackend, NullCache, make_cache
+from service.catalog import ProductCatalog, NullCatalog, make_catalog
+from service.group_commit import GroupCommitter, make_group_committer
+from service.pool import engine_options, install_statement_timeout
+from service.records import SupplierRecord
 from service.supplier_exception \
     import MissingInfo, WrongArgType, \
-    UserDefinedIdError, OutOfRange
+    UserDefinedIdError, OutOfRange, UnknownProducts, VersionConflict
 
 
 db = SQLAlchemy()
 logger = logging.getLogger("flask.app")
 
+# Most product ids are carried by a handful of suppliers, too few to make
+# the default array statistics, so the planner would guess 0.5% of the
+# table for every products && lookup and skip the GIN index. A larger
+# sample keeps those rare elements in the statistics.
+PRODUCTS_STATISTICS_TARGET = 1000
+
+# Range of the integer (int4) columns; larger values must be refused
+# before they reach a query, where Postgres would type them bigint
+INT4_MIN, INT4_MAX = -2 ** 31, 2 ** 31 - 1
+
+# the :ids of the product statements, typed so that the array operators
+# compare integer[] with integer[]
+PRODUCT_IDS = "CAST(:ids AS integer[])"
+
+# Where the product ids of a supplier live: the products array column, or
+# one row per product in the supplier_product table (for huge catalogs)
+PRODUCT_STORAGES = ("array", "table")
+
+# The text GET /suppliers/search matches, indexed by ix_supplier_search.
+# Email punctuation becomes spaces, so "smith@exa" matches word prefixes.
+SEARCH_DOCUMENT = ("(name || ' ' || translate(coalesce(email, ''), '@.', '  ')"
+                   " || ' ' || coalesce(address, ''))")
+# Matches ranked per search. Broad queries rank an arbitrary sample of
+# this size instead of every match, so their cost stays bounded.
+SEARCH_CANDIDATES = 1000
+
 
 def init_db(app):
     """Initialies the SQLAlchemy app"""
     Supplier.init_db(app)
 
 
+def remove_session(exception=None) -> None:
+    """Rolls back and returns the connection of the session to the pool"""
+    db.session.remove()
+
+
 class Supplier(db.Model):
     '''
     Supplier model that encapsulates
     necessary info about a supplier
     '''
     app: Flask = None
+    cache: CacheBackend = NullCache()
+    catalog: ProductCatalog = NullCatalog()
+    group_commit: Optional[GroupCommitter] = None
+    product_storage: str = "array"
+    search_backend: str = None  # trigram or fulltext, found on first search
     __tablename__ = "supplier"
     __table_args__ = (
         db.CheckConstraint('NOT(email IS NULL AND address IS NULL)'),
+        # serve equality filters in id order for keyset pagination
+        db.Index("ix_supplier_name_id", "name", "id"),
+        db.Index("ix_supplier_email_id", "email", "id"),
+        # reverse lookups with products && / @> (which suppliers carry X)
+        db.Index("ix_supplier_products", "products", postgresql_using="gin"),
     )
 
     id = db.Column(db.Integer, primary_key=True)
@@ -38,6 +93,20 @@ class Supplier(db.Model):
     email = db.Column(db.String(63), nullable=True)
     address = db.Column(db.String(63), nullable=True)
     products = db.Column(ARRAY(db.Integer), nullable=True)
+    # bumped by every UPDATE, which also checks it (optimistic locking)
+    version = db.Column(db.Integer, nullable=False, server_default="1")
+
+    __mapper_args__ = {"version_id_col": version}
+
+    # fields a client can pick with a sparse fieldset (?fields=)
+    FIELDS = ("id", "name", "email", "address", "products", "version")
+    EXPORT_FIELDS = ("id", "name", "email", "address", "products")
+    # fields a client can change
+    UPDATABLE_FIELDS = ("name", "email", "address", "products")
+    # SQL types of the fields, to type the VALUES lists of update_many
+    FIELD_TYPES = {"id": "integer", "name": "varchar", "email": "varchar",
+                   "address": "varchar", "products": "integer[]",
+                   "version": "integer"}
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
@@ -75,14 +144,31 @@ class Supplier(db.Model):
     @classmethod
     def init_db(cls, app: Flask):
         """Initializes the database session
+        Does not touch the schema; see service/schema.py
         :param app: the Flask app
         :type data: Flask
         """
         logger.info("Initializing database")
+        storage = app.config.get("PRODUCT_STORAGE", "array")
+        if storage not in PRODUCT_STORAGES:
+            raise ValueError("PRODUCT_STORAGE must be one of %s, not %r"
+                             % (", ".join(PRODUCT_STORAGES), storage))
         cls.app = app
+        cls.cache = make_cache(app.config)
+        cls.catalog = make_catalog(app.config, db.session.connection)
+        cls.group_commit = make_group_committer(app.config,
+                                                cls._flush_creates)
+        cls.product_storage = storage
+        app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS",
+                              engine_options(app.config))
         db.init_app(app)
         app.app_context().push()
-        db.create_all()  # make our sqlalchemy tables
+        # requests run in the app context pushed above, whose teardown never
+        # comes: end the session of each request, or its connection stays
+        # checked out, idle in (maybe failed) transaction
+        if remove_session not in app.teardown_request_funcs.get(None, ()):
+            app.teardown_request(remove_session)
+        install_statement_timeout(db.engine, app.config)
 
     @classmethod
     def all(cls) -> List["Supplier"]:
@@ -91,16 +177,322 @@ class Supplier(db.Model):
         return cls.query.all()
 
     @classmethod
-    def find(cls, supplier_id: int) -> "Supplier":
+    def page(cls, limit: int, after: int = None,
+             product_ids: List[int] = None, match_all: bool = False,
+             fields: Sequence[str] = None, **filters) -> List["Supplier"]:
+        """
+        Returns up to limit suppliers with an id greater than after,
+        ordered by id (keyset pagination)
+        product_ids keeps suppliers that carry any of the products,
+        or all of them when match_all is True
+        fields limits the columns that are SELECTed
+        filters are column equality filters such as name="Tom"
+        """
+        query = cls.query.filter_by(**filters)
+        if fields:
+            query = query.options(load_only(*fields))
+        if product_ids:
+            query = query.filter(cls.product_filter(product_ids, match_all))
+        if after is not None:
+            query = query.filter(cls.id > after)
+        return query.order_by(cls.id).limit(limit).all()
+
+    @classmethod
+    def all_records(cls) -> List[SupplierRecord]:
+        """Returns all of the suppliers as read-only records, in id order"""
+        logger.info("Processing all supplier records")
+        return cls._records(cls._select_records().order_by(cls.id))
+
+    @classmethod
+    def page_records(cls, limit: int, after: int = None,
+                     product_ids: List[int] = None, match_all: bool = False,
+                     fields: Sequence[str] = None,
+                     **filters) -> List[SupplierRecord]:
+        """
+        Same as page, but returns read-only records selected with Core
+        instead of Supplier objects
+        """
+        statement = cls._select_records(fields)
+        for key, value in filters.items():
+            statement = statement.where(cls.__table__.c[key] == value)
+        if product_ids:
+            statement = statement.where(
+                cls.product_filter(product_ids, match_all))
+        if after is not None:
+            statement = statement.where(cls.id > after)
+        return cls._records(statement.order_by(cls.id).limit(limit), fields)
+
+    @classmethod
+    def find_record(cls, supplier_id: int,
+                    fields: Sequence[str] = None) -> SupplierRecord:
+        """
+        Same as find, but returns a read-only record selected with Core
+        The version is always read. Only full rows are cached
+        Throws NotFound if none is found
+        """
+        cached = cls.cache.get(supplier_id)
+        if cached is not None:
+            return SupplierRecord(**cached)
+        if fields and "version" not in fields:
+            fields = list(fields) + ["version"]
+        records = cls._records(
+            cls._select_records(fields).where(cls.id == supplier_id), fields)
+        if not records:
+            raise NotFound("Supplier %s was not found" % supplier_id)
+        if not fields:
+            cls.cache.set(supplier_id, records[0].serialize_to_dict())
+        return records[0]
+
+    @classmethod
+    def find_records(cls, supplier_ids: Sequence[int],
+                     fields: Sequence[str] = None
+                     ) -> Dict[int, SupplierRecord]:
+        """
+        Finds many suppliers by id, reading through the cache like
+        find_record, with a single SELECT ... WHERE id = ANY(...) for the
+        misses; only full rows are cached
+        Returns the records found by id; missing ids are left out
+        """
+        found, misses = {}, []
+        for supplier_id in dict.fromkeys(supplier_ids):
+            cached = cls.cache.get(supplier_id)
+            if cached is not None:
+                found[supplier_id] = SupplierRecord(**cached)
+            else:
+                misses.append(supplier_id)
+        if not misses:
+            return found
+        if fields and "id" not in fields:
+            fields = ["id"] + list(fields)
+        # one array parameter, whatever the number of ids
+        statement = cls._select_records(fields).where(
+            cls.__table__.c.id == any_(
+                bindparam("ids", misses, type_=ARRAY(db.Integer))))
+        for record in cls._records(statement, fields):
+            found[record.id] = record
+            if not fields:
+                cls.cache.set(record.id, record.serialize_to_dict())
+        return found
+
+    @classmethod
+    def page_products(cls, supplier_id: int, limit: int,
+                      after: int = None) -> List[int]:
+        """
+        Returns up to limit product ids of a supplier greater than after,
+        in product id order (keyset pagination)
+        In table mode only that page is read, through the primary key of
+        supplier_product; in array mode the array is unnested
+        Throws NotFound if the supplier does not exist
+        """
+        if cls.product_storage == "table":
+            statement = (
+                "SELECT product_id FROM supplier_product "
+                "WHERE supplier_id = :id AND product_id > :after "
+                "ORDER BY product_id LIMIT :limit")
+        else:
+            statement = (
+                "SELECT DISTINCT p FROM supplier, unnest(products) AS p "
+                "WHERE id = :id AND p > :after ORDER BY p LIMIT :limit")
+        products = [row[0] for row in db.session.execute(
+            statement, {"id": supplier_id, "limit": limit,
+                        "after": 0 if after is None else after})]
+        if not products and db.session.execute(
+                select([cls.id]).where(cls.id == supplier_id)).first() is None:
+            raise NotFound("Supplier %s was not found" % supplier_id)
+        return products
+
+    @classmethod
+    def search(cls, query: str, limit: int,
+               fields: Sequence[str] = None) -> List[SupplierRecord]:
+        """
+        Returns up to limit suppliers whose name, email or address match
+        query, names starting with query first, then the closest matches
+        With pg_trgm, prefixes, substrings and near misses match through
+        the trigram index; without it, the words of query match through
+        the full-text index, the last one as a prefix (type-ahead)
+        Only SEARCH_CANDIDATES matches are ranked, plus as many names
+        starting with query, found in name order by their own index
+        """
+        if cls.search_backend is None:
+            cls.search_backend = "trigram" if has_trigram(db.session) \
+                else "fulltext"
+        params = {"prefix": escape_like(query) + "%"}
+        if cls.search_backend == "trigram":
+            params["query"] = query
+            condition = ":query <% " + SEARCH_DOCUMENT
+            rank = "word_similarity(:query, %s)" % SEARCH_DOCUMENT
+        else:
+            words = re.findall(r"\w+", query)
+            if not words:
+                return []
+            # exact words let GIN skip through common ones (fast scan)
+            params["query"] = " & ".join(words[:-1] + [words[-1] + ":*"])
+            condition = ("to_tsvector('simple', %s) @@ "
+                         "to_tsquery('simple', :query)" % SEARCH_DOCUMENT)
+            rank = ("ts_rank(to_tsvector('simple', %s), "
+                    "to_tsquery('simple', :query))" % SEARCH_DOCUMENT)
+        # a broad query samples its matches, which could miss the exact
+        # prefixes that rank first, so they are looked up on their own
+        candidates = (
+            "id IN ((SELECT id FROM supplier WHERE {condition} LIMIT {n}) "
+            "UNION (SELECT id FROM supplier "
+            "WHERE lower(name) LIKE lower(:prefix) AND {condition} "
+            "ORDER BY lower(name) LIMIT {n}))".format(
+                condition=condition, n=SEARCH_CANDIDATES))
+        statement = cls._select_records(fields) \
+            .where(text(candidates)) \
+            .order_by(text("name ILIKE :prefix DESC, %s DESC, id" % rank)) \
+            .limit(limit)
+        return SupplierRecord.from_rows(
+            fields or cls.FIELDS, db.session.execute(statement, params))
+
+    @classmethod
+    def _select_records(cls, fields: Sequence[str] = None):
+        """Returns a Core SELECT of fields (all of FIELDS by default)"""
+        return select([cls._column(field) for field in fields or cls.FIELDS])
+
+    @classmethod
+    def _column(cls, field: str):
+        """
+        Returns the SQL expression that reads field
+        In table mode products are aggregated from supplier_product, in
+        product id order, by a subquery over its primary key
+        """
+        if field != "products" or cls.product_storage == "array":
+            return cls.__table__.c[field]
+        return literal_column(
+            "ARRAY(SELECT product_id FROM supplier_product "
+            "WHERE supplier_id = supplier.id ORDER BY product_id)",
+            ARRAY(db.Integer)).label("products")
+
+    @classmethod
+    def _records(cls, statement,
+                 fields: Sequence[str] = None) -> List[SupplierRecord]:
+        """Runs a Core SELECT in the session and wraps its rows"""
+        return SupplierRecord.from_rows(fields or cls.FIELDS,
+                                        db.session.execute(statement))
+
+    @classmethod
+    def product_filter(cls, product_ids: List[int], match_all: bool = False):
+        """
+        Returns the SQL condition for suppliers carrying product_ids
+        Uses the array operators served by the GIN index on products:
+        @> (contains all) or && (overlaps any)
+        In table mode, a semi-join served by the btree index on
+        supplier_product (product_id, supplier_id)
+        """
+        if cls.product_storage == "table":
+            columns = supplier_product.c
+            carriers = select([columns.supplier_id]) \
+                .where(columns.product_id.in_(product_ids))
+            if match_all:
+                carriers = carriers.group_by(columns.supplier_id) \
+                    .having(func.count() == len(set(product_ids)))
+            return cls.id.in_(carriers)
+        # typed, so that the operators compare integer[] with integer[]
+        product_ids = cast(literal(product_ids, ARRAY(db.Integer)),
+                           ARRAY(db.Integer))
+        if match_all:
+            return cls.products.contains(product_ids)
+        return cls.products.overlap(product_ids)
+
+    @classmethod
+    def stream(cls, batch_size: int = 1000,
+               fields: Sequence[str] = None) -> Iterator[dict]:
+        """
+        Yields every supplier as a dictionary in id order
+        Rows are fetched batch_size at a time through a server-side
+        cursor and are never hydrated into Supplier objects, so memory
+        stays constant whatever the size of the table
+        fields are the columns to read, EXPORT_FIELDS by default
+        """
+        logger.info("Streaming all suppliers")
+        fields = fields or cls.EXPORT_FIELDS
+        query = cls.query \
+            .with_entities(*[cls._column(field) for field in fields]) \
+            .order_by(cls.id) \
+            .yield_per(batch_size)
+        for row in query:
+            yield row._asdict()
+
+    @classmethod
+    def find(cls, supplier_id: int,
+             fields: Sequence[str] = None) -> "Supplier":
         """ 
         Finds a supplier with the provided int
+        Reads through the cache, so a hit costs no database round trip
+        On a miss, fields limits the columns that are SELECTed (the
+        version is always read) and the partial row is not cached
         Throws NotFound if none is found
         """
-        return cls.query.get_or_404(supplier_id)
+        cached = cls.cache.get(supplier_id)
+        if cached is not None:
+            return cls._from_cache(cached)
+        if fields:
+            return cls.query \
+                .options(load_only(*fields, "version")) \
+                .get_or_404(supplier_id)
+        supplier = cls.query.get_or_404(supplier_id)
+        cls.cache.set(supplier.id, supplier.serialize_to_dict())
+        return supplier
+
+    @classmethod
+    def _from_cache(cls, data: dict) -> "Supplier":
+        """
+        Rebuilds a supplier from its cached dictionary
+        The supplier is merged into the session as if it had just been
+        loaded, without a SELECT, so it can be updated like any other
+        """
+        supplier = cls.from_row({
+            key: list(value) if isinstance(value, list) else value
+            for key, value in data.items()  # never share lists with the cache
+        })
+        make_transient_to_detached(supplier)
+        return db.session.merge(supplier, load=False)
+
+    @classmethod
+    def from_row(cls, row: dict) -> "Supplier":
+        """
+        Builds a supplier from column values read from the database
+        The values are trusted, so __init__ and its checks are skipped;
+        the supplier is not attached to any session
+        """
+        supplier = cls.__mapper__.class_manager.new_instance()
+        for key, value in row.items():
+            set_committed_value(supplier, key, value)
+        return supplier
 
     ##################################################
     # STATIC METHODS
     ##################################################
+    @staticmethod
+    def check_changes(data: dict) -> dict:
+        """
+        Checks a partial update of a supplier
+        Returns the updatable fields present in data; other keys are
+        ignored
+        """
+        if not isinstance(data, dict):
+            raise WrongArgType("<class 'dict'> expected for data, "
+                               "got %s" % type(data))
+        changes = {field: data[field] for field in Supplier.UPDATABLE_FIELDS
+                   if field in data}
+        if "name" in changes:
+            Supplier._check_name(changes["name"])
+        if "email" in changes:
+            Supplier._check_email(changes["email"])
+        if "address" in changes:
+            Supplier._check_address(changes["address"])
+        if "products" in changes:
+            Supplier._check_product_ids(changes["products"])
+            if changes["products"] is not None:
+                changes["products"] = list(changes["products"])
+        if "email" in changes and "address" in changes and \
+                changes["email"] is None and changes["address"] is None:
+            raise MissingInfo("At least one contact method "
+                              "(email or address) is required")
+        return changes
+
     @staticmethod
     def deserialize_from_dict(data: dict) -> "Supplier":
         """
@@ -142,45 +534,515 @@ class Supplier(db.Model):
     def create(self):
         """
         Creates a supplier to the database
+        In group-commit mode the supplier is written with the others
+        queued at the same time, and errors are raised
         """
         logger.info("Creating %s", self.name)
         self.id = None  # id must be none to generate next primary key
+        if self.group_commit is not None:
+            self.group_commit.submit(self).result()
+            return
         try:
             db.session.add(self)
             db.session.commit()
+            self.cache.set(self.id, self.serialize_to_dict())
+        except Exception:
+            db.session.rollback()
+
+    @classmethod
+    def create_many(cls, suppliers: List["Supplier"]) -> List[int]:
+        """
+        Creates many suppliers with a single multi-row INSERT
+        The batch is committed (or rolled back) as one transaction
+        Returns the generated ids in the same order as suppliers
+        """
+        if not suppliers:
+            return []
+        logger.info("Creating %d suppliers", len(suppliers))
+        table = cls.__table__
+        values = [supplier._insert_values() for supplier in suppliers]
+        if cls.product_storage == "table":
+            for row in values:
+                row["products"] = None
+        statement = table.insert().values(values) \
+            .returning(table.c.id, table.c.version)
+        try:
+            rows = db.session.execute(statement).fetchall()
+            ids = [row[0] for row in rows]
+            if cls.product_storage == "table":
+                cls._insert_products(db.session, {
+                    supplier_id: supplier.products
+                    for supplier, supplier_id in zip(suppliers, ids)})
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        for supplier, (supplier_id, version) in zip(suppliers, rows):
+            supplier.id = supplier_id
+            supplier.version = version
+            if cls.product_storage == "table":
+                supplier.products = cls._stored_order(supplier.products)
+        # the ids were just generated, so nothing cached can be stale; new
+        # rows are not worth caching either, nor evicting hot entries for
+        return ids
+
+    @classmethod
+    def _flush_creates(cls, suppliers: List["Supplier"]) -> list:
+        """
+        Writes a batch of the group commit with create_many
+        If the batch fails, each supplier is retried alone, so that only
+        the faulty ones get an error
+        Returns the id of each supplier, or its exception
+        """
+        with cls.app.app_context():
+            if len(suppliers) > 1:
+                try:
+                    return cls.create_many(suppliers)
+                except Exception:  # pylint: disable=broad-except
+                    pass  # retried one by one below
+            results = []
+            for supplier in suppliers:
+                try:
+                    results.extend(cls.create_many([supplier]))
+                except DataError as error:
+                    results.append(WrongArgType(
+                        str(error.orig).strip().splitlines()[0]))
+                except Exception as error:  # pylint: disable=broad-except
+                    results.append(error)
+            return results
+
+    @classmethod
+    def patch(cls, supplier_id: int, data: dict,
+              expected_version: int = None,
+              fields: Sequence[str] = None) -> SupplierRecord:
+        """
+        Updates only the fields present in data, in a single
+        UPDATE ... RETURNING without reading the row first
+        Only the supplied fields are checked and sent, and only the id,
+        the version, the changed fields and fields are read back
+        Throws NotFound, or VersionConflict if expected_version is given
+        and the supplier is at another version
+        """
+        changes = cls.check_changes(data)
+        if not changes:
+            raise MissingInfo("No fields to update, expected some of %s"
+                              % ", ".join(cls.UPDATABLE_FIELDS))
+        table = cls.__table__
+        returning = ["id", "version"]
+        returning += [field for field in list(changes) + list(fields or ())
+                      if field not in returning]
+        write_products = None
+        if "products" in changes and cls.product_storage == "table":
+            products = {supplier_id: changes["products"]}
+            changes["products"] = None
+            returning.remove("products")  # the rows are written afterwards
+            write_products = partial(cls._replace_products, db.session,
+                                     products)
+        statement = table.update() \
+            .where(table.c.id == supplier_id) \
+            .values(version=table.c.version + 1, **changes) \
+            .returning(*[cls._column(field) for field in returning])
+        if expected_version is not None:
+            statement = statement.where(table.c.version == expected_version)
+        row, version = cls._write_returning(supplier_id, statement,
+                                            then=write_products)
+        if row is None:
+            cls._raise_missed(supplier_id, version, expected_version)
+        record = dict(zip(returning, row))
+        cls.cache.delete(supplier_id, record["version"])
+        if write_products is not None:
+            record["products"] = cls._stored_order(products[supplier_id])
+        return SupplierRecord(**record)
+
+    @classmethod
+    def add_products(cls, supplier_id: int, product_ids: List[int],
+                     expected_version: int = None) -> tuple:
+        """
+        Appends the product ids the supplier does not carry yet, in one
+        UPDATE that never sends the array over the wire
+        Returns the number of products added and the supplier version,
+        which is only bumped if something was added
+        """
+        return cls._change_products(supplier_id, product_ids, True,
+                                    expected_version)
+
+    @classmethod
+    def remove_products(cls, supplier_id: int, product_ids: List[int],
+                        expected_version: int = None) -> tuple:
+        """
+        Removes the product ids from the supplier in one UPDATE
+        Returns the number of products removed and the supplier version,
+        which is only bumped if something was removed
+        """
+        return cls._change_products(supplier_id, product_ids, False,
+                                    expected_version)
+
+    @classmethod
+    def _change_products(cls, supplier_id: int, product_ids: List[int],
+                         add: bool, expected_version: int = None) -> tuple:
+        """Adds or removes product ids server-side; see add_products"""
+        # ids leaving the catalog must stay removable
+        cls._check_product_ids(product_ids, known=add)
+        if not product_ids:
+            raise MissingInfo("At least one product id is required")
+        # keep the first occurrence of each id, in request order
+        product_ids = list(dict.fromkeys(product_ids))
+        if cls.product_storage == "table":
+            statement = cls._change_product_rows(add, expected_version)
+        else:
+            statement = cls._change_product_array(add, expected_version)
+        row, version = cls._write_returning(
+            supplier_id, statement,
+            {"id": supplier_id, "ids": product_ids,
+             "version": expected_version})
+        if row is not None:
+            cls.cache.delete(supplier_id, row[1])
+            return row[0], row[1]
+        if version is None or (expected_version is not None and
+                               version != expected_version):
+            cls._raise_missed(supplier_id, version, expected_version)
+        return 0, version
+
+    @staticmethod
+    def _change_product_array(add: bool, expected_version: int = None):
+        """Statement that adds or removes :ids in the products array"""
+        if add:
+            products = (
+                "s.products || ARRAY(SELECT p FROM unnest({ids}) "
+                "WITH ORDINALITY AS t(p, n) WHERE p <> ALL(s.products) "
+                "ORDER BY n)")
+            changes = "NOT s.products @> {ids}"
+        else:
+            products = (
+                "ARRAY(SELECT p FROM unnest(s.products) "
+                "WITH ORDINALITY AS t(p, n) WHERE p <> ALL({ids}) "
+                "ORDER BY n)")
+            changes = "s.products && {ids}"
+        # the CTE locks the row and keeps its old array to count changes
+        statement = text(
+            "WITH old AS (SELECT id, COALESCE(products, '{{}}') AS products "
+            "FROM supplier WHERE id = :id{version} FOR UPDATE) "
+            "UPDATE supplier SET products = {products}, "
+            "version = supplier.version + 1 "
+            "FROM old AS s WHERE supplier.id = s.id AND {changes} "
+            "RETURNING abs(cardinality(supplier.products) "
+            "- cardinality(s.products)), supplier.version".format(
+                products=products.format(ids=PRODUCT_IDS),
+                changes=changes.format(ids=PRODUCT_IDS),
+                version="" if expected_version is None
+                else " AND version = :version")
+        ).bindparams(bindparam("ids", type_=ARRAY(db.Integer)))
+        return statement
+
+    @staticmethod
+    def _change_product_rows(add: bool, expected_version: int = None):
+        """Statement that inserts or deletes :ids in supplier_product"""
+        if add:
+            changed = (
+                "INSERT INTO supplier_product (supplier_id, product_id) "
+                "SELECT s.id, p FROM s, unnest({ids}) AS p "
+                "ON CONFLICT DO NOTHING RETURNING 1")
+        else:
+            changed = (
+                "DELETE FROM supplier_product USING s "
+                "WHERE supplier_id = s.id AND product_id = ANY({ids}) "
+                "RETURNING 1")
+        # the first CTE locks the row, so the count and version agree
+        return text(
+            "WITH s AS (SELECT id FROM supplier "
+            "WHERE id = :id{version} FOR UPDATE), "
+            "changed AS ({changed}) "
+            "UPDATE supplier SET products = NULL, "
+            "version = supplier.version + 1 "
+            "FROM s WHERE supplier.id = s.id "
+            "AND EXISTS (SELECT 1 FROM changed) "
+            "RETURNING (SELECT count(*) FROM changed), "
+            "supplier.version".format(
+                changed=changed.format(ids=PRODUCT_IDS),
+                version="" if expected_version is None
+                else " AND version = :version")
+        ).bindparams(bindparam("ids", type_=ARRAY(db.Integer)))
+
+    @classmethod
+    def _write_returning(cls, supplier_id: int, statement,
+                         params: dict = None, then=None) -> tuple:
+        """
+        Runs an UPDATE ... RETURNING of one supplier and commits
+        then, if given, is called before the commit when a row matched
+        Returns the row, or None and the current version of the
+        supplier when the UPDATE matched nothing (None if it is gone)
+        Values Postgres rejects throw MissingInfo or WrongArgType
+        """
+        table = cls.__table__
+        try:
+            row = db.session.execute(statement, params).first()
+            version = None
+            if row is not None and then is not None:
+                then()
+            if row is None:
+                version = db.session.execute(
+                    select([table.c.version])
+                    .where(table.c.id == supplier_id)).scalar()
+            db.session.commit()
+        except IntegrityError as error:
+            db.session.rollback()
+            raise MissingInfo("At least one contact method "
+                              "(email or address) is required") from error
+        except DataError as error:
+            db.session.rollback()
+            raise WrongArgType(str(error.orig).strip().splitlines()[0]) \
+                from error
+        except Exception:
+            db.session.rollback()
+            raise
+        return row, version
+
+    @classmethod
+    def backfill_products(cls, batch_size: int = 1000,
+                          clear: bool = False) -> Iterator[tuple]:
+        """
+        Copies the products arrays into supplier_product, batch_size
+        suppliers per transaction, without sending the arrays over the
+        wire; rows already there are kept, so it can be run again
+        clear empties the array columns that were copied
+        Yields the number of suppliers and product rows of each batch
+        """
+        logger.info("Backfilling supplier_product")
+        after = 0
+        while True:
+            try:
+                ids = [row[0] for row in db.session.execute(
+                    "SELECT id FROM supplier WHERE id > :after "
+                    "AND products IS NOT NULL ORDER BY id LIMIT :limit",
+                    {"after": after, "limit": batch_size})]
+                if not ids:
+                    db.session.commit()
+                    return
+                inserted = db.session.execute(
+                    "INSERT INTO supplier_product (supplier_id, product_id) "
+                    "SELECT id, unnest(products) FROM supplier "
+                    "WHERE id = ANY(:ids) ON CONFLICT DO NOTHING",
+                    {"ids": ids}).rowcount
+                if clear:
+                    db.session.execute(
+                        "UPDATE supplier SET products = NULL "
+                        "WHERE id = ANY(:ids)", {"ids": ids})
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            for supplier_id in ids:
+                cls.cache.delete(supplier_id)
+            after = ids[-1]
+            yield len(ids), inserted
+
+    @staticmethod
+    def _stored_order(products: List[int]) -> List[int]:
+        """products as table mode reads them back: sorted, no repeats"""
+        return sorted(set(products or ()))
+
+    @staticmethod
+    def _insert_products(connection, products: Dict[int, List[int]]) -> None:
+        """
+        Inserts the supplier_product rows of products, a dict of supplier
+        id to product ids, with a single INSERT
+        """
+        supplier_ids, product_ids = [], []
+        for supplier_id, ids in products.items():
+            for product_id in set(ids or ()):
+                supplier_ids.append(supplier_id)
+                product_ids.append(product_id)
+        if not supplier_ids:
+            return
+        connection.execute(
+            text("INSERT INTO supplier_product (supplier_id, product_id) "
+                 "SELECT * FROM unnest(:supplier_ids, :product_ids)")
+            .bindparams(bindparam("supplier_ids", type_=ARRAY(db.Integer)),
+                        bindparam("product_ids", type_=ARRAY(db.Integer))),
+            {"supplier_ids": supplier_ids, "product_ids": product_ids})
+
+    @staticmethod
+    def _replace_products(connection,
+                          products: Dict[int, List[int]]) -> None:
+        """Replaces the supplier_product rows of the suppliers in products"""
+        if not products:
+            return
+        connection.execute(
+            supplier_product.delete()
+            .where(supplier_product.c.supplier_id.in_(list(products))))
+        Supplier._insert_products(connection, products)
+
+    @staticmethod
+    def _raise_missed(supplier_id: int, version: int,
+                      expected_version: int) -> None:
+        """Throws NotFound, or VersionConflict if the supplier exists"""
+        if version is None:
+            raise NotFound("Supplier %s was not found" % supplier_id)
+        raise VersionConflict("Supplier %s is at version %s, not %s"
+                              % (supplier_id, version, expected_version))
+
+    @classmethod
+    def update_many(cls, changes: List[dict]) -> dict:
+        """
+        Applies many partial updates, each a dict with the supplier id
+        and the fields to change (checked with check_changes first)
+        A "version" in a change makes it conditional on that version
+        Changes that set the same fields share one
+        UPDATE ... FROM (VALUES ...) statement, and the whole batch is
+        committed (or rolled back) as one transaction
+        Returns the ids that were "updated", "conflicts" (at another
+        version) and "not_found"
+        """
+        if not changes:
+            return {"updated": [], "conflicts": [], "not_found": []}
+        logger.info("Updating %d suppliers", len(changes))
+        groups = {}
+        for change in changes:
+            fields = tuple(field for field in cls.UPDATABLE_FIELDS
+                           if field in change)
+            groups.setdefault(fields, []).append(change)
+        updated = {}  # id -> new version
+        try:
+            for fields, group in groups.items():
+                updated.update(cls._update_group(fields, group))
+            requested = [change["id"] for change in changes]
+            missed = [id for id in requested if id not in updated]
+            existing = set()
+            if missed:
+                existing = {row[0] for row in db.session.execute(
+                    select([cls.id]).where(cls.id.in_(missed)))}
+            db.session.commit()
         except Exception:
             db.session.rollback()
+            raise
+        for supplier_id, version in updated.items():
+            cls.cache.delete(supplier_id, version)
+        return {
+            "updated": [id for id in requested if id in updated],
+            "conflicts": [id for id in missed if id in existing],
+            "not_found": [id for id in missed if id not in existing],
+        }
+
+    @classmethod
+    def _update_group(cls, fields: Sequence[str],
+                      changes: List[dict]) -> Dict[int, int]:
+        """
+        Runs one UPDATE ... FROM (VALUES ...) for changes to fields
+        Returns the new version of each updated supplier by id
+        """
+        table_products = "products" in fields and \
+            cls.product_storage == "table"
+        if table_products:
+            fields = tuple(field for field in fields if field != "products")
+        columns = ("id", "version") + tuple(fields)
+        rows, params = [], {}
+        for index, change in enumerate(changes):
+            values = []
+            for column in columns:
+                key = "%s_%d" % (column, index)
+                params[key] = change.get(column)
+                values.append("CAST(:%s AS %s)"
+                              % (key, cls.FIELD_TYPES[column]))
+            rows.append("(%s)" % ", ".join(values))
+        assignments = ["%s = v.%s" % (field, field) for field in fields]
+        if table_products:
+            assignments.append("products = NULL")
+        assignments.append("version = s.version + 1")
+        statement = (
+            "UPDATE supplier AS s SET {} FROM (VALUES {}) AS v({}) "
+            "WHERE s.id = v.id "
+            "AND (v.version IS NULL OR s.version = v.version) "
+            "RETURNING s.id, s.version").format(
+                ", ".join(assignments), ", ".join(rows), ", ".join(columns))
+        updated = dict(db.session.execute(statement, params).fetchall())
+        if table_products:
+            matched = set(updated)
+            cls._replace_products(db.session, {
+                change["id"]: change["products"] for change in changes
+                if change["id"] in matched})
+        return updated
 
-    def update(self, data: dict) -> "Supplier":
+    def update(self, data: dict, expected_version: int = None) -> "Supplier":
         """
         Updates self with data in dict
-        Saves changes to the database
+        Saves changes to the database in one UPDATE that only matches
+        the row at the version self was read at, and bumps the version
+        Throws VersionConflict if expected_version is given and the
+        supplier is at another version, and the errors of check_changes
         """
-        self.id = data["id"] if "id" in data else self.id
-        self.name = data["name"] if "name" in data else self.name
-        self.email = data["email"] if "email" in data else self.email
-        self.address = data["address"] if "address" in data else self.address
-        self.products = data["products"] if "products" in data else self.products
-        db.session.commit()
+        self.check_changes(data)
+        previous_id = self.id
+        if expected_version is not None and self.version != expected_version:
+            db.session.refresh(self)  # self may be an outdated cached copy
+            if self.version != expected_version:
+                raise VersionConflict(
+                    "Supplier %s is at version %s, not %s"
+                    % (self.id, self.version, expected_version))
+        try:
+            self._assign(data)
+            try:
+                db.session.commit()
+            except StaleDataError as error:
+                db.session.rollback()
+                self.cache.delete(previous_id)
+                if expected_version is not None:
+                    raise VersionConflict(
+                        "Supplier %s was changed by another request"
+                        % previous_id) from error
+                # self was an outdated cached copy, retry on the current row
+                db.session.refresh(self)
+                self._assign(data)
+                db.session.commit()
+        except Exception:
+            db.session.rollback()
+            self.cache.delete(previous_id)
+            raise
+        if previous_id != self.id:
+            self.cache.delete(previous_id)
+        self.cache.set(self.id, self.serialize_to_dict())
 
-    def serialize_to_dict(self) -> dict:
-        """Serializes a supplier into a dictionary"""
+    def serialize_to_dict(self, fields: Sequence[str] = None) -> dict:
+        """
+        Serializes a supplier into a dictionary
+        fields limits the output to a sparse fieldset
+        """
+        if fields:
+            return {field: getattr(self, field) for field in fields}
         return {
             "id": self.id,
             "name": self.name,
             "email": self.email,
             "address": self.address,
             "products": self.products,
+            "version": self.version,
         }
 
     def serialize_to_json(self) -> str:
         '''convert the supplier to JSON formatted string'''
-        return json.dumps(self.serialize_to_dict(), indent=4)
+        return json.dumps(self.serialize_to_dict(), separators=(",", ":"))
 
     ##################################################
-    # PRIVATE INSTANCE METHODS
+    # PRIVATE METHODS
     ##################################################
-    def _check_name(self, name: str) -> None:
+    def _assign(self, data: dict) -> None:
+        '''copy the fields present in data onto self'''
+        self.id = data["id"] if "id" in data else self.id
+        self.name = data["name"] if "name" in data else self.name
+        self.email = data["email"] if "email" in data else self.email
+        self.address = data["address"] if "address" in data else self.address
+        self.products = data["products"] if "products" in data else self.products
+
+    def _insert_values(self) -> dict:
+        '''column values used to INSERT a new supplier'''
+        return {
+            "name": self.name,
+            "email": self.email,
+            "address": self.address,
+            "products": self.products,
+        }
+
+    @staticmethod
+    def _check_name(name: str) -> None:
         '''check the type of name'''
         if name is None:
             raise MissingInfo("Supplier name is required")
@@ -188,36 +1050,227 @@ class Supplier(db.Model):
             raise WrongArgType("class<'str'> expected for supplier name, "
                                "got %s" % type(name))
 
-    def _check_email(self, email: str) -> None:
+    @staticmethod
+    def _check_email(email: str) -> None:
         '''check the type of email'''
         # email format parser may needed
         if email is not None and not isinstance(email, str):
             raise WrongArgType("<class 'str'> expected for email, "
                                "got %s" % type(email))
 
-    def _check_address(self, address: str) -> None:
+    @staticmethod
+    def _check_address(address: str) -> None:
         '''check the type of address'''
         if address is not None and not isinstance(address, str):
             raise WrongArgType("<class 'str'> expected for address, "
                                "got %s" % type(address))
 
-    def _check_product_id(self, product_id: int) -> None:
-        '''check the type of product'''
-        if not isinstance(product_id, int):
-            raise WrongArgType("class<'int'> expected for product ID, "
-                               "got %s" % type(product_id))
-        elif (product_id <= 0 or product_id >= 1e15):
-            raise OutOfRange("Product id is not within range (0, 1e15), "
-                             "got %s" % id)
-        # also need to check if product id is in db
-
-    def _check_product_ids(self, product_ids:
-                           Union[List[int], Set[int]]) -> None:
-        '''check the type of product ids'''
+    @staticmethod
+    def _check_product_ids(product_ids: Union[List[int], Set[int]],
+                           known: bool = True) -> None:
+        '''
+        check the type and range of product ids, and unless known is
+        False that the catalog knows them; the whole list is checked at once
+        '''
         if product_ids is None:
-            product_ids = []
-        elif not isinstance(product_ids, (List, Set)):
+            return
+        if not isinstance(product_ids, (List, Set)):
             raise WrongArgType("class<'List'> or class<'Set'> expected "
                                "for product ids, got %s" % type(product_ids))
-        for id in product_ids:
-            self._check_product_id(id)
+        if not product_ids:
+            return
+        for id_type in set(map(type, product_ids)):
+            if not issubclass(id_type, int):
+                raise WrongArgType("class<'int'> expected for product ID, "
+                                   "got %s" % id_type)
+        # ids are stored as integer, so anything above INT4_MAX would only
+        # fail later, in Postgres
+        if min(product_ids) <= 0 or max(product_ids) > INT4_MAX:
+            raise OutOfRange(
+                "Product ids are not within range (0, %d], got %s"
+                % (INT4_MAX, ", ".join(str(id)
+                                       for id in sorted(set(product_ids))
+                                       if id <= 0 or id > INT4_MAX)))
+        unknown = Supplier.catalog.missing(product_ids) if known else None
+        if unknown:
+            raise UnknownProducts("Unknown product ids: %s"
+                                  % ", ".join(map(str, unknown)))
+
+
+event.listen(
+    Supplier.__table__, "after_create",
+    DDL("ALTER TABLE %(table)s ALTER COLUMN products "
+        "SET STATISTICS {}".format(PRODUCTS_STATISTICS_TARGET)))
+
+
+def has_trigram(bind) -> bool:
+    """Whether the pg_trgm extension is installed in the database"""
+    return bool(bind.execute(
+        "SELECT EXISTS (SELECT 1 FROM pg_extension "
+        "WHERE extname = 'pg_trgm')").scalar())
+
+
+def escape_like(value: str) -> str:
+    """Escapes the LIKE wildcards in value"""
+    return re.sub(r"([\\%_])", r"\\\1", value)
+
+
+def create_search_indexes(bind) -> None:
+    """
+    Creates the indexes of search unless they exist: ix_supplier_search,
+    a trigram index when pg_trgm can be installed and a full-text index
+    otherwise, and ix_supplier_name_prefix for the names starting with
+    the query
+    """
+    if bind.execute(
+            "SELECT EXISTS (SELECT 1 FROM pg_available_extensions "
+            "WHERE name = 'pg_trgm')").scalar():
+        bind.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    if has_trigram(bind):
+        document = "{} gin_trgm_ops".format(SEARCH_DOCUMENT)
+    else:
+        document = "to_tsvector('simple', {})".format(SEARCH_DOCUMENT)
+    bind.execute("CREATE INDEX IF NOT EXISTS ix_supplier_search "
+                 "ON supplier USING gin ({})".format(document))
+    # text_pattern_ops serves LIKE 'prefix%' whatever the collation
+    bind.execute("CREATE INDEX IF NOT EXISTS ix_supplier_name_prefix "
+                 "ON supplier (lower(name) text_pattern_ops)")
+
+
+event.listen(
+    Supplier.__table__, "after_create",
+    lambda target, bind, **kw: create_search_indexes(bind))
+
+supplier_product = db.Table(
+    "supplier_product", db.metadata,
+    db.Column("supplier_id", db.Integer,
+              db.ForeignKey("supplier.id", ondelete="CASCADE",
+                            onupdate="CASCADE"),
+              primary_key=True),
+    db.Column("product_id", db.Integer, primary_key=True),
+    # reverse lookups (which suppliers carry X), in supplier id order
+    db.Index("ix_supplier_product_product", "product_id", "supplier_id"),
+)
+
+# Change log behind GET /suppliers/changes (see service/changes.py): one
+# row per created, updated or deleted supplier, written by a trigger in
+# the transaction of the change, whatever the writer (ORM, bulk, import,
+# ASGI app). Readers page in (txid, seq) order.
+supplier_change = db.Table(
+    "supplier_change", db.metadata,
+    db.Column("seq", db.BigInteger, primary_key=True),
+    db.Column("txid", db.BigInteger, nullable=False,
+              server_default=text("txid_current()")),
+    db.Column("supplier_id", db.Integer, nullable=False),
+    db.Column("op", db.String(6), nullable=False),
+    db.Column("version", db.Integer, nullable=False),
+    db.Column("changed_at", db.DateTime(timezone=True), nullable=False,
+              server_default=func.now()),
+    db.Index("ix_supplier_change_txid_seq", "txid", "seq"),
+)
+
+# Statement triggers with transition tables log a COPY or a multi-row
+# INSERT with one INSERT ... SELECT.
+LOG_CHANGES = DDL("""
+CREATE OR REPLACE FUNCTION supplier_log_change() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO supplier_change (supplier_id, op, version)
+        SELECT id, 'create', version FROM new_rows;
+    ELSIF TG_OP = 'UPDATE' THEN
+        INSERT INTO supplier_change (supplier_id, op, version)
+        SELECT after.id, 'update', after.version
+        FROM new_rows after LEFT JOIN old_rows before
+            ON before.id = after.id
+        WHERE before IS DISTINCT FROM after;
+    ELSE
+        INSERT INTO supplier_change (supplier_id, op, version)
+        SELECT id, 'delete', version FROM old_rows;
+    END IF;
+    IF FOUND THEN
+        -- one notification per transaction: equal ones are folded
+        PERFORM pg_notify('supplier_change', '');
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+DROP TRIGGER IF EXISTS supplier_create ON supplier;
+DROP TRIGGER IF EXISTS supplier_update ON supplier;
+DROP TRIGGER IF EXISTS supplier_delete ON supplier;
+CREATE TRIGGER supplier_create AFTER INSERT ON supplier
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE PROCEDURE supplier_log_change();
+CREATE TRIGGER supplier_update AFTER UPDATE ON supplier
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE PROCEDURE supplier_log_change();
+CREATE TRIGGER supplier_delete AFTER DELETE ON supplier
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE PROCEDURE supplier_log_change();
+""")
+CHANGE_TRIGGERS = ("supplier_create", "supplier_update", "supplier_delete")
+
+
+def create_change_triggers(bind) -> None:
+    """
+    Creates supplier_log_change and the supplier triggers calling it,
+    unless they all exist: DDL locks supplier, and concurrent CREATE OR
+    REPLACE of one function fails, so a migrated schema must issue none
+    """
+    found = bind.execute(
+        text("SELECT count(*) FROM pg_trigger t "
+             "JOIN pg_proc p ON p.oid = t.tgfoid "
+             "WHERE t.tgrelid = to_regclass('supplier') "
+             "AND p.proname = 'supplier_log_change' "
+             "AND t.tgname = ANY(:names)"),
+        names=list(CHANGE_TRIGGERS)).scalar()
+    if found < len(CHANGE_TRIGGERS):
+        bind.execute(LOG_CHANGES)
+
+
+# on the metadata, so that it runs once both tables exist
+event.listen(db.metadata, "after_create",
+             lambda target, bind, **kw: create_change_triggers(bind))
+event.listen(db.metadata, "after_drop",
+             DDL("DROP FUNCTION IF EXISTS supplier_log_change()"))
+
+
+######################################################################
+# Table mode for the ORM: a Supplier keeps its product ids in
+# supplier_product, and its products column stays NULL
+######################################################################
+@event.listens_for(Supplier, "before_insert")
+@event.listens_for(Supplier, "before_update")
+def _hold_products(mapper, connection, target):
+    if Supplier.product_storage != "table":
+        return
+    if target.id is None or get_history(target, "products").has_changes():
+        target.held_products = target.products
+        target.products = None
+
+
+@event.listens_for(Supplier, "after_insert")
+@event.listens_for(Supplier, "after_update")
+def _write_products(mapper, connection, target):
+    if "held_products" not in target.__dict__:
+        return
+    products = target.__dict__.pop("held_products")
+    Supplier._replace_products(connection, {target.id: products})
+    set_committed_value(target, "products", Supplier._stored_order(products))
+
+
+@event.listens_for(Supplier, "load")
+def _read_products(target, context, attrs=None):
+    # merge(load=False) has no context, and the values it copies are whole
+    if Supplier.product_storage != "table" or context is None or \
+            "products" not in target.__dict__ or \
+            (attrs is not None and "products" not in attrs):
+        return
+    columns = supplier_product.c
+    set_committed_value(target, "products", [
+        row[0] for row in context.session.execute(
+            select([columns.product_id])
+            .where(columns.supplier_id == target.id)
+            .order_by(columns.product_id))])
+
+
+event.listen(Supplier, "refresh", _read_products)
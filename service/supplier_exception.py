@@ -21,3 +21,13 @@ class OutOfRange(SupplierException):
 class UserDefinedIdError(SupplierException):
     def __init__(self, *args: object) -> None:
         super().__init__(*args)
+
+
+class VersionConflict(SupplierException):
+    def __init__(self, *args: object) -> None:
+        super().__init__(*args)
+
+
+class UnknownProducts(SupplierException):
+    def __init__(self, *args: object) -> None:
+        super().__init__(*args)
@@ -0,0 +1,187 @@
+"""
+Test cases for the supplier caches
+"""
+import time
+import unittest
+from service.cache import LRUCache, NullCache, SharedCache, DictStore, \
+    RedisStore, make_cache
+
+
+######################################################################
+#  C A C H E   T E S T   C A S E S
+######################################################################
+class TestLRUCache(unittest.TestCase):
+    """Test Cases for the in-process LRU cache"""
+
+    def test_get_and_set(self):
+        """Values can be read back and are counted as hits"""
+        cache = LRUCache(max_size=10, ttl=60)
+        self.assertIsNone(cache.get(1))
+        cache.set(1, {"id": 1})
+        self.assertEqual(cache.get(1), {"id": 1})
+        stats = cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["size"], 1)
+        self.assertEqual(stats["hit_ratio"], 0.5)
+
+    def test_size_bound(self):
+        """The least recently used value is evicted first"""
+        cache = LRUCache(max_size=2, ttl=60)
+        cache.set(1, {"id": 1})
+        cache.set(2, {"id": 2})
+        cache.get(1)
+        cache.set(3, {"id": 3})
+        self.assertIsNone(cache.get(2))
+        self.assertEqual(cache.get(1), {"id": 1})
+        self.assertEqual(cache.get(3), {"id": 3})
+        self.assertEqual(cache.stats()["evictions"], 1)
+        self.assertEqual(len(cache), 2)
+
+    def test_ttl(self):
+        """Expired values are dropped when they are read"""
+        cache = LRUCache(max_size=2, ttl=0.01)
+        cache.set(1, {"id": 1})
+        time.sleep(0.02)
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(cache.stats()["evictions"], 1)
+        self.assertEqual(len(cache), 0)
+
+    def test_delete_and_clear(self):
+        """Values can be invalidated"""
+        cache = LRUCache()
+        cache.set(1, {"id": 1})
+        cache.set(2, {"id": 2})
+        cache.delete(1)
+        cache.delete(5)
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(cache.stats()["invalidations"], 1)
+        cache.clear()
+        self.assertIsNone(cache.get(2))
+
+    def test_versions(self):
+        """Older versions never replace newer ones, nor pass an invalidation"""
+        cache = LRUCache()
+        cache.set(1, {"id": 1, "version": 2})
+        cache.set(1, {"id": 1, "version": 1})
+        self.assertEqual(cache.get(1)["version"], 2)
+        # a read that missed the cache before version 3 was written
+        cache.delete(1, 3)
+        cache.set(1, {"id": 1, "version": 2})
+        self.assertIsNone(cache.get(1))
+        cache.set(1, {"id": 1, "version": 3})
+        self.assertEqual(cache.get(1)["version"], 3)
+        # without a version, only the cached one and older are refused
+        cache.delete(1)
+        cache.set(1, {"id": 1, "version": 3})
+        self.assertIsNone(cache.get(1))
+        cache.set(1, {"id": 1, "version": 4})
+        self.assertEqual(cache.get(1)["version"], 4)
+
+
+class TestSharedCache(unittest.TestCase):
+    """Test Cases for the shared cache over the local stand-in store"""
+
+    def test_shared_between_caches(self):
+        """Two caches on the same store see each other's writes"""
+        store = DictStore()
+        first = SharedCache(store, ttl=60)
+        second = SharedCache(store, ttl=60)
+        first.set(1, {"id": 1, "products": [1, 2]})
+        self.assertEqual(second.get(1), {"id": 1, "products": [1, 2]})
+        second.delete(1)
+        self.assertIsNone(first.get(1))
+        self.assertEqual(first.stats()["misses"], 1)
+        self.assertEqual(second.stats()["hits"], 1)
+
+    def test_ttl_and_clear(self):
+        """Values expire in the store and clear only drops our prefix"""
+        store = DictStore()
+        cache = SharedCache(store, ttl=0.01)
+        cache.set(1, {"id": 1})
+        time.sleep(0.02)
+        self.assertIsNone(cache.get(1))
+        cache = SharedCache(store, ttl=60)
+        cache.set(2, {"id": 2})
+        store.set("other:1", b"1", 60)
+        cache.clear()
+        self.assertIsNone(cache.get(2))
+        self.assertEqual(store.get("other:1"), b"1")
+        self.assertEqual(len(cache), 1)
+
+    def test_versions(self):
+        """A worker cannot store a row older than another worker's write"""
+        store = DictStore()
+        reader = SharedCache(store, ttl=60)
+        writer = SharedCache(store, ttl=60)
+        reader.set(1, {"id": 1, "version": 1})
+        writer.delete(1, 2)
+        self.assertIsNone(reader.get(1))
+        reader.set(1, {"id": 1, "version": 1})  # read before the write
+        self.assertIsNone(writer.get(1))
+        reader.set(1, {"id": 1, "version": 2})
+        self.assertEqual(writer.get(1), {"id": 1, "version": 2})
+        writer.set(1, {"id": 1, "version": 1})
+        self.assertEqual(reader.get(1), {"id": 1, "version": 2})
+
+
+class FakeRedis:
+    """The few redis-py calls RedisStore makes, over a DictStore"""
+
+    def __init__(self):
+        self.values = DictStore()
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, px):
+        self.values.set(key, value, px / 1000)
+
+    def delete(self, key):
+        self.values.delete(key)
+
+    def scan_iter(self, match):
+        return [key for key in list(self.values._values)
+                if key.startswith(match.rstrip("*"))]
+
+
+class TestRedisStore(unittest.TestCase):
+    """Test Cases for the shared cache over a Redis client"""
+
+    def test_shared_cache(self):
+        """Store, expire and flush values through the client"""
+        client = FakeRedis()
+        cache = SharedCache(RedisStore(client), ttl=60)
+        cache.set(1, {"id": 1, "version": 1})
+        self.assertEqual(cache.get(1), {"id": 1, "version": 1})
+        cache.delete(1, 2)
+        cache.set(1, {"id": 1, "version": 1})
+        self.assertIsNone(cache.get(1))
+        client.set("other:1", b"1", 60000)
+        cache.clear()
+        self.assertEqual(list(client.values._values), ["other:1"])
+        SharedCache(RedisStore(client), ttl=0.0001).set(2, {"id": 2})
+        time.sleep(0.01)
+        self.assertIsNone(cache.get(2))
+
+
+class TestMakeCache(unittest.TestCase):
+    """Test Cases for building the cache from the configuration"""
+
+    def test_backends(self):
+        """Each CACHE_BACKEND builds its cache"""
+        cache = make_cache({"CACHE_BACKEND": "lru", "CACHE_MAX_SIZE": 5,
+                            "CACHE_TTL": 3})
+        self.assertIsInstance(cache, LRUCache)
+        self.assertEqual(cache.max_size, 5)
+        self.assertEqual(cache.ttl, 3)
+        store = DictStore()
+        cache = make_cache({"CACHE_BACKEND": "shared"}, store)
+        self.assertIs(cache.store, store)
+        self.assertRaises(ValueError, make_cache, {"CACHE_BACKEND": "shared"})
+        cache = make_cache({"CACHE_BACKEND": "none"})
+        self.assertIsInstance(cache, NullCache)
+        self.assertIsInstance(make_cache({}), NullCache)
+        cache.set(1, {"id": 1})
+        self.assertIsNone(cache.get(1))
+        self.assertRaises(ValueError, make_cache, {"CACHE_BACKEND": "x"})
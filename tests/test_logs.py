@@ -0,0 +1,153 @@
+"""
+Test cases for the asynchronous structured logging
+"""
+import sys
+import json
+import logging
+import threading
+import unittest
+from flask import Flask, g
+from service import app
+from service.logs import AsyncQueueHandler, BodySample, JsonFormatter, \
+    RequestFormatter, log_request_body, REQUEST_ID_HEADER
+
+
+class ListHandler(logging.Handler):
+    """Keeps the formatted records, and the threads that formatted them"""
+
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+        self.threads = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+        self.threads.append(threading.current_thread())
+
+
+class Rendered:
+    """A log argument that remembers the thread that rendered it"""
+
+    def __init__(self):
+        self.thread = None
+
+    def __str__(self):
+        self.thread = threading.current_thread()
+        return "rendered"
+
+
+######################################################################
+#  L O G G I N G   T E S T   C A S E S
+######################################################################
+class TestLogging(unittest.TestCase):
+    """Test Cases for the log queue, the JSON format and request ids"""
+
+    def setUp(self):
+        # other test modules turn logging off
+        self.addCleanup(logging.disable, logging.root.manager.disable)
+        logging.disable(logging.NOTSET)
+
+    def make_logger(self, handler: logging.Handler) -> logging.Logger:
+        """A logger of its own that writes to handler"""
+        logger = logging.getLogger("test_logs.%s" % self.id())
+        logger.handlers = [handler]
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        return logger
+
+    def test_json_format(self):
+        """Format a record as one JSON object, with extras and exceptions"""
+        try:
+            raise ValueError("bad")
+        except ValueError:
+            record = logging.getLogger("x").makeRecord(
+                "x", logging.ERROR, "f", 1, "failed %s", ("once",),
+                sys.exc_info(), extra={"supplier_id": 7})
+        record.request_id = "r1"
+        entry = json.loads(JsonFormatter().format(record))
+        self.assertEqual(entry["message"], "failed once")
+        self.assertEqual(entry["level"], "ERROR")
+        self.assertEqual(entry["request_id"], "r1")
+        self.assertEqual(entry["supplier_id"], 7)
+        self.assertIn("ValueError: bad", entry["exception"])
+        self.assertTrue(entry["time"].endswith("Z"))
+
+    def test_queue(self):
+        """Format and write records in the listener thread, in order"""
+        target = ListHandler()
+        target.setFormatter(RequestFormatter("%(message)s"))
+        handler = AsyncQueueHandler([target])
+        logger = self.make_logger(handler)
+        argument = Rendered()
+        logger.info("first %s", argument)
+        logger.info("second")
+        handler.stop()
+        self.assertEqual(target.lines, ["first rendered", "second"])
+        self.assertIsNot(argument.thread, threading.current_thread())
+        self.assertEqual(set(target.threads), {argument.thread})
+
+    def test_full_queue(self):
+        """Drop records rather than block when the queue is full"""
+        release = threading.Event()
+
+        class Blocked(ListHandler):
+            def emit(self, record):
+                release.wait(5)
+                super().emit(record)
+        target = Blocked()
+        handler = AsyncQueueHandler([target], size=1)
+        logger = self.make_logger(handler)
+        for index in range(10):
+            logger.info("record %d", index)
+        self.assertGreater(handler.dropped, 0)
+        release.set()
+        handler.stop()
+        self.assertEqual(len(target.lines) + handler.dropped, 10)
+
+    def test_request_id(self):
+        """Send back a valid request id, or a generated one"""
+        client = app.test_client()
+        resp = client.get("/", headers={REQUEST_ID_HEADER: "abc-123"})
+        self.assertEqual(resp.headers[REQUEST_ID_HEADER], "abc-123")
+        resp = client.get("/", headers={REQUEST_ID_HEADER: "bad id!"})
+        self.assertRegex(resp.headers[REQUEST_ID_HEADER], r"^[0-9a-f]{32}$")
+
+    def test_request_id_in_records(self):
+        """Add the request id to the records logged during a request"""
+        target = ListHandler()
+        target.setFormatter(JsonFormatter())
+        handler = AsyncQueueHandler([target])
+        logger = self.make_logger(handler)
+        with Flask(__name__).test_request_context():
+            g.request_id = "r42"
+            logger.info("inside")
+        logger.info("outside")
+        handler.stop()
+        entries = [json.loads(line) for line in target.lines]
+        self.assertEqual(entries[0]["request_id"], "r42")
+        self.assertNotIn("request_id", entries[1])
+
+    def test_request_body(self):
+        """Log a truncated sample of the request bodies"""
+        logger = logging.getLogger("test_logs.body")
+        logger.setLevel(logging.INFO)
+        body = json.dumps({"products": list(range(100))})
+        sampled = Flask(__name__)
+        sampled.config.update(LOG_BODY_SAMPLE_RATE=1, LOG_BODY_MAX_BYTES=20)
+        with sampled.test_request_context(method="POST", data=body):
+            with self.assertLogs(logger, "INFO") as logs:
+                log_request_body(logger)
+        self.assertEqual(logs.records[0].getMessage(),
+                         "request body: %s... (%d bytes)"
+                         % (body[:20], len(body)))
+        sampled.config["LOG_BODY_SAMPLE_RATE"] = 0
+        with sampled.test_request_context(method="POST", data=body):
+            with self.assertRaises(AssertionError):  # nothing logged
+                with self.assertLogs(logger, "INFO"):
+                    log_request_body(logger)
+
+    def test_body_sample(self):
+        """Render short bodies whole and long ones truncated"""
+        self.assertEqual(str(BodySample(b"{}", 10)), "{}")
+        self.assertEqual(str(BodySample("é".encode() * 3, 3)),
+                         "é�... (6 bytes)")
@@ -0,0 +1,47 @@
+"""
+Test cases for the Prometheus metrics shared by worker processes
+"""
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+RECORD = """
+from service.metrics import REQUESTS
+REQUESTS.labels("GET", "/suppliers", 200).inc(3)
+"""
+RENDER = """
+import sys
+from service.metrics import render_metrics
+sys.stdout.write(render_metrics()[0].decode())
+"""
+
+
+######################################################################
+#  M E T R I C S   T E S T   C A S E S
+######################################################################
+class TestMultiprocessMetrics(unittest.TestCase):
+    """Test Cases for metrics across gunicorn-like worker processes"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_python(self, code: str) -> str:
+        """Runs code in a new process sharing the metrics directory"""
+        result = subprocess.run([sys.executable, "-c", code], env=self.env,
+                                stdout=subprocess.PIPE, check=True)
+        return result.stdout.decode()
+
+    def test_counters_are_summed_across_processes(self):
+        """Each worker process adds to the same counter"""
+        self.run_python(RECORD)
+        self.run_python(RECORD)
+        text = self.run_python(RENDER)
+        self.assertIn('supplier_http_requests_total{method="GET",'
+                      'route="/suppliers",status="200"} 6.0', text)
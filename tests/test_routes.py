@@ -1,10 +1,15 @@
 import os
+import json
 import logging
 import unittest
+from unittest import mock
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
 
 
 from service import status  # HTTP Status Codes
-from service.supplier import db, init_db
+from service.supplier import Supplier, db, init_db
+from service.cache import LRUCache
 from service.routes import app
 
 # Disable all but ciritcal errors during normal test run
@@ -45,6 +50,7 @@ class TestSupplierServer(unittest.TestCase):
         """Runs before each test"""
         db.drop_all()  # clean up the last tests
         db.create_all()  # create new tables
+        Supplier.cache = LRUCache()  # the cache is off by default
         self.app = app.test_client()
 
     def tearDown(self):
@@ -118,6 +124,31 @@ class TestSupplierServer(unittest.TestCase):
         )
         self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_product_ids_beyond_int4(self):
+        """Refuse product ids Postgres cannot store on every write path"""
+        body = {"name": "TOM", "email": "a", "products": [3000000000]}
+        resp = self.app.post(BASE_URL, json=body,
+                             content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("3000000000", resp.get_json()["error"])
+        resp = self.app.post(BASE_URL, json={"name": "TOM", "email": "a"},
+                             content_type=CONTENT_TYPE_JSON)
+        url = "{}/{}".format(BASE_URL, resp.get_json()["id"])
+        for method in (self.app.put, self.app.patch):
+            resp = method(url, json=body, content_type=CONTENT_TYPE_JSON)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIsNone(self.app.get(url).get_json()["products"])
+
+    def test_create_supplier_refused_by_database(self):
+        """Report a supplier the database refused instead of a null id"""
+        resp = self.app.post(BASE_URL, json={"name": "x" * 64, "email": "a"},
+                             content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code,
+                         status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertIsNone(resp.headers.get("ETag"))
+        resp = self.app.get(BASE_URL)
+        self.assertEqual(resp.get_json()["suppliers"], [])
+
     def test_update_supplier_happy_path(self):
         """ Create a supplier and update it """
 
@@ -162,3 +193,613 @@ class TestSupplierServer(unittest.TestCase):
             "{}/{}".format(BASE_URL, 0), json=test_supplier, content_type=CONTENT_TYPE_JSON
         )
         self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_create_suppliers_bulk_json(self):
+        """ Create several suppliers from a JSON array """
+        self.addCleanup(app.config.__setitem__, "BULK_CHUNK_SIZE",
+                        app.config["BULK_CHUNK_SIZE"])
+        app.config["BULK_CHUNK_SIZE"] = 2
+        test_suppliers = [
+            {"name": "TOM", "email": "a0", "products": [1, 2]},
+            {"name": "ANN", "address": "nyc"},
+            {"email": "missing@name.com"},
+            {"name": "BOB", "email": "bob", "id": 7},
+            {"name": "EVE", "email": "eve", "products": [3]},
+        ]
+        resp = self.app.post(
+            "{}/bulk".format(BASE_URL), json=test_suppliers,
+            content_type=CONTENT_TYPE_JSON
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        body = resp.get_json()
+        self.assertEqual(body["created"], 3)
+        self.assertEqual(body["failed"], 2)
+        results = body["results"]
+        self.assertEqual([r["index"] for r in results], [0, 1, 2, 3, 4])
+        self.assertEqual([r["status"] for r in results],
+                         [201, 201, 400, 400, 201])
+        ids = [r["id"] for r in results if "id" in r]
+        self.assertEqual(len(set(ids)), 3)
+
+        resp = self.app.put(
+            "{}/{}".format(BASE_URL, ids[2]), json={},
+            content_type=CONTENT_TYPE_JSON
+        )
+        self.assertEqual(resp.json["name"], "EVE")
+        self.assertEqual(resp.json["products"], [3])
+
+    def test_create_suppliers_bulk_ndjson(self):
+        """ Create several suppliers from an NDJSON stream """
+        lines = [
+            '{"name": "TOM", "email": "a0"}',
+            '',
+            'not json',
+            '{"name": "ANN", "address": "nyc", "products": [5]}',
+        ]
+        resp = self.app.post(
+            "{}/bulk".format(BASE_URL), data="\n".join(lines),
+            content_type="application/x-ndjson"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        results = resp.get_json()["results"]
+        self.assertEqual([r["status"] for r in results], [201, 400, 201])
+
+    def test_create_suppliers_bulk_rejected_values(self):
+        """ Values rejected by Postgres only fail their own items """
+        self.addCleanup(app.config.__setitem__, "BULK_CHUNK_SIZE",
+                        app.config["BULK_CHUNK_SIZE"])
+        app.config["BULK_CHUNK_SIZE"] = 4
+        test_suppliers = [{"name": "S{}".format(i), "email": "s"}
+                          for i in range(4)]
+        test_suppliers[2]["name"] = "x" * 64
+        resp = self.app.post(
+            "{}/bulk".format(BASE_URL), json=test_suppliers,
+            content_type=CONTENT_TYPE_JSON
+        )
+        results = resp.get_json()["results"]
+        self.assertEqual([r["status"] for r in results],
+                         [201, 201, 400, 201])
+        self.assertIn("too long", results[2]["error"])
+        self.assertNotIn("INSERT", results[2]["error"])
+        self.assertEqual(len(Supplier.all()), 3)
+
+    def test_create_suppliers_bulk_all_created(self):
+        """ A bulk request where every item is created returns 201 """
+        resp = self.app.post(
+            "{}/bulk".format(BASE_URL),
+            json=[{"name": "TOM", "email": "a0"}],
+            content_type=CONTENT_TYPE_JSON
+        )
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(resp.get_json()["created"], 1)
+
+    def test_create_suppliers_bulk_bad_request(self):
+        """ Bulk create rejects bodies that are not an array """
+        resp = self.app.post(
+            "{}/bulk".format(BASE_URL), json={"name": "TOM"},
+            content_type=CONTENT_TYPE_JSON
+        )
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.post(
+            "{}/bulk".format(BASE_URL), data="name,email",
+            content_type="text/csv"
+        )
+        self.assertEqual(resp.status_code,
+                         status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+    def test_list_suppliers_pages(self):
+        """ List suppliers one keyset page at a time """
+        suppliers = [{"name": "S{}".format(i), "email": "s{}".format(i)}
+                     for i in range(5)]
+        self.app.post("{}/bulk".format(BASE_URL), json=suppliers,
+                      content_type=CONTENT_TYPE_JSON)
+
+        names = []
+        url = "{}?limit=2".format(BASE_URL)
+        pages = 0
+        while url:
+            resp = self.app.get(url)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            body = resp.get_json()
+            self.assertLessEqual(len(body["suppliers"]), 2)
+            names.extend(s["name"] for s in body["suppliers"])
+            if body["next"]:
+                self.assertIn(body["next"], resp.headers["Link"])
+            url = body["next"]
+            pages += 1
+        self.assertEqual(pages, 3)
+        self.assertEqual(names, ["S0", "S1", "S2", "S3", "S4"])
+
+    def test_list_suppliers_filtered(self):
+        """ List suppliers filtered by name and email """
+        suppliers = [{"name": "TOM", "email": "a"},
+                     {"name": "ANN", "email": "b"},
+                     {"name": "TOM", "email": "c"}]
+        self.app.post("{}/bulk".format(BASE_URL), json=suppliers,
+                      content_type=CONTENT_TYPE_JSON)
+        resp = self.app.get("{}?name=TOM&limit=1".format(BASE_URL))
+        body = resp.get_json()
+        self.assertEqual([s["email"] for s in body["suppliers"]], ["a"])
+        self.assertIn("name=TOM", body["next"])
+        resp = self.app.get(body["next"])
+        body = resp.get_json()
+        self.assertEqual([s["email"] for s in body["suppliers"]], ["c"])
+        self.assertIsNone(body["next"])
+
+        resp = self.app.get("{}?email=b".format(BASE_URL))
+        self.assertEqual(len(resp.get_json()["suppliers"]), 1)
+
+    def test_list_suppliers_bad_arguments(self):
+        """ List suppliers with a bad limit or cursor """
+        for query in ("limit=abc", "limit=0", "after=!!!", "after=e30"):
+            resp = self.app.get("{}?{}".format(BASE_URL, query))
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_suppliers(self):
+        """ Stream every supplier as NDJSON and as CSV """
+        suppliers = [{"name": "TOM", "email": "a", "products": [1, 2]},
+                     {"name": "ANN", "address": "nyc"}]
+        self.app.post("{}/bulk".format(BASE_URL), json=suppliers,
+                      content_type=CONTENT_TYPE_JSON)
+
+        resp = self.app.get("{}/export".format(BASE_URL))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.mimetype, "application/x-ndjson")
+        rows = [json.loads(line) for line in resp.data.decode().splitlines()]
+        self.assertEqual(rows, [
+            {"id": 1, "name": "TOM", "email": "a", "address": None,
+             "products": [1, 2]},
+            {"id": 2, "name": "ANN", "email": None, "address": "nyc",
+             "products": None},
+        ])
+
+        resp = self.app.get("{}/export?format=csv".format(BASE_URL))
+        self.assertEqual(resp.mimetype, "text/csv")
+        self.assertEqual(resp.data.decode().splitlines(), [
+            "id,name,email,address,products",
+            "1,TOM,a,,1;2",
+            "2,ANN,,nyc,",
+        ])
+
+    def test_get_suppliers_by_ids(self):
+        """ Get many suppliers by id, in request order """
+        suppliers = [{"name": "S%d" % i, "email": "e"} for i in range(3)]
+        self.app.post("{}/bulk".format(BASE_URL), json=suppliers,
+                      content_type=CONTENT_TYPE_JSON)
+
+        resp = self.app.get("{}?ids=3,9,1&ids=3".format(BASE_URL))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        body = resp.get_json()
+        self.assertEqual([s["name"] for s in body["suppliers"]],
+                         ["S2", "S0"])
+        self.assertEqual(body["missing"], [9])
+
+        resp = self.app.post("{}/lookup?fields=name".format(BASE_URL),
+                             json={"ids": [2, 1, 7]},
+                             content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), {
+            "suppliers": [{"id": 2, "name": "S1"}, {"id": 1, "name": "S0"}],
+            "missing": [7]})
+
+    def test_get_suppliers_by_ids_bad_requests(self):
+        """ Reject empty, malformed or too long id lists """
+        for query in ("ids=", "ids=a", "ids=1,2,3,4"):
+            with self.subTest(query=query):
+                app.config["MULTI_GET_MAX_IDS"] = 3
+                try:
+                    resp = self.app.get("{}?{}".format(BASE_URL, query))
+                finally:
+                    app.config["MULTI_GET_MAX_IDS"] = 1000
+                self.assertEqual(resp.status_code,
+                                 status.HTTP_400_BAD_REQUEST)
+        for body in ({"ids": "1"}, {"ids": [1, "2"]}, {"ids": [True]}, []):
+            resp = self.app.post("{}/lookup".format(BASE_URL), json=body,
+                                 content_type=CONTENT_TYPE_JSON)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_search_suppliers(self):
+        """ Search suppliers by name, email and address """
+        suppliers = [{"name": "Acme Tools", "email": "sales@acme.com"},
+                     {"name": "Best Acme", "address": "1 Main St"},
+                     {"name": "Zed", "email": "zed@mainline.io"}]
+        self.app.post("{}/bulk".format(BASE_URL), json=suppliers,
+                      content_type=CONTENT_TYPE_JSON)
+
+        resp = self.app.get("{}/search?q=acm".format(BASE_URL))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        names = [s["name"] for s in resp.get_json()["suppliers"]]
+        self.assertEqual(names, ["Acme Tools", "Best Acme"])
+        resp = self.app.get("{}/search?q=main&limit=1&fields=name"
+                            .format(BASE_URL))
+        self.assertEqual(len(resp.get_json()["suppliers"]), 1)
+        self.assertEqual(set(resp.get_json()["suppliers"][0]),
+                         {"id", "name"})
+        resp = self.app.get("{}/search?q=sales@acme".format(BASE_URL))
+        self.assertEqual([s["id"] for s in resp.get_json()["suppliers"]],
+                         [1])
+        for query in ("", "q=", "q=%20", "q=" + "a" * 101):
+            resp = self.app.get("{}/search?{}".format(BASE_URL, query))
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_suppliers_bad_format(self):
+        """ Export with an unknown format """
+        resp = self.app.get("{}/export?format=xml".format(BASE_URL))
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_suppliers_by_product(self):
+        """ List the suppliers that carry some products """
+        suppliers = [{"name": "A", "email": "a", "products": [1, 2, 3]},
+                     {"name": "B", "email": "b", "products": [2]},
+                     {"name": "C", "email": "c"},
+                     {"name": "D", "email": "d", "products": [3, 4]}]
+        self.app.post("{}/bulk".format(BASE_URL), json=suppliers,
+                      content_type=CONTENT_TYPE_JSON)
+
+        def names(query):
+            resp = self.app.get("{}?{}".format(BASE_URL, query))
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            return [s["name"] for s in resp.get_json()["suppliers"]]
+
+        self.assertEqual(names("product_id=2"), ["A", "B"])
+        self.assertEqual(names("product_id=2,4"), ["A", "B", "D"])
+        self.assertEqual(names("product_id=2&product_id=4"), ["A", "B", "D"])
+        self.assertEqual(names("product_id=2,3&match=all"), ["A"])
+        self.assertEqual(names("product_id=9"), [])
+
+        for query in ("product_id=x", "product_id=99999999999",
+                      "product_id=1,-2147483649", "ids=2147483648"):
+            resp = self.app.get("{}?{}".format(BASE_URL, query))
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST,
+                             query)
+        self.assertEqual(names("product_id=2147483647"), [])
+        resp = self.app.get("{}?product_id=1&match=some".format(BASE_URL))
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_cache_stats(self):
+        """ Read the supplier cache counters """
+        hits = self.app.get("/internal/cache").get_json()["hits"]
+        resp = self.app.post(
+            BASE_URL, json={"name": "TOM", "email": "a0"},
+            content_type=CONTENT_TYPE_JSON
+        )
+        self.app.put("{}/{}".format(BASE_URL, resp.json["id"]), json={},
+                     content_type=CONTENT_TYPE_JSON)
+        resp = self.app.get("/internal/cache")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        stats = resp.get_json()
+        self.assertEqual(stats["backend"], "LRUCache")
+        self.assertEqual(stats["hits"], hits + 1)
+        self.assertEqual(stats["size"], 1)
+
+    def test_read_supplier(self):
+        """ Read a supplier and revalidate it with its ETag """
+        resp = self.app.post(
+            BASE_URL, json={"name": "TOM", "email": "a0"},
+            content_type=CONTENT_TYPE_JSON
+        )
+        self.assertEqual(resp.headers["ETag"], '"1"')
+        url = "{}/{}".format(BASE_URL, resp.json["id"])
+
+        resp = self.app.get(url)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.json["name"], "TOM")
+        self.assertEqual(resp.json["version"], 1)
+        etag = resp.headers["ETag"]
+
+        resp = self.app.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(resp.data, b"")
+        self.assertEqual(resp.headers["ETag"], etag)
+
+        self.app.put(url, json={"email": "b0"},
+                     content_type=CONTENT_TYPE_JSON)
+        resp = self.app.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.headers["ETag"], '"2"')
+
+        resp = self.app.get("{}/0".format(BASE_URL))
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_update_supplier_if_match(self):
+        """ Update a supplier only if it is at the expected version """
+        resp = self.app.post(
+            BASE_URL, json={"name": "TOM", "email": "a0"},
+            content_type=CONTENT_TYPE_JSON
+        )
+        url = "{}/{}".format(BASE_URL, resp.json["id"])
+        etag = resp.headers["ETag"]
+
+        resp = self.app.put(url, json={"email": "b0"},
+                            headers={"If-Match": etag},
+                            content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.headers["ETag"], '"2"')
+
+        # the old ETag no longer matches
+        for if_match in (etag, 'W/"2"', '"x"', '"1", "2"'):
+            resp = self.app.put(url, json={"email": "c0"},
+                                headers={"If-Match": if_match},
+                                content_type=CONTENT_TYPE_JSON)
+            self.assertEqual(resp.status_code,
+                             status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(self.app.get(url).json["email"], "b0")
+
+        resp = self.app.put(url, json={"email": "c0"},
+                            headers={"If-Match": "*"},
+                            content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.json["version"], 3)
+
+    def test_pool_stats(self):
+        """ Read the database pool statistics """
+        resp = self.app.get("/internal/pool")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        stats = resp.get_json()
+        self.assertEqual(stats["pool"], "TimedQueuePool")
+        self.assertIn("checked_out", stats)
+        self.assertIn("checkout_wait_max_ms", stats)
+
+    def test_requests_release_their_connection(self):
+        """ A request returns its connection, even after a failed statement """
+        self.app.get(BASE_URL)
+        resp = self.app.get("/internal/pool")
+        self.assertEqual(resp.get_json()["checked_out"], 0)
+
+        def time_out(*args, **kwargs):
+            db.session.execute("SET LOCAL statement_timeout = 10")
+            db.session.execute("SELECT pg_sleep(1)")
+        with mock.patch.object(Supplier, "find_record", time_out):
+            self.assertRaises(OperationalError, self.app.get,
+                              "{}/1".format(BASE_URL))
+        resp = self.app.get(BASE_URL)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.app.get("/internal/pool")
+                         .get_json()["checked_out"], 0)
+
+    def test_metrics(self):
+        """ Read the Prometheus metrics """
+        resp = self.app.post(
+            BASE_URL, json={"name": "TOM", "email": "a0"},
+            content_type=CONTENT_TYPE_JSON
+        )
+        self.app.get("{}/{}".format(BASE_URL, resp.json["id"]))
+        self.app.get("/no/such/page")
+        resp = self.app.get("/metrics")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertTrue(resp.content_type.startswith("text/plain"))
+        text = resp.data.decode()
+        self.assertIn('supplier_http_requests_total{method="POST",'
+                      'route="/suppliers",status="201"}', text)
+        self.assertIn('supplier_http_requests_total{method="GET",'
+                      'route="/suppliers/<int:supplier_id>",status="200"}',
+                      text)
+        self.assertIn('supplier_http_requests_total{method="GET",'
+                      'route="<unmatched>",status="404"}', text)
+        self.assertIn('supplier_http_request_duration_seconds_bucket'
+                      '{le="0.001",method="POST",route="/suppliers"}', text)
+        self.assertIn('supplier_db_statements_per_request_count'
+                      '{route="/suppliers"}', text)
+        self.assertIn('supplier_db_time_per_request_seconds_sum'
+                      '{route="/suppliers"}', text)
+
+    def test_sparse_fieldsets(self):
+        """ Read only some fields, without SELECTing the others """
+        statements = []
+
+        def capture(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        suppliers = [{"name": "TOM", "email": "a", "products": [1, 2]},
+                     {"name": "ANN", "email": "b", "products": [3]}]
+        self.app.post("{}/bulk".format(BASE_URL), json=suppliers,
+                      content_type=CONTENT_TYPE_JSON)
+        Supplier.cache.clear()
+        event.listen(db.engine, "before_cursor_execute", capture)
+        try:
+            resp = self.app.get("{}?fields=name".format(BASE_URL))
+            self.assertEqual(resp.get_json()["suppliers"],
+                             [{"id": 1, "name": "TOM"},
+                              {"id": 2, "name": "ANN"}])
+            resp = self.app.get("{}/1?fields=name,email".format(BASE_URL))
+            self.assertEqual(resp.get_json(),
+                             {"id": 1, "name": "TOM", "email": "a"})
+            self.assertEqual(resp.headers["ETag"], '"1-id,name,email"')
+            resp = self.app.get(
+                "{}/export?format=csv&fields=email".format(BASE_URL))
+            self.assertEqual(resp.data.decode().splitlines(),
+                             ["id,email", "1,a", "2,b"])
+        finally:
+            event.remove(db.engine, "before_cursor_execute", capture)
+        self.assertEqual(len(statements), 3)
+        for statement in statements:
+            self.assertNotIn("products", statement)
+
+        resp = self.app.get("{}?fields=secret".format(BASE_URL))
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_update_suppliers_bulk(self):
+        """ Update several suppliers with one PATCH """
+        self.addCleanup(app.config.__setitem__, "BULK_CHUNK_SIZE",
+                        app.config["BULK_CHUNK_SIZE"])
+        app.config["BULK_CHUNK_SIZE"] = 3
+        suppliers = [{"name": "S{}".format(i), "email": "s{}".format(i),
+                      "products": [i + 1]} for i in range(4)]
+        resp = self.app.post("{}/bulk".format(BASE_URL), json=suppliers,
+                             content_type=CONTENT_TYPE_JSON)
+        ids = [result["id"] for result in resp.get_json()["results"]]
+        self.app.get("{}/{}".format(BASE_URL, ids[0]))  # cache it
+
+        changes = [
+            {"id": ids[0], "name": "NEW", "products": [7, 8]},
+            {"id": ids[1], "email": None, "address": "nyc"},
+            {"id": 0, "name": "GHOST"},
+            {"id": ids[2], "name": "OLD", "version": 5},
+            {"id": ids[3], "products": ["x"]},
+            {"id": ids[1], "name": "TWICE"},
+            {"name": "NO ID"},
+            {"id": ids[3]},
+        ]
+        resp = self.app.patch(BASE_URL, json=changes,
+                              content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        body = resp.get_json()
+        self.assertEqual([r["status"] for r in body["results"]],
+                         [200, 200, 404, 412, 400, 400, 400, 400])
+        self.assertEqual((body["updated"], body["not_found"],
+                          body["conflicts"], body["failed"]), (2, 1, 1, 4))
+
+        first = self.app.get("{}/{}".format(BASE_URL, ids[0])).get_json()
+        self.assertEqual((first["name"], first["email"], first["products"],
+                          first["version"]), ("NEW", "s0", [7, 8], 2))
+        second = self.app.get("{}/{}".format(BASE_URL, ids[1])).get_json()
+        self.assertEqual((second["email"], second["address"]), (None, "nyc"))
+        third = self.app.get("{}/{}".format(BASE_URL, ids[2])).get_json()
+        self.assertEqual((third["name"], third["version"]), ("S2", 1))
+
+    def test_update_suppliers_bulk_rejected_values(self):
+        """ Values rejected by Postgres only fail their own items """
+        resp = self.app.post(
+            "{}/bulk".format(BASE_URL),
+            json=[{"name": "A", "email": "a"}, {"name": "B", "email": "b"}],
+            content_type=CONTENT_TYPE_JSON)
+        ids = [result["id"] for result in resp.get_json()["results"]]
+        resp = self.app.patch(
+            BASE_URL, json=[{"id": ids[0], "email": None},
+                            {"id": ids[1], "name": "x" * 100}],
+            content_type=CONTENT_TYPE_JSON)
+        self.assertEqual([r["status"] for r in resp.get_json()["results"]],
+                         [400, 400])
+        resp = self.app.patch(
+            BASE_URL, json=[{"id": ids[0], "email": None},
+                            {"id": ids[1], "name": "BEE"}],
+            content_type=CONTENT_TYPE_JSON)
+        self.assertEqual([r["status"] for r in resp.get_json()["results"]],
+                         [400, 200])
+        resp = self.app.get("{}/{}".format(BASE_URL, ids[1]))
+        self.assertEqual(resp.get_json()["name"], "BEE")
+
+    def test_patch_supplier(self):
+        """ Change one field in a single UPDATE without reading the row """
+        resp = self.app.post(BASE_URL, json={"name": "TOM", "email": "a",
+                                             "products": [1, 2, 3]},
+                             content_type=CONTENT_TYPE_JSON)
+        supplier_id = resp.get_json()["id"]
+        url = "{}/{}".format(BASE_URL, supplier_id)
+        self.app.get(url)  # cache it
+        statements = []
+
+        def capture(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", capture)
+        try:
+            resp = self.app.patch(url, json={"email": "b"},
+                                  content_type=CONTENT_TYPE_JSON)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", capture)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(),
+                         {"id": supplier_id, "version": 2, "email": "b"})
+        self.assertEqual(resp.headers["ETag"], '"2"')
+        self.assertEqual(len(statements), 1)
+        self.assertTrue(statements[0].startswith("UPDATE"))
+        self.assertNotIn("products", statements[0])
+
+        resp = self.app.get(url)
+        supplier = resp.get_json()
+        self.assertEqual(
+            (supplier["email"], supplier["name"], supplier["products"]),
+            ("b", "TOM", [1, 2, 3]))
+        resp = self.app.patch("{}?fields=name".format(url),
+                              json={"address": "nyc"},
+                              headers={"If-Match": '"2"'},
+                              content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.get_json(), {"id": supplier_id, "version": 3,
+                                           "address": "nyc", "name": "TOM"})
+
+    def test_patch_supplier_errors(self):
+        """ Partial updates check the supplied fields and preconditions """
+        resp = self.app.post(BASE_URL, json={"name": "TOM", "email": "a"},
+                             content_type=CONTENT_TYPE_JSON)
+        url = "{}/{}".format(BASE_URL, resp.get_json()["id"])
+        for body in ({"name": None}, {"products": ["x"]}, {"email": None},
+                     {"name": "x" * 100}, {"unknown": 1}, []):
+            resp = self.app.patch(url, json=body,
+                                  content_type=CONTENT_TYPE_JSON)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST,
+                             body)
+        resp = self.app.patch(url, json={"name": "A"},
+                              headers={"If-Match": '"5"'},
+                              content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code,
+                         status.HTTP_412_PRECONDITION_FAILED)
+        resp = self.app.patch("{}/0".format(BASE_URL), json={"name": "A"},
+                              content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.app.get(url).get_json()["version"], 1)
+
+    def test_add_and_remove_products(self):
+        """ Add and remove product ids server-side """
+        resp = self.app.post(BASE_URL, json={"name": "TOM", "email": "a",
+                                             "products": [5, 1]},
+                             content_type=CONTENT_TYPE_JSON)
+        supplier_id = resp.get_json()["id"]
+        url = "{}/{}".format(BASE_URL, supplier_id)
+        self.app.get(url)  # cache it
+
+        resp = self.app.post(url + "/products",
+                             json={"products": [3, 1, 3, 9]},
+                             content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(),
+                         {"id": supplier_id, "added": 2, "version": 2})
+        self.assertEqual(resp.headers["ETag"], '"2"')
+        self.assertEqual(self.app.get(url).get_json()["products"],
+                         [5, 1, 3, 9])
+
+        resp = self.app.post(url + "/products", json={"products": [9, 5]},
+                             content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.get_json()["added"], 0)
+        self.assertEqual(resp.get_json()["version"], 2)
+
+        resp = self.app.delete(url + "/products",
+                               json={"products": [5, 3, 42]},
+                               headers={"If-Match": '"2"'},
+                               content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.get_json(),
+                         {"id": supplier_id, "removed": 2, "version": 3})
+        self.assertEqual(self.app.get(url).get_json()["products"], [1, 9])
+
+    def test_add_and_remove_products_errors(self):
+        """ Product changes check the ids, the supplier and If-Match """
+        resp = self.app.post(BASE_URL, json={"name": "TOM", "email": "a"},
+                             content_type=CONTENT_TYPE_JSON)
+        url = "{}/{}/products".format(BASE_URL, resp.get_json()["id"])
+        for body in ({"products": [0]}, {"products": ["x"]},
+                     {"products": []}, {"products": 1}, [1], {},
+                     {"products": [99999999999]}, {"products": [2 ** 31]}):
+            resp = self.app.post(url, json=body,
+                                 content_type=CONTENT_TYPE_JSON)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST,
+                             body)
+            resp = self.app.delete(url, json=body,
+                                   content_type=CONTENT_TYPE_JSON)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST,
+                             body)
+        resp = self.app.post(url, json={"products": [1]},
+                             headers={"If-Match": '"7"'},
+                             content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code,
+                         status.HTTP_412_PRECONDITION_FAILED)
+        resp = self.app.post(url, data="1", content_type="text/plain")
+        self.assertEqual(resp.status_code,
+                         status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        resp = self.app.delete("{}/0/products".format(BASE_URL),
+                               json={"products": [1]},
+                               content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        # a supplier without products gets its first ones
+        resp = self.app.post(url, json={"products": [4]},
+                             content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.get_json()["added"], 1)
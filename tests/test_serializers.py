@@ -0,0 +1,55 @@
+"""
+Test cases for the JSON serializers
+"""
+import json
+import unittest
+from werkzeug.exceptions import BadRequest
+from service.serializers import Serializer, BACKENDS, parse_fields
+
+PAYLOAD = {"id": 1, "name": "Tom", "email": None, "products": [1, 2, 3]}
+
+
+######################################################################
+#  S E R I A L I Z E R   T E S T   C A S E S
+######################################################################
+class TestSerializer(unittest.TestCase):
+    """Test Cases for Serializer"""
+
+    def test_json_backend(self):
+        """The standard library backend is compact"""
+        serializer = Serializer("json")
+        self.assertEqual(serializer.dumps(PAYLOAD),
+                         b'{"id":1,"name":"Tom","email":null,'
+                         b'"products":[1,2,3]}')
+
+    @unittest.skipUnless("orjson" in BACKENDS, "orjson is not installed")
+    def test_orjson_backend(self):
+        """The orjson backend encodes the same JSON"""
+        serializer = Serializer("orjson")
+        self.assertEqual(json.loads(serializer.dumps(PAYLOAD)), PAYLOAD)
+        self.assertEqual(Serializer("auto").backend, "orjson")
+
+    def test_unknown_backend(self):
+        """Asking for a backend that is not available fails"""
+        self.assertRaises(ValueError, Serializer, "simplejson")
+
+    def test_response(self):
+        """Responses carry the encoded payload as application/json"""
+        response = Serializer().response(PAYLOAD, 201)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.mimetype, "application/json")
+        self.assertEqual(json.loads(response.get_data()), PAYLOAD)
+
+
+class TestParseFields(unittest.TestCase):
+    """Test Cases for parse_fields"""
+
+    def test_parse_fields(self):
+        """Fieldsets always start with the id"""
+        allowed = ("id", "name", "email")
+        self.assertIsNone(parse_fields(None, allowed))
+        self.assertIsNone(parse_fields("", allowed))
+        self.assertEqual(parse_fields("name", allowed), ["id", "name"])
+        self.assertEqual(parse_fields("email, id,email", allowed),
+                         ["id", "email"])
+        self.assertRaises(BadRequest, parse_fields, "name,secret", allowed)